@@ -20,6 +20,11 @@ from django.http.multipartparser import MultiPartParserError
 from django.http.request import MultiValueDict
 from django.http.request import QueryDict
 
+from rest_framework import pagination
+
+from idgo_admin import API_MAX_PAGE_SIZE
+from idgo_admin import API_PAGE_SIZE
+
 
 def parse_request(request):
     if request.content_type.startswith('multipart/form-data'):
@@ -36,3 +41,41 @@ def parse_request(request):
         return QueryDict(request.body, encoding=request._encoding, mutable=True), MultiValueDict()
     else:
         return QueryDict(encoding=request._encoding, mutable=True), MultiValueDict()
+
+
+class CursorPagination(pagination.CursorPagination):
+    """Pagination par curseur des listes de l'API (`?cursor=` et `?limit=`).
+
+    La pagination n'est appliquée que si l'un de ces paramètres est passé,
+    de sorte que les clients existants reçoivent toujours la liste complète.
+    Les liens vers les pages suivante et précédente sont retournés dans
+    l'en-tête `Link`.
+    """
+
+    ordering = 'pk'
+    page_size = API_PAGE_SIZE
+    page_size_query_param = 'limit'
+    max_page_size = API_MAX_PAGE_SIZE
+
+    def get_page_size(self, request):
+        if self.page_size_query_param not in request.query_params \
+                and self.cursor_query_param not in request.query_params:
+            return None
+        return super().get_page_size(request)
+
+    def get_link_header(self):
+        links = (
+            ('next', self.get_next_link()),
+            ('prev', self.get_previous_link()),
+            )
+        return ', '.join(
+            '<%s>; rel="%s"' % (link, rel) for rel, link in links if link)
+
+
+def paginate(request, queryset, view=None):
+    """Retourner la page demandée de `queryset` et l'en-tête `Link`."""
+    paginator = CursorPagination()
+    page = paginator.paginate_queryset(queryset, request, view=view)
+    if page is None:
+        return queryset, None
+    return page, paginator.get_link_header()
@@ -20,9 +20,11 @@ import xml.etree.ElementTree as ET
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.db import transaction
+from django.db.models import Q
 from django.http import Http404
 from django.http import HttpResponse
 from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
 
 from rest_framework import permissions
 from rest_framework.views import APIView
@@ -35,11 +37,13 @@ from idgo_admin.models import Category
 from idgo_admin.models import Dataset
 from idgo_admin.models import DataType
 from idgo_admin.models import License
+from idgo_admin.models import LiaisonsReferents
 from idgo_admin.models.mail import send_dataset_creation_mail
 from idgo_admin.models.mail import send_dataset_delete_mail
 from idgo_admin.models.mail import send_dataset_update_mail
 from idgo_admin.models import Organisation
 
+from api.utils import paginate
 from api.utils import parse_request
 
 
@@ -108,15 +112,32 @@ def serialize(dataset):
     ])
 
 
-def handler_get_request(request):
+def handler_get_request(request, serializing=True):
+    """Retourner les jeux de données visibles par l'utilisateur.
+
+    Si `serializing` est vrai, les relations utilisées par `serialize()`
+    sont chargées avec le jeu de requêtes (et non pour chaque jeu de données).
+    """
     user = request.user
+    datasets = Dataset.objects.all()
+    if serializing:
+        datasets = datasets.select_related(
+            'organisation', 'license', 'granularity',
+            ).prefetch_related(
+            'keywords', 'categories', 'data_type')
+
     if user.profile.is_admin:
-        datasets = Dataset.objects.all()
-    else:
-        s1 = set(Dataset.objects.filter(organisation__in=user.profile.referent_for))
-        s2 = set(Dataset.objects.filter(editor=user))
-        datasets = list(s1 | s2)
-    return datasets
+        return datasets
+
+    organisations = LiaisonsReferents.objects.filter(
+        profile=user.profile, validated_on__isnull=False
+        ).values('organisation')
+    return datasets.filter(Q(organisation__in=organisations) | Q(editor=user))
+
+
+def get_dataset_or_404(request, dataset_name, serializing=False):
+    return get_object_or_404(
+        handler_get_request(request, serializing=serializing), slug=dataset_name)
 
 
 def handle_pust_request(request, dataset_name=None):
@@ -128,12 +149,7 @@ def handle_pust_request(request, dataset_name=None):
     user = request.user
     dataset = None
     if dataset_name:
-        for instance in handler_get_request(request):
-            if instance.slug == dataset_name:
-                dataset = instance
-                break
-        if not instance:
-            raise Http404()
+        dataset = get_dataset_or_404(request, dataset_name)
 
     query_data = getattr(request, request.method)  # QueryDict
 
@@ -306,11 +322,8 @@ class DatasetShow(APIView):
 
     def get(self, request, dataset_name):
         """Voir le jeu de données."""
-        datasets = handler_get_request(request)
-        for dataset in datasets:
-            if dataset.slug == dataset_name:
-                return JsonResponse(serialize(dataset), safe=True)
-        raise Http404()
+        dataset = get_dataset_or_404(request, dataset_name, serializing=True)
+        return JsonResponse(serialize(dataset), safe=True)
 
     def put(self, request, dataset_name):
         """Modifier le jeu de données."""
@@ -326,13 +339,7 @@ class DatasetShow(APIView):
 
     def delete(self, request, dataset_name):
         """Supprimer le jeu de données."""
-        instance = None
-        for dataset in handler_get_request(request):
-            if dataset.slug == dataset_name:
-                instance = dataset
-                break
-        if not instance:
-            raise Http404()
+        instance = get_dataset_or_404(request, dataset_name)
         instance.delete(current_user=request.user)
         send_dataset_delete_mail(request.user, instance)
         return HttpResponse(status=204)
@@ -347,9 +354,12 @@ class DatasetList(APIView):
     def get(self, request):
         """Voir les jeux de données."""
 
-        datasets = handler_get_request(request)
-        return JsonResponse(
+        datasets, link = paginate(request, handler_get_request(request), view=self)
+        response = JsonResponse(
             [serialize(dataset) for dataset in datasets], safe=False)
+        if link:
+            response['Link'] = link
+        return response
 
     def post(self, request):
         """Créer un nouveau jeu de données."""
@@ -373,12 +383,8 @@ class DatasetMDShow(APIView):
 
     def get(self, request, dataset_name):
         """Voir la fiche de metadonnées du jeu de données."""
-        instance = None
-        for dataset in handler_get_request(request):
-            if dataset.slug == dataset_name:
-                instance = dataset
-                break
-        if not instance or (instance and not instance.geonet_id):
+        instance = get_dataset_or_404(request, dataset_name)
+        if not instance.geonet_id:
             raise Http404()
         try:
             record = geonet.get_record(str(instance.geonet_id))
@@ -392,13 +398,7 @@ class DatasetMDShow(APIView):
         request.PUT, _ = parse_request(request)
         request.PUT._mutable = True
 
-        instance = None
-        for dataset in handler_get_request(request):
-            if dataset.slug == dataset_name:
-                instance = dataset
-                break
-        if not instance:
-            raise Http404()
+        dataset = get_dataset_or_404(request, dataset_name)
 
         root = ET.fromstring(request.PUT.get('xml'))
         ns = {'gmd': 'http://www.isotc211.org/2005/gmd',
@@ -14,6 +14,7 @@
 # under the License.
 
 
+from collections import defaultdict
 from collections import OrderedDict
 from functools import reduce
 from operator import iand
@@ -44,15 +45,30 @@ from idgo_admin.models import LiaisonsReferents
 from idgo_admin.models import Organisation
 from idgo_admin.models import Profile
 
+from api.utils import paginate
 from api.utils import parse_request
 
 
-def serialize(user):
+def serialize(user, referent_for=None, contribute_for=None):
+    """Sérialiser l'utilisateur.
+
+    Les organisations pour lesquelles l'utilisateur est référent ou
+    contributeur peuvent être passées, sous la forme de listes de couples
+    (slug, legal_name) ; sinon elles sont lues depuis le profil.
+    """
 
     def nullify(m):
         return m or None
 
     try:
+        if referent_for is None:
+            referent_for = [
+                (organisation.slug, organisation.legal_name)
+                for organisation in user.profile.strict_referent_for]
+        if contribute_for is None:
+            contribute_for = [
+                (organisation.slug, organisation.legal_name)
+                for organisation in user.profile.contribute_for]
         return OrderedDict([
             # Information de base sur l'utilisateur
             ('username', user.username),
@@ -67,14 +83,14 @@ def serialize(user):
                 ]) or None),
             # Listes des organisations pour lesquelles l'utilisateur est référent
             ('referent', nullify([OrderedDict([
-                ('name', organisation.slug),
-                ('legal_name', organisation.legal_name)
-                ]) for organisation in user.profile.strict_referent_for])),
+                ('name', slug),
+                ('legal_name', legal_name)
+                ]) for slug, legal_name in referent_for])),
             # Listes des organisations pour lesquelles l'utilisateur est contributeur
             ('contribute', nullify([OrderedDict([
-                ('name', organisation.slug),
-                ('legal_name', organisation.legal_name)
-                ]) for organisation in user.profile.contribute_for]))
+                ('name', slug),
+                ('legal_name', legal_name)
+                ]) for slug, legal_name in contribute_for]))
             ])
     except Exception as e:
         if e.__class__.__name__ == 'RelatedObjectDoesNotExist':
@@ -82,6 +98,36 @@ def serialize(user):
         raise e
 
 
+def serialize_many(users):
+    """Sérialiser les utilisateurs.
+
+    Les liaisons de tous les utilisateurs sont lues en deux requêtes
+    (référents et contributeurs) puis regroupées par profil.
+    """
+    users = list(users)
+    profiles = [user.profile.pk for user in users]
+
+    def get_liaisons(model):
+        liaisons = defaultdict(list)
+        queryset = model.objects.filter(
+            profile__in=profiles, validated_on__isnull=False
+            ).order_by('organisation__slug').values_list(
+            'profile_id', 'organisation__slug', 'organisation__legal_name')
+        for profile_id, slug, legal_name in queryset:
+            liaisons[profile_id].append((slug, legal_name))
+        return liaisons
+
+    referents = get_liaisons(LiaisonsReferents)
+    contributors = get_liaisons(LiaisonsContributeurs)
+
+    return [
+        serialize(
+            user,
+            referent_for=referents[user.profile.pk],
+            contribute_for=contributors[user.profile.pk])
+        for user in users]
+
+
 def user_list(order_by='last_name', or_clause=None, **and_clause):
 
     and_clause.update({'profile__pk__isnull': False})
@@ -93,11 +139,15 @@ def user_list(order_by='last_name', or_clause=None, **and_clause):
     else:
         filter = reduce(iand, l1)
 
-    return [serialize(user) for user in User.objects.filter(filter).order_by(order_by)]
+    return User.objects.filter(filter).select_related(
+        'profile', 'profile__organisation').order_by(order_by)
 
 
 def handler_get_request(request):
     qs = request.GET.dict()
+    # Paramètres de pagination (cf. `api.utils.paginate`)
+    qs.pop('cursor', None)
+    qs.pop('limit', None)
     or_clause = dict()
 
     user = request.user
@@ -248,11 +298,8 @@ class UserShow(APIView):
         ]
 
     def get(self, request, username):
-        data = handler_get_request(request)
-        for item in data:
-            if item['username'] == username:
-                return JsonResponse(item, safe=True)
-        raise Http404()
+        user = get_object_or_404(handler_get_request(request), username=username)
+        return JsonResponse(serialize_many([user])[0], safe=True)
 
     def put(self, request, username):
         """Mettre à jour un utilisateur."""
@@ -278,8 +325,11 @@ class UserList(APIView):
     def get(self, request):
         if not hasattr(request.user, 'profile'):
             raise Http404()
-        data = handler_get_request(request)
-        return JsonResponse(data, safe=False)
+        users, link = paginate(request, handler_get_request(request), view=self)
+        response = JsonResponse(serialize_many(users), safe=False)
+        if link:
+            response['Link'] = link
+        return response
 
     def post(self, request):
         """Créer un utilisateur."""
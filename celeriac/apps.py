@@ -26,6 +26,7 @@ import os  # noqa
 import importlib  # noqa
 
 from celery import Celery  # noqa
+from celery.schedules import crontab  # noqa
 
 from django.conf import settings  # noqa E402
 
@@ -43,6 +44,23 @@ else:
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 
+# Planification par défaut de la copie des statistiques CKAN (`None` pour
+# la désactiver) ; une entrée `sync-ckan-statistics` de `beat_schedule`
+# définie dans les paramètres Celery est prioritaire.
+try:
+    CKAN_STATISTICS_SCHEDULE = settings.CELERIAC_CKAN_STATISTICS_SCHEDULE
+except AttributeError:
+    CKAN_STATISTICS_SCHEDULE = {'minute': 0, 'hour': 4}
+
+
 app = Celery('celeriac')
 app.config_from_object('django.conf:settings', namespace=CELERY_NAMESPACE)
 app.autodiscover_tasks()
+
+if CKAN_STATISTICS_SCHEDULE:
+    app.conf.beat_schedule = dict({
+        'sync-ckan-statistics': {
+            'task': 'celeriac.tasks.sync_ckan_statistics',
+            'schedule': crontab(**CKAN_STATISTICS_SCHEDULE),
+            },
+        }, **(app.conf.beat_schedule or {}))
@@ -14,8 +14,12 @@
 # under the License.
 
 
+from collections import defaultdict
+from concurrent.futures import as_completed
+from concurrent.futures import ThreadPoolExecutor
 import csv
 from dateutil.relativedelta import relativedelta
+from itertools import chain
 from io import StringIO
 import json
 from uuid import UUID
@@ -26,13 +30,20 @@ from celery.signals import before_task_publish
 from celery.signals import task_postrun
 from celery.utils.log import get_task_logger
 
+from django.apps import apps
 from django.core.mail import EmailMessage
+from django.db.models import Max
+from django.utils.dateparse import parse_datetime
 from django.utils import timezone
 
 from idgo_admin.ckan_module import CkanHandler
+from idgo_admin import harvest
+from idgo_admin import outbox
 from idgo_admin.models import AccountActions
 from idgo_admin.models import AsyncExtractorTask
 from idgo_admin.models import Category
+from idgo_admin.models import Dataset
+from idgo_admin.models import DatasetStatistics
 from idgo_admin.models import LiaisonsContributeurs
 from idgo_admin.models import LiaisonsReferents
 from idgo_admin.models import Mail
@@ -58,6 +69,8 @@ if ENABLE_DCAT_HARVESTER:
 
 from idgo_admin import DEFAULT_FROM_EMAIL
 from idgo_admin import ENABLE_SENDING_MAIL
+from idgo_admin import HARVEST_MAX_RETRIES
+from idgo_admin import HARVEST_RETRY_COUNTDOWN
 from idgo_admin import IDGO_ADMIN_HARVESTER_USER
 
 
@@ -70,8 +83,10 @@ logger = get_task_logger(__name__)
 
 @before_task_publish.connect
 def on_beforehand(headers=None, body=None, sender=None, **kwargs):
-    TaskTracking.objects.create(
-        uuid=UUID(body.get('id')), task=body.get('task'), detail=body)
+    # Une nouvelle tentative (`retry`) est publiée avec le même identifiant
+    TaskTracking.objects.update_or_create(
+        uuid=UUID(body.get('id')),
+        defaults={'task': body.get('task'), 'detail': body, 'state': 'running'})
 
 
 @task_postrun.connect
@@ -80,6 +95,7 @@ def on_task_postrun(state=None, task_id=None, task=None,
     ttracking = TaskTracking.objects.get(uuid=UUID(task_id))
 
     ttracking.state = {
+        'RETRY': 'running',
         'UNKNOWN': 'unknown',
         'FAILURE': 'failed',
         'SUCCESS': 'succesful',
@@ -104,6 +120,20 @@ def clean_tasktracking_table(*args, **kwargs):
     TaskTracking.objects.filter(**kwargs).delete()
 
 
+@celery_app.task()
+def drain_outbox(*args, limit=100, **kwargs):
+    """Traiter les messages en attente de l'outbox (CKAN, MRA, GeoNetwork).
+
+    La tâche est déclenchée à la validation de chaque transaction qui
+    enregistre un message ; elle doit également être planifiée de manière
+    périodique afin de traiter les nouvelles tentatives.
+    """
+
+    count = outbox.drain(limit=limit)
+    if count:
+        logger.info("%d outbox message(s) processed." % count)
+
+
 @celery_app.task()
 def save_resource(*args, pk=None, **kwargs):
     """Sauvegarder une resource."""
@@ -144,52 +174,162 @@ def sync_extractor_tasks():
 
 
 @celery_app.task()
-def sync_remote_catalogs(*args, **kwargs):
-    """Synchroniser les catalogues distants."""
+def sync_remote_catalogs(*args, force=False, **kwargs):
+    """Planifier la synchronisation des catalogues distants.
 
-    for RemoteCatalog in RemoteCatalogs:
-        for remote in RemoteCatalog.objects.filter(**kwargs):
-            logger.info("Start synchronize remote instance %s %d (%s)" % (
-                remote.__class__.__qualname__, remote.pk, remote.url))
-            try:
-                remote.save()
-            except Exception as e:
-                logger.exception(e)
+    Une tâche `sync_remote_catalog` est lancée pour chaque catalogue dont
+    la fréquence de synchronisation est échue (ou pour tous si `force`).
+    """
+
+    if force:
+        remotes = [
+            remote for RemoteCatalog in RemoteCatalogs
+            for remote in RemoteCatalog.objects.filter(**kwargs)]
+    else:
+        remotes = harvest.get_due_remotes(**kwargs)
+
+    for remote in remotes:
+        sync_remote_catalog.delay(remote.__class__.__qualname__, remote.pk)
+
+
+@celery_app.task(bind=True, max_retries=HARVEST_MAX_RETRIES)
+def sync_remote_catalog(self, model_name, pk, *args, **kwargs):
+    """Synchroniser un catalogue distant.
+
+    Si le moissonnage n'est pas possible pour le moment (catalogue en
+    cours de moissonnage ou limite de concurrence atteinte), la tâche est
+    relancée après `HARVEST_RETRY_COUNTDOWN` secondes, au plus
+    `HARVEST_MAX_RETRIES` fois.
+    """
+
+    Model = apps.get_model(app_label='idgo_admin', model_name=model_name)
+    try:
+        remote = Model.objects.get(pk=pk)
+    except Model.DoesNotExist as e:
+        logger.warning(e)
+        return
+
+    try:
+        harvest.harvest(remote)
+    except harvest.HarvestUnavailable as e:
+        logger.warning(e)
+        # Au-delà du nombre de tentatives, l'exception est levée et le
+        # catalogue sera repris lors de la prochaine planification
+        raise self.retry(exc=e, countdown=HARVEST_RETRY_COUNTDOWN)
+    except Exception as e:
+        logger.exception(e)
 
 
 @celery_app.task()
-def sync_ckan_allowed_users_by_resource(*args, **kwargs):
+def sync_ckan_allowed_users_by_resource(*args, max_workers=8, **kwargs):
     """Synchroniser `ckan-restricted` pour le cas particuliers
     des autorisations par organisation.
-    """
-
-    def get_all_users_for_organisations(organisation__in):
-        filter = {'organisation__in': organisation__in,
-                  'organisation__is_active': True}
-        return [profile.user.username
-                for profile in Profile.objects.filter(**filter)]
 
-    for resource in Resource.objects.exclude(organisations_allowed=None):
-        dataset = resource.dataset
+    Les listes d'utilisateurs sont calculées pour toutes les ressources en
+    quelques requêtes ; seules les ressources dont la liste a changé depuis
+    le dernier envoi sont mises à jour dans CKAN.
+    """
 
-        organisation__in = [r.pk for r in resource.organisations_allowed.all()]
-        allowed_users = get_all_users_for_organisations(organisation__in)
-        restricted = {
-            'allowed_users': ','.join(allowed_users),
-            'level': 'only_allowed_users'}
+    resources = list(
+        Resource.objects.exclude(organisations_allowed=None).filter(**kwargs)
+        .distinct().values_list('pk', 'ckan_id', 'ckan_restricted'))
+
+    organisations_by_resource = defaultdict(set)
+    for resource_id, organisation_id in \
+            Resource.organisations_allowed.through.objects.filter(
+                resource__in=[pk for pk, _, _ in resources]
+                ).values_list('resource_id', 'organisation_id'):
+        organisations_by_resource[resource_id].add(organisation_id)
+
+    usernames_by_organisation = defaultdict(set)
+    for organisation_id, username in Profile.objects.filter(
+            organisation__in=set(chain(*organisations_by_resource.values())),
+            organisation__is_active=True
+            ).values_list('organisation_id', 'user__username'):
+        usernames_by_organisation[organisation_id].add(username)
+
+    changes = {}
+    for pk, ckan_id, previous in resources:
+        allowed_users = set(chain(*(
+            usernames_by_organisation[organisation_id]
+            for organisation_id in organisations_by_resource[pk])))
+        restricted = json.dumps({
+            'allowed_users': ','.join(sorted(allowed_users)),
+            'level': 'only_allowed_users'})
+        if restricted != previous:
+            changes[pk] = (str(ckan_id), restricted)
+
+    logger.info("%d/%d resource(s) to update" % (len(changes), len(resources)))
+
+    def push(item):
+        pk, (ckan_id, restricted) = item
+        CkanHandler.patch_resource(ckan_id, restricted=restricted)
+        return pk
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(push, item): item[0] for item in changes.items()}
+        for future in as_completed(futures):
+            pk = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                logger.exception(e)
+                logger.info("Continue...")
+            else:
+                logger.info("Update 'restricted' for Resource '%d'" % pk)
+                Resource.objects.filter(pk=pk).update(
+                    ckan_restricted=changes[pk][1])
 
-        ckan_params = {
-            'id': str(resource.ckan_id),
-            'restricted': json.dumps(restricted)}
 
-        logger.info("Update 'restricted' for Resource '%d'" % resource.pk)
+@celery_app.task()
+def sync_ckan_statistics(*args, full=False, **kwargs):
+    """Recopier localement les statistiques de consultation et les notes
+    des jeux de données CKAN.
+
+    Les statistiques sont lues dans l'index de recherche de CKAN
+    (`package_search` restreint aux champs utiles, page par page). Seuls
+    les paquets réindexés par CKAN depuis la dernière exécution sont relus,
+    sauf si `full` est vrai. Les valeurs absentes de l'index sont conservées.
+    """
 
-        try:
-            package = CkanHandler.get_package(str(dataset.ckan_id))
-            CkanHandler.push_resource(package, **ckan_params)
-        except Exception as e:
-            logger.exception(e)
-            logger.info("Continue...")
+    search = {}
+    since = not full and DatasetStatistics.objects.aggregate(
+        Max('indexed_on'))['indexed_on__max']
+    if since:
+        search['fq'] = 'indexed_ts:[%s TO *]' % since.astimezone(
+            timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    # Champs de l'index -> champs de `DatasetStatistics`
+    fields = {
+        'views_total': ('views', int),
+        'views_recent': ('recent_views', int),
+        'downloads': ('downloads', int),
+        'rating': ('rating', float),
+        'ratings_count': ('ratings_count', int),
+        }
+
+    packages = {
+        package['id']: package
+        for package in CkanHandler.iter_packages(
+            fl=['id', 'indexed_ts'] + list(fields.keys()), **search)}
+
+    datasets = dict(
+        (str(ckan_id), pk) for ckan_id, pk in Dataset.objects.filter(
+            ckan_id__in=list(packages.keys()), **kwargs
+            ).values_list('ckan_id', 'pk'))
+
+    logger.info("%d dataset(s) to update" % len(datasets))
+
+    for ckan_id, pk in datasets.items():
+        package = packages[ckan_id]
+        defaults = {}
+        for name, (field, cast) in fields.items():
+            if package.get(name) not in (None, ''):
+                defaults[field] = cast(package[name])
+        indexed_on = package.get('indexed_ts') and parse_datetime(package['indexed_ts'])
+        DatasetStatistics.objects.update_or_create(
+            dataset_id=pk, defaults=dict(indexed_on=indexed_on or None, **defaults))
 
 
 @celery_app.task()
@@ -65,14 +65,25 @@ for KEY in MANDATORY:
         raise AssertionError("Missing mandatory parameter: %s" % e.__str__())
 
 OPTIONAL = (
+    ('API_PAGE_SIZE', 100),
+    ('API_MAX_PAGE_SIZE', 1000),
     ('HOST_INTERNAL', None),
     ('PORT_INTERNAL', None),
     ('HREF_WWW', None),
     ('CKAN_TIMEOUT', 36000),
+    ('CKAN_APIKEY_EXPIRATION', 300),
+    ('CKAN_USER_HANDLERS_MAXSIZE', 100),
+    ('CKAN_REFERENCE_EXPIRATION', 300),
     ('CSW_TIMEOUT', 36000),
+    ('CSW_PAGE_SIZE', 100),
+    ('CSW_MAX_WORKERS', 4),
     ('DCAT_TIMEOUT', 36000),
+    ('DCAT_PUBLISHERS_EXPIRATION', 3600),
     ('DATA_TRANSMISSION_SIZE_LIMITATION', 104857600),
     ('DATA_DOWNLOAD_TIMEOUT', 120),
+    ('REMOTE_CONNECT_TIMEOUT', 10),
+    ('REMOTE_READ_TIMEOUT', 300),
+    ('REMOTE_CACHE_DIR', None),
     ('DATAGIS_DB_EPSG', 4171),
     ('DEFAULT_PLATFORM_NAME', 'IDGO'),
     ('DEFAULT_CONTACT_EMAIL', 'contact@idgo.fr'),
@@ -87,6 +98,8 @@ OPTIONAL = (
     ('ENABLE_CSW_HARVESTER', True),
     ('ENABLE_CKAN_HARVESTER', True),
     ('ENABLE_DCAT_HARVESTER', False),
+    ('ENABLE_OUTBOX', False),
+    ('ENABLE_REMOTE_CACHE', True),
     ('EXTRACTOR_BOUNDS', [[40, -14], [55, 28]]),
     ('PHONE_REGEX', '^0\d{9}$'),
     ('FTP_URL', None),
@@ -95,10 +108,19 @@ OPTIONAL = (
     ('FTP_MECHANISM', ''),
     ('FTP_UPLOADS_DIR', 'uploads'),
     ('FTP_USER_PREFIX', ''),
+    ('HARVEST_LOCK_EXPIRATION', 36000),
+    ('HARVEST_MAX_CONCURRENCY', 4),
+    ('HARVEST_MAX_CONCURRENCY_PER_HOST', 1),
+    ('HARVEST_MAX_RETRIES', 12),
+    ('HARVEST_PAGE_SIZE', 100),
+    ('HARVEST_RETRY_COUNTDOWN', 300),
     ('GEONETWORK_LOGIN', 'admin'),
     ('GEONETWORK_PASSWORD', 'admin'),
     ('GEONETWORK_TIMEOUT', 36000),
+    ('GEONETWORK_BATCH_SIZE', 50),
     ('MAPSERV_TIMEOUT', 60),
+    ('METRICS_ALLOWED_IPS', ['127.0.0.1']),
+    ('METRICS_CALLER_SAMPLING', 0),
     ('MDEDIT_HTML_PATH', 'mdedit/html/'),
     ('MDEDIT_CONFIG_PATH', 'mdedit/config/'),
     ('MDEDIT_DATASET_MODEL', 'models/model-dataset-empty.json'),
@@ -106,6 +128,11 @@ OPTIONAL = (
     ('REDIS_HOST', 'localhost'),
     ('REDIS_PORT', 6379),
     ('REDIS_EXPIRATION', 120),
+    ('ROLES_SNAPSHOT_EXPIRATION', 300),
+    ('OUTBOX_CONCURRENCY', {'ckan': 4, 'mra': 2, 'geonet': 2}),
+    ('OUTBOX_MAX_ATTEMPTS', 10),
+    ('OUTBOX_RETRY_DELAY', 30),
+    ('BULK_RATE_LIMITS', {}),  # ex. {'ckan': 10, 'mra': 5} (objets par seconde)
     ('READTHEDOC_URL', None),
     ('VIEWERSTUDIO_URL', None),
     ('IDGO_SITE_HEADING_LOGO', None),
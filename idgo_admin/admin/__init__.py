@@ -23,6 +23,7 @@ from idgo_admin.admin.jurisdiction import *
 from idgo_admin.admin.license import *
 from idgo_admin.admin.mail import *
 from idgo_admin.admin.organisation import *
+from idgo_admin.admin.outbox import *
 from idgo_admin.admin.support import *
 from idgo_admin.admin.supported_crs import *
 from idgo_admin.admin.task import *
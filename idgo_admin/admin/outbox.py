@@ -0,0 +1,52 @@
+# Copyright (c) 2017-2021 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+from django.contrib import admin
+from django.utils import timezone
+
+from idgo_admin.models import OutboxMessage
+
+
+def retry_messages(modeladmin, request, queryset):
+    queryset.exclude(state='running').update(
+        state='pending', attempts=0, available_at=timezone.now())
+    OutboxMessage.objects.wake_up_workers()
+
+
+retry_messages.short_description = "Relancer le traitement des messages sélectionnés"
+
+
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = (
+        'pk', 'target', 'action', 'object_key', 'state',
+        'attempts', 'created_on', 'available_at', 'processed_on')
+    list_filter = ('target', 'state', 'action')
+    search_fields = ('object_key', 'idempotency_key')
+    ordering = ('-pk',)
+    actions = [retry_messages]
+    readonly_fields = (
+        'target', 'action', 'object_key', 'idempotency_key', 'payload',
+        'state', 'attempts', 'last_error', 'created_on', 'available_at',
+        'processed_on')
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+admin.site.register(OutboxMessage, OutboxMessageAdmin)
@@ -0,0 +1,237 @@
+# Copyright (c) 2017-2021 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""Traitements de masse parallèles et reprenables.
+
+Les objets à traiter sont répartis par lots entre plusieurs processus. Le
+résultat de chaque objet est enregistré dans la table `BulkCheckpoint`,
+ce qui permet de reprendre un traitement interrompu (`resume=True`) sans
+retraiter les objets déjà traités avec succès.
+"""
+
+
+from concurrent.futures import as_completed
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import time
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from idgo_admin.ckan_module import CkanHandler
+from idgo_admin.ckan_module import CkanUserHandlers
+
+from idgo_admin import BULK_RATE_LIMITS
+
+
+logger = logging.getLogger('idgo_admin')
+
+
+class RateLimiter(object):
+    """Limiter le nombre d'opérations par seconde (`rate`)."""
+
+    def __init__(self, rate=None):
+        self.interval = rate and 1.0 / rate or 0
+        self.last = 0
+
+    def wait(self):
+        if not self.interval:
+            return
+        delay = self.last + self.interval - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self.last = time.monotonic()
+
+
+def _reset_remote_sessions():
+    # Le processus fils hérite des sockets des sessions HTTP du parent ;
+    # elles ne doivent pas être partagées. Les clients MRA et GeoNetwork
+    # n'ouvrent pas de session persistante.
+    CkanHandler.reset_session()
+    CkanUserHandlers.clear()
+
+
+def _process_chunk(name, model_label, pks, action, rate):
+    _reset_remote_sessions()
+
+    Model = apps.get_model(model_label)
+    BulkCheckpoint = apps.get_model(
+        app_label='idgo_admin', model_name='BulkCheckpoint')
+
+    limiter = RateLimiter(rate)
+    results = []
+    for pk in pks:
+        limiter.wait()
+        start = time.monotonic()
+        error = None
+        try:
+            action(Model.objects.get(pk=pk))
+        except Exception as e:
+            logger.exception(e)
+            error = str(e) or e.__class__.__qualname__
+        duration = time.monotonic() - start
+
+        BulkCheckpoint.objects.update_or_create(
+            name=name, object_pk=str(pk), defaults={
+                'state': error and 'failed' or 'done',
+                'error': error,
+                'duration': duration})
+        results.append((pk, error, duration))
+
+    # Les connexions ouvertes dans le processus fils sont fermées
+    connections.close_all()
+    return results
+
+
+class BulkRunner(object):
+    """Appliquer `action` à chaque objet de `queryset`.
+
+    `action` doit être une fonction définie au niveau d'un module (elle est
+    transmise aux processus fils) ; `services` liste les services distants
+    sollicités (ex. 'ckan', 'mra') dont la limite de débit est définie par
+    le paramètre `BULK_RATE_LIMITS`.
+    """
+
+    def __init__(self, name, queryset, action, services=(), workers=4,
+                 chunk_size=50, resume=False):
+        self.name = name
+        self.queryset = queryset
+        self.action = action
+        self.workers = max(workers, 1)
+        self.chunk_size = chunk_size
+        self.resume = resume
+
+        rates = [BULK_RATE_LIMITS[s] for s in services if BULK_RATE_LIMITS.get(s)]
+        # La limite est répartie entre les processus
+        self.rate = rates and min(rates) / self.workers or None
+
+    def get_pks(self):
+        BulkCheckpoint = apps.get_model(
+            app_label='idgo_admin', model_name='BulkCheckpoint')
+        checkpoints = BulkCheckpoint.objects.filter(name=self.name)
+
+        if not self.resume:
+            checkpoints.delete()
+            return list(self.queryset.values_list('pk', flat=True)), 0
+
+        done = set(checkpoints.filter(state='done').values_list('object_pk', flat=True))
+        pks = list(self.queryset.values_list('pk', flat=True))
+        return [pk for pk in pks if str(pk) not in done], len(done)
+
+    def run(self):
+        pks, skipped = self.get_pks()
+        total = len(pks)
+        model_label = self.queryset.model._meta.label
+        chunks = [pks[i:i + self.chunk_size] for i in range(0, total, self.chunk_size)]
+
+        logger.info("Bulk '%s': %d object(s) to process, %d skipped." % (
+            self.name, total, skipped))
+
+        # Les processus fils ne doivent pas hériter des connexions du parent
+        connections.close_all()
+
+        start = time.monotonic()
+        count = 0
+        failures = []
+        failed_chunks = []
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = {
+                executor.submit(
+                    _process_chunk, self.name, model_label, chunk,
+                    self.action, self.rate): chunk
+                for chunk in chunks}
+            for future in as_completed(futures):
+                try:
+                    results = future.result()
+                except Exception as e:
+                    logger.exception(e)
+                    # Le lot entier est compté en échec
+                    error = str(e) or e.__class__.__qualname__
+                    results = [(pk, error, None) for pk in futures[future]]
+                    failed_chunks.append(results)
+                for pk, error, duration in results:
+                    count += 1
+                    if error:
+                        failures.append((pk, error))
+                logger.info("[%d/%d] - Bulk '%s'." % (count, total, self.name))
+
+        # Les objets des lots en échec sans point de reprise sont marqués
+        # en échec (les processus fils ont alors tous terminé)
+        for results in failed_chunks:
+            self.checkpoint_failures(results)
+
+        return BulkReport(
+            self.name, total, skipped, failures, time.monotonic() - start)
+
+    def checkpoint_failures(self, results):
+        BulkCheckpoint = apps.get_model(
+            app_label='idgo_admin', model_name='BulkCheckpoint')
+        known = set(BulkCheckpoint.objects.filter(
+            name=self.name, object_pk__in=[str(pk) for pk, _, _ in results]
+            ).values_list('object_pk', flat=True))
+        BulkCheckpoint.objects.bulk_create([
+            BulkCheckpoint(
+                name=self.name, object_pk=str(pk), state='failed', error=error)
+            for pk, error, _ in results if str(pk) not in known])
+
+
+class BulkReport(object):
+
+    def __init__(self, name, total, skipped, failures, elapsed):
+        self.name = name
+        self.total = total
+        self.skipped = skipped
+        self.failures = failures
+        self.elapsed = elapsed
+
+    @property
+    def throughput(self):
+        return self.elapsed and self.total / self.elapsed or 0
+
+    def __str__(self):
+        lines = [
+            "Bulk '%s' finished in %.1f s" % (self.name, self.elapsed),
+            "Processed: %d (%.2f/s)" % (self.total, self.throughput),
+            "Skipped (already done): %d" % self.skipped,
+            "Failed: %d" % len(self.failures),
+            ]
+        lines += ["  - %s: %s" % (pk, error) for pk, error in self.failures]
+        return '\n'.join(lines)
+
+
+class BulkCommand(BaseCommand):
+    """Commande de gestion s'appuyant sur `BulkRunner`."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help="Nombre de processus.")
+        parser.add_argument(
+            '--chunk-size', type=int, default=50,
+            help="Nombre d'objets par lot.")
+        parser.add_argument(
+            '--resume', action='store_true',
+            help="Reprendre le traitement précédent là où il s'est arrêté.")
+
+    def run_bulk(self, name, queryset, action, services=(), **options):
+        runner = BulkRunner(
+            name, queryset, action, services=services,
+            workers=options['workers'], chunk_size=options['chunk_size'],
+            resume=options['resume'])
+        report = runner.run()
+        self.stdout.write(str(report))
+        return report
@@ -15,48 +15,51 @@
 
 
 import ast
+from collections import OrderedDict
+import json
+from contextlib import contextmanager
 from datetime import datetime
 from functools import wraps
-import inspect
 import logging
-import os
+import threading
 import time
-import timeout_decorator
 import unicodedata
 from urllib.parse import urljoin
 
 from ckanapi import errors as CkanError
 from ckanapi import RemoteCKAN
+import redis
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import Timeout
 
 from django.core.exceptions import ValidationError
 from django.core.files.base import File
 from django.db import IntegrityError
+from django.db import transaction
 
 from idgo_admin.exceptions import GenericException
+from idgo_admin.metrics import instrument
+from idgo_admin.remote_cache import get_session
+from idgo_admin.utils import DeadlineExceeded
+from idgo_admin.utils import remote_timeouts
 from idgo_admin.utils import Singleton
 from idgo_admin.utils import slugify
 
 from idgo_admin import CKAN_URL
 from idgo_admin import CKAN_API_KEY
+from idgo_admin import CKAN_APIKEY_EXPIRATION
+from idgo_admin import CKAN_REFERENCE_EXPIRATION
+from idgo_admin import CKAN_USER_HANDLERS_MAXSIZE
 from idgo_admin import DOMAIN_NAME
-from idgo_admin import CKAN_TIMEOUT
+from idgo_admin import REDIS_HOST
+from idgo_admin import REDIS_PORT
 
 
 logger = logging.getLogger('idgo_admin.ckan_module')
 
 
-def timeout(fun):
-    t = CKAN_TIMEOUT  # in seconds
-
-    @timeout_decorator.timeout(t, use_signals=False)
-    def return_with_timeout(fun, args=tuple(), kwargs=dict()):
-        return fun(*args, **kwargs)
-
-    @wraps(fun)
-    def wrapper(*args, **kwargs):
-        return return_with_timeout(fun, args=args, kwargs=kwargs)
-
-    return wrapper
+strict_redis = redis.StrictRedis(REDIS_HOST, REDIS_PORT)
 
 
 class CkanBaseError(GenericException):
@@ -112,48 +115,178 @@ class CkanExceptionsHandler(object):
         @wraps(f)
         def wrapper(*args, **kwargs):
 
-            root_dir = os.path.dirname(os.path.abspath(__file__))
-            info = inspect.getframeinfo(inspect.stack()[1][0])
-            logger.debug(
-                'Run {} (called by file "{}", line {}, in {})'.format(
-                    f.__qualname__,
-                    info.filename.replace(root_dir, '.'),
-                    info.lineno,
-                    info.function))
-
-            try:
-                return f(*args, **kwargs)
-            except Exception as e:
-                logger.exception(e)
-                if isinstance(e, timeout_decorator.TimeoutError):
-                    raise CkanTimeoutError
-                if self.is_ignored(e):
+            with instrument('ckan', f.__qualname__):
+                try:
                     return f(*args, **kwargs)
-                if e.__class__.__qualname__ == 'ValidationError':
-                    try:
-                        err = e.error_dict
-                        del err['__type']
-                        msg = ', '.join([
-                            '"{0}" {1}'.format(k, isinstance(v, list) and ', '.join(v) or v)
-                            for k, v in err.items()])
-                    except Exception:
-                        msg = e.__str__()
-                    raise ValidationError(msg)
-                if e.__str__() in ('Indisponible', 'Not Found'):
-                    raise CkanNotFoundError
-                raise CkanSyncingError(e.__str__())
+                except Exception as e:
+                    logger.exception(e)
+                    if isinstance(e, (Timeout, DeadlineExceeded)):
+                        raise CkanTimeoutError
+                    if self.is_ignored(e):
+                        return f(*args, **kwargs)
+                    if e.__class__.__qualname__ == 'ValidationError':
+                        try:
+                            err = e.error_dict
+                            del err['__type']
+                            msg = ', '.join([
+                                '"{0}" {1}'.format(k, isinstance(v, list) and ', '.join(v) or v)
+                                for k, v in err.items()])
+                        except Exception:
+                            msg = e.__str__()
+                        raise ValidationError(msg)
+                    if isinstance(e, CkanError.NotFound) \
+                            or e.__str__() in ('Indisponible', 'Not Found'):
+                        raise CkanNotFoundError
+                    raise CkanSyncingError(e.__str__())
         return wrapper
 
     def is_ignored(self, exception):
         return type(exception) in self.ignore
 
 
+class CkanUnitOfWork(object):
+    """Regrouper les écritures CKAN d'une cascade de sauvegardes.
+
+    Tant qu'une unité de travail est ouverte (cf. `ckan_unit_of_work`), les
+    mises à jour de paquets et de ressources existants ainsi que les vues
+    de ressources sont conservées en mémoire, puis envoyées à la validation
+    sous la forme d'un seul `package_patch` / `resource_patch` par objet.
+
+    Les appels différés retournent `None` : le résultat n'est connu qu'à
+    la validation. Un paquet disparu de CKAN est alors recréé à partir de
+    sa description complète (cf. `on_package_created`).
+    """
+
+    _local = threading.local()
+
+    def __init__(self):
+        self.flushing = False
+        self.packages = OrderedDict()   # id -> [handler, data]
+        self.resources = OrderedDict()  # id -> [handler, data]
+        self.views = OrderedDict()      # (resource_id, view_type) -> [handler, data]
+        self.optional = set()           # ressources dont l'échec est ignoré
+        self.created = {}               # id -> [callback]
+
+    @classmethod
+    def current(cls):
+        uow = getattr(cls._local, 'uow', None)
+        if uow and not uow.flushing:
+            return uow
+
+    def _merge(self, pending, key, handler, data):
+        if key in pending:
+            pending[key][0] = handler
+            pending[key][1].update(data)
+        else:
+            pending[key] = [handler, dict(data)]
+        return pending[key][1]
+
+    def patch_package(self, handler, id, **kwargs):
+        self._merge(self.packages, id, handler, kwargs)
+
+    def on_package_created(self, id, callback):
+        """Appeler `callback(package)` si le paquet doit être recréé."""
+        self.created.setdefault(id, []).append(callback)
+
+    def patch_resource(self, handler, id, ignore_errors=False, **kwargs):
+        # L'échec n'est ignoré que si toutes les écritures de la
+        # ressource l'acceptent.
+        if id not in self.resources and ignore_errors:
+            self.optional.add(id)
+        elif not ignore_errors:
+            self.optional.discard(id)
+        self._merge(self.resources, id, handler, kwargs)
+
+    def push_resource_view(self, handler, **kwargs):
+        key = (kwargs['resource_id'], kwargs['view_type'])
+        self._merge(self.views, key, handler, kwargs)
+
+    def forget_package(self, id):
+        self.packages.pop(id, None)
+
+    def forget_resource(self, id):
+        self.resources.pop(id, None)
+        self.optional.discard(id)
+        for key in [k for k in self.views.keys() if k[0] == id]:
+            del self.views[key]
+
+    def commit(self):
+        local = self._local
+        previous = getattr(local, 'uow', None)
+        # Les écritures envoyées ici ne sont pas différées à nouveau
+        local.uow = self
+        self.flushing = True
+        try:
+            for id, (handler, data) in self.resources.items():
+                try:
+                    handler.patch_resource(id, **data)
+                except Exception as e:
+                    if id not in self.optional:
+                        raise
+                    logger.warning("Error was ignored: %s" % e)
+            for (resource_id, view_type), (handler, data) in self.views.items():
+                handler.push_resource_view(**data)
+            for id, (handler, data) in self.packages.items():
+                try:
+                    handler.patch_package(id, **data)
+                except CkanNotFoundError:
+                    # Seule une description complète (cf. `Dataset.synchronize`)
+                    # permet de recréer le paquet
+                    if 'name' not in data:
+                        raise
+                    logger.warning("Package '%s' not found: create it." % id)
+                    package = handler.publish_dataset(**data)
+                    for callback in self.created.get(id, []):
+                        callback(package)
+        finally:
+            self.packages.clear()
+            self.resources.clear()
+            self.views.clear()
+            self.optional.clear()
+            self.created.clear()
+            self.flushing = False
+            local.uow = previous
+
+
+@contextmanager
+def ckan_unit_of_work():
+    """Ouvrir (ou rejoindre) l'unité de travail CKAN du fil d'exécution.
+
+    S'utilise comme gestionnaire de contexte ou comme décorateur. Seule
+    l'unité de travail la plus externe envoie les écritures à CKAN, et
+    ce une fois la transaction qu'elle ouvre validée (aucun appel HTTP
+    n'est fait transaction ouverte). En cas d'erreur, les écritures CKAN
+    en attente sont abandonnées avec la transaction.
+    """
+    local = CkanUnitOfWork._local
+    uow = getattr(local, 'uow', None)
+    if uow:
+        yield uow
+        return
+
+    uow = CkanUnitOfWork()
+    with transaction.atomic():
+        local.uow = uow
+        try:
+            yield uow
+        finally:
+            local.uow = None
+        transaction.on_commit(uow.commit)
+
+
 class CkanBaseHandler(object):
 
-    def __init__(self, url, apikey=None):
+    def __init__(self, url, apikey=None, session=None, check=True, cache=False):
 
         self.apikey = apikey
-        self.remote = RemoteCKAN(url, apikey=self.apikey)
+        if cache:
+            # Lectures seules en GET, mises en cache (cf. `remote_cache`)
+            self.remote = RemoteCKAN(
+                url, apikey=self.apikey, session=session or get_session(url), get_only=True)
+        else:
+            self.remote = RemoteCKAN(url, apikey=self.apikey, session=session)
+        if not check:
+            return
         try:
             res = self.call_action('site_read')
         except Exception as e:
@@ -175,9 +308,36 @@ class CkanBaseHandler(object):
         self.remote.close()
         logger.info('Close CKAN connection')
 
-    # @timeout
+    def reset_session(self):
+        """Remplacer la session HTTP (ex. dans un processus fils)."""
+        self.remote.session = requests.Session()
+
     def call_action(self, action, **kwargs):
-        return self.remote.call_action(action, kwargs)
+        return self.remote.call_action(
+            action, kwargs, requests_kwargs={'timeout': remote_timeouts()})
+
+    @CkanExceptionsHandler()
+    def search_packages(self, **kwargs):
+        return self.call_action('package_search', **kwargs)
+
+    def iter_packages(self, fl=None, rows=1000, **kwargs):
+        """Parcourir les résultats de `package_search` page par page.
+
+        `fl` restreint les champs de l'index retournés pour chaque paquet.
+        """
+        kwargs.setdefault('include_private', True)
+        kwargs.setdefault('sort', 'id asc')
+        if fl:
+            kwargs['fl'] = list(fl)
+        start = 0
+        while True:
+            result = self.search_packages(rows=rows, start=start, **kwargs)
+            packages = result.get('results', [])
+            for package in packages:
+                yield package
+            start += len(packages)
+            if not packages or start >= result.get('count', 0):
+                break
 
     @CkanExceptionsHandler()
     def get_all_categories(self, *args, **kwargs):
@@ -223,7 +383,6 @@ class CkanBaseHandler(object):
         return self.get_package(name) and True or False
 
     @CkanExceptionsHandler()
-    # @timeout
     def push_resource(self, package, **kwargs):
         kwargs['package_id'] = package['id']
         kwargs['created'] = datetime.now().isoformat()
@@ -261,6 +420,10 @@ class CkanBaseHandler(object):
         kwargs['description'] = kwargs['description'] \
             if 'description' in kwargs else 'Aperçu du jeu de données'
 
+        uow = CkanUnitOfWork.current()
+        if uow:
+            return uow.push_resource_view(self, **kwargs)
+
         views = self.call_action(
             'resource_view_list', id=kwargs['resource_id'])
         for view in views:
@@ -269,18 +432,45 @@ class CkanBaseHandler(object):
                     'resource_view_update', id=view['id'], **kwargs)
         return self.call_action('resource_view_create', **kwargs)
 
+    def update_resource(self, id, ignore_errors=False, **kwargs):
+        """Mettre à jour la ressource CKAN.
+
+        Si `ignore_errors` est vrai, une erreur de CKAN est journalisée
+        puis ignorée (y compris lorsque l'écriture est différée).
+        """
+        uow = CkanUnitOfWork.current()
+        if uow:
+            return uow.patch_resource(self, id, ignore_errors=ignore_errors, **kwargs)
+        try:
+            return self._update_resource(id, **kwargs)
+        except Exception as e:
+            if not ignore_errors:
+                raise
+            logger.warning("Error was ignored: %s" % e)
+
     @CkanExceptionsHandler()
-    def update_resource(self, id, **kwargs):
+    def _update_resource(self, id, **kwargs):
         resource = self.call_action('resource_show', id=id)
         resource.update(kwargs)
         return self.call_action('resource_update', **resource)
 
+    @CkanExceptionsHandler()
+    def patch_resource(self, id, **kwargs):
+        return self.call_action('resource_patch', id=id, **kwargs)
+
+    @CkanExceptionsHandler()
+    def patch_package(self, id, **kwargs):
+        return self.call_action('package_patch', id=id, **kwargs)
+
     def check_dataset_integrity(self, name):
         if self.is_package_name_already_used(name):
             raise CkanConflictError('Dataset already exists')
 
     @CkanExceptionsHandler()
     def publish_dataset(self, id=None, resources=None, **kwargs):
+        uow = CkanUnitOfWork.current()
+        if id and uow:
+            return uow.patch_package(self, id, **kwargs)
         if id and self.is_package_exists(id):
             package = self.call_action(
                 'package_update', **{**self.get_package(id), **kwargs})
@@ -302,6 +492,9 @@ class CkanBaseHandler(object):
 
     @CkanExceptionsHandler(ignore=[CkanError.NotFound])
     def delete_resource(self, id):
+        uow = CkanUnitOfWork.current()
+        if uow:
+            uow.forget_resource(id)
         try:
             return self.call_action('resource_delete', id=id, force=True)
         except CkanError.NotFound:
@@ -309,6 +502,9 @@ class CkanBaseHandler(object):
 
     @CkanExceptionsHandler(ignore=[CkanError.NotFound])
     def delete_dataset(self, id):
+        uow = CkanUnitOfWork.current()
+        if uow:
+            uow.forget_package(id)
         try:
             return self.call_action('package_delete', id=id)
         except CkanError.NotFound:
@@ -317,8 +513,24 @@ class CkanBaseHandler(object):
 
 class CkanUserHandler(CkanBaseHandler):
 
+    def __init__(self, apikey, session=None, check=True):
+        super().__init__(CKAN_URL, apikey=apikey, session=session, check=check)
+
+
+class CkanPooledUserHandler(CkanUserHandler):
+    """Connexion CKAN d'un utilisateur conservée par `CkanUserHandlers`."""
+
     def __init__(self, apikey):
-        super().__init__(CKAN_URL, apikey=apikey)
+        session = requests.Session()
+        session.mount('http://', HTTPAdapter(pool_maxsize=10))
+        session.mount('https://', HTTPAdapter(pool_maxsize=10))
+        # L'instance CKAN est déjà contrôlée par `CkanManagerHandler`,
+        # inutile de refaire un `site_read` pour chaque utilisateur.
+        super().__init__(apikey, session=session, check=False)
+
+    def __exit__(self, type, value, traceback):
+        # La session HTTP est réutilisée d'une opération à l'autre.
+        pass
 
 
 class CkanManagerHandler(CkanBaseHandler, metaclass=Singleton):
@@ -362,6 +574,7 @@ class CkanManagerHandler(CkanBaseHandler, metaclass=Singleton):
         # self.del_user_from_groups(username)
         self.del_user_from_organisations(username)
         self.call_action('user_delete', id=username)
+        CkanUserHandlers.invalidate(username)
 
     @CkanExceptionsHandler()
     def update_user(self, user):
@@ -373,12 +586,14 @@ class CkanManagerHandler(CkanBaseHandler, metaclass=Singleton):
         ckan_user.update({'email': user.email,
                           'fullname': user.get_full_name()})
         self.call_action('user_update', **ckan_user)
+        CkanUserHandlers.invalidate(user.username)
 
     @CkanExceptionsHandler()
     def activate_user(self, username):
         ckan_user = self.get_user(username)
         ckan_user.update({'state': 'active'})
         self.call_action('user_update', **ckan_user)
+        CkanUserHandlers.invalidate(username)
 
     def is_organisation_exists(self, id):
         return self.get_organisation(id) and True or False
@@ -403,6 +618,7 @@ class CkanManagerHandler(CkanBaseHandler, metaclass=Singleton):
         except ValueError:
             pass
         self.call_action('organization_create', **params)
+        CkanReferences.invalidate('organisation', params['id'])
 
     @CkanExceptionsHandler()
     def update_organisation(self, organisation):
@@ -434,17 +650,22 @@ class CkanManagerHandler(CkanBaseHandler, metaclass=Singleton):
             self.call_action('package_owner_org_update', id=package['id'],
                              organization_id=ckan_organisation['id'])
 
+        CkanReferences.invalidate('organisation', organisation.ckan_id)
+
     @CkanExceptionsHandler()
     def purge_organisation(self, id):
+        CkanReferences.invalidate('organisation', id)
         return self.call_action('organization_purge', id=id)
 
     @CkanExceptionsHandler()
     def activate_organisation(self, id):
         self.call_action('organization_update', id=id, state='active')
+        CkanReferences.invalidate('organisation', id)
 
     @CkanExceptionsHandler()
     def deactivate_organisation(self, id):
         self.call_action('organization_delete', id=id)
+        CkanReferences.invalidate('organisation', id)
 
     def deactivate_ckan_organisation_if_empty(self, id):
         organisation = self.get_organisation(id)
@@ -466,12 +687,15 @@ class CkanManagerHandler(CkanBaseHandler, metaclass=Singleton):
         self.call_action(
             'organization_member_create',
             id=str(organisation_id), username=username, role=role)
+        CkanReferences.invalidate('organisation', organisation_id)
 
     @CkanExceptionsHandler()
     def del_user_from_organisation(self, username, organisation_id):
         self.call_action(
             'organization_member_delete',
             id=str(organisation_id), username=username)
+        # L'organisation peut être désignée par son nom plutôt que son identifiant
+        CkanReferences.invalidate('organisation')
 
     @CkanExceptionsHandler()
     def del_user_from_organisations(self, username):
@@ -510,11 +734,13 @@ class CkanManagerHandler(CkanBaseHandler, metaclass=Singleton):
             ckan_group['users'].append({'name': username})
 
         self.call_action('group_update', **ckan_group)
+        CkanReferences.invalidate('group')
 
     @CkanExceptionsHandler()
     def del_user_from_partner_group(self, username, id):
         if self.is_group_exists(id):
             self.call_action('group_member_delete', id=id, username=username)
+            CkanReferences.invalidate('group')
 
     @CkanExceptionsHandler()
     def add_group(self, group, type=None):
@@ -548,6 +774,7 @@ class CkanManagerHandler(CkanBaseHandler, metaclass=Singleton):
             ckan_group['image_url'] = urljoin(DOMAIN_NAME, group.picto.url)
         except ValueError:
             pass
+        CkanReferences.invalidate('group', group.ckan_id)
         try:
             return self.call_action('group_update', **ckan_group)
         except CkanError.NotFound:
@@ -556,6 +783,7 @@ class CkanManagerHandler(CkanBaseHandler, metaclass=Singleton):
     @CkanExceptionsHandler()
     def del_group(self, id):
         self.call_action('group_purge', id=str(id))
+        CkanReferences.invalidate('group', id)
 
     @CkanExceptionsHandler()
     def add_user_to_group(self, username, group_id):
@@ -579,6 +807,7 @@ class CkanManagerHandler(CkanBaseHandler, metaclass=Singleton):
             ckan_group['users'].append({'name': username, 'capacity': 'admin'})
 
         self.call_action('group_update', **ckan_group)
+        CkanReferences.invalidate('group', group_id)
 
     @CkanExceptionsHandler()
     def purge_dataset(self, id):
@@ -638,3 +867,185 @@ def handle_connection(attempt):
 
 
 CkanHandler = handle_connection(1)
+
+
+class CkanUserHandlerRegistry(object):
+    """Registre des connexions CKAN des utilisateurs.
+
+    La clé d'API de chaque utilisateur est conservée `ttl` secondes dans
+    la mémoire du processus (au lieu d'un `user_show` à chaque opération) ;
+    seul un compteur de génération par utilisateur est partagé dans Redis,
+    de sorte qu'une invalidation est vue par tous les processus (gunicorn
+    et celery) sans que la clé d'API n'y soit écrite.
+
+    Les connexions (une session HTTP par clé d'API) sont partagées d'une
+    opération à l'autre au sein du processus ; au-delà de `maxsize`, la
+    connexion la moins récemment utilisée est fermée.
+    """
+
+    prefix = 'idgo:ckan:user'
+
+    def __init__(self, ttl=CKAN_APIKEY_EXPIRATION, maxsize=CKAN_USER_HANDLERS_MAXSIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._apikeys = {}  # username -> (apikey, generation, expiration)
+        self._handlers = OrderedDict()  # apikey -> CkanPooledUserHandler
+
+    def get_generation_key(self, username):
+        return '%s:%s:generation' % (self.prefix, username)
+
+    def get_generation(self, username):
+        try:
+            generation = strict_redis.get(self.get_generation_key(username))
+        except redis.exceptions.RedisError as e:
+            logger.warning(e)
+            return None
+        return int(generation or 0)
+
+    def get_apikey(self, username):
+        generation = self.get_generation(username)
+        with self._lock:
+            apikey, previous, expiration = self._apikeys.get(username, (None, None, 0))
+        if apikey and previous == generation and expiration > time.monotonic():
+            return apikey
+
+        ckan_user = CkanHandler.get_user(username)
+        if not ckan_user:
+            raise CkanNotFoundError(
+                "L'utilisateur CKAN '{}' n'existe pas.".format(username))
+
+        apikey = ckan_user['apikey']
+        with self._lock:
+            previous = self._apikeys.get(username, (None,))[0]
+            if previous and previous != apikey:
+                self._discard(previous)
+            self._apikeys[username] = (apikey, generation, time.monotonic() + self.ttl)
+        return apikey
+
+    def get(self, username):
+        """Retourner la connexion CKAN de l'utilisateur."""
+        apikey = self.get_apikey(username)
+        with self._lock:
+            handler = self._handlers.get(apikey)
+            if handler:
+                self._handlers.move_to_end(apikey)
+            else:
+                handler = CkanPooledUserHandler(apikey)
+                self._handlers[apikey] = handler
+                while len(self._handlers) > self.maxsize:
+                    self._discard(next(iter(self._handlers)))
+        return handler
+
+    def invalidate(self, username):
+        """Oublier la clé d'API (et la connexion) de l'utilisateur."""
+        try:
+            strict_redis.incr(self.get_generation_key(username))
+        except redis.exceptions.RedisError as e:
+            logger.warning(e)
+        with self._lock:
+            apikey = self._apikeys.pop(username, (None,))[0]
+            if apikey:
+                self._discard(apikey)
+
+    def clear(self):
+        with self._lock:
+            self._apikeys.clear()
+            for apikey in list(self._handlers.keys()):
+                self._discard(apikey)
+
+    def _discard(self, apikey):
+        handler = self._handlers.pop(apikey, None)
+        if handler:
+            handler.remote.session.close()
+
+
+CkanUserHandlers = CkanUserHandlerRegistry()
+
+
+class CkanReferenceCache(object):
+    """Cache des données de référence CKAN (licences, organisations, groupes).
+
+    Les entrées sont conservées `ttl` secondes dans Redis et sont invalidées
+    par les méthodes de `CkanManagerHandler` qui modifient les objets
+    concernés, quel que soit le processus qui les lit. L'invalidation de
+    toutes les entrées d'un type incrémente sa génération.
+    """
+
+    prefix = 'idgo:ckan:reference'
+
+    def __init__(self, ttl=CKAN_REFERENCE_EXPIRATION):
+        self.ttl = ttl
+
+    def get_generation_key(self, kind):
+        return '%s:%s:generation' % (self.prefix, kind)
+
+    def get_key(self, kind, id):
+        return '%s:%s:%s' % (self.prefix, kind, id and str(id) or '')
+
+    def _get(self, kind, id, loader):
+        key = self.get_key(kind, id)
+        try:
+            generation, cached = strict_redis.mget(self.get_generation_key(kind), key)
+        except redis.exceptions.RedisError as e:
+            logger.warning(e)
+            return loader()
+
+        generation = int(generation or 0)
+        entry = cached and json.loads(cached.decode('utf-8'))
+        if entry and entry['generation'] == generation:
+            return entry['value']
+
+        value = loader()
+        try:
+            strict_redis.set(
+                key, json.dumps({'generation': generation, 'value': value}), ex=self.ttl)
+        except redis.exceptions.RedisError as e:
+            logger.warning(e)
+        return value
+
+    def invalidate(self, kind, id=None):
+        """Oublier une entrée, ou toutes les entrées de ce type si `id` est omis."""
+        try:
+            if id is not None:
+                strict_redis.delete(self.get_key(kind, id))
+            else:
+                strict_redis.incr(self.get_generation_key(kind))
+        except redis.exceptions.RedisError as e:
+            logger.warning(e)
+
+    def clear(self):
+        for kind in ('licenses', 'organisation', 'group'):
+            self.invalidate(kind)
+
+    def get_licenses(self):
+        """Retourner les identifiants des licences CKAN."""
+        return self._get('licenses', None, lambda: [
+            license['id'] for license in CkanHandler.get_licenses()])
+
+    def get_organisation(self, id):
+        return self._get('organisation', id, lambda: CkanHandler.get_organisation(str(id)))
+
+    def get_group(self, id):
+        return self._get('group', id, lambda: CkanHandler.get_group(str(id)))
+
+    def add_user_to_organisation(self, username, organisation_id):
+        """Ajouter l'utilisateur à l'organisation s'il n'en est pas déjà membre."""
+        organisation = self.get_organisation(organisation_id) or {}
+        members = [
+            user['name'] for user in organisation.get('users', [])
+            if user.get('capacity') in ('editor', 'admin')]
+        if username not in members:
+            CkanHandler.add_user_to_organisation(username, organisation_id)
+
+    def add_user_to_group(self, username, group_id):
+        """Ajouter l'utilisateur au groupe s'il n'en est pas déjà membre."""
+        group = self.get_group(group_id) or {}
+        members = [
+            user['name'] for user in group.get('users', [])
+            if user.get('capacity') == 'admin']
+        if username not in members:
+            CkanHandler.add_user_to_group(username, group_id)
+
+
+CkanReferences = CkanReferenceCache()
@@ -17,6 +17,8 @@
 from django.apps import apps
 from django.conf import settings
 
+from idgo_admin.roles import get_snapshot
+
 from idgo_admin import HREF_WWW
 from idgo_admin import ENABLE_CSW_HARVESTER
 from idgo_admin import ENABLE_CKAN_HARVESTER
@@ -67,13 +69,11 @@ else:
 def global_vars(request):
 
     user = request.user
-    if user.is_authenticated and hasattr(user, 'profile'):
-        Organisation = apps.get_model(app_label='idgo_admin', model_name='Organisation')
-        profile = request.user.profile
-        contributor = Organisation.extras.get_contribs(
-            profile).values_list('pk', 'legal_name')
-        referent = Organisation.extras.get_subordinated_organisations(
-            profile).values_list('pk', 'legal_name')
+    if user.is_authenticated:
+        # Cf. `idgo_admin.roles`
+        snapshot = get_snapshot(user)
+        contributor = [tuple(item) for item in snapshot['contributor']]
+        referent = [tuple(item) for item in snapshot['referent']]
     else:
         contributor, referent = [], []
 
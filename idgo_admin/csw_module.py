@@ -14,39 +14,53 @@
 # under the License.
 
 
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
 from functools import wraps
-import inspect
 import logging
-import os
 
+from lxml import etree
 import re
-import timeout_decorator
 from owslib.csw import CatalogueServiceWeb
+from owslib.iso import MD_Metadata
+from requests.exceptions import Timeout
 
 from django.utils.text import slugify
 
 from idgo_admin.datagis import bounds_to_wkt
 from idgo_admin.datagis import transform
 from idgo_admin.exceptions import GenericException
+from idgo_admin.metrics import instrument
+from idgo_admin.remote_cache import get_session
+from idgo_admin.utils import DeadlineExceeded
+from idgo_admin.utils import remote_timeouts
 
-from idgo_admin import CSW_TIMEOUT
+from idgo_admin import CSW_MAX_WORKERS
+from idgo_admin import CSW_PAGE_SIZE
 
 
 logger = logging.getLogger('idgo_admin.csw_module')
 
 
-def timeout(fun):
-    t = CSW_TIMEOUT  # in seconds
+CSW = 'http://www.opengis.net/cat/csw/2.0.2'
+GMD = 'http://www.isotc211.org/2005/gmd'
+OWS = 'http://www.opengis.net/ows'
 
-    @timeout_decorator.timeout(t, use_signals=False)
-    def return_with_timeout(fun, args=tuple(), kwargs=dict()):
-        return fun(*args, **kwargs)
+DEFAULT_GETRECORDS = (
+    b'<csw:GetRecords xmlns:csw="http://www.opengis.net/cat/csw/2.0.2" '
+    b'xmlns:gmd="http://www.isotc211.org/2005/gmd" service="CSW" version="2.0.2">'
+    b'<csw:Query typeNames="gmd:MD_Metadata">'
+    b'<csw:ElementSetName>full</csw:ElementSetName>'
+    b'</csw:Query>'
+    b'</csw:GetRecords>')
 
-    @wraps(fun)
-    def wrapper(*args, **kwargs):
-        return return_with_timeout(fun, args=args, kwargs=kwargs)
 
-    return wrapper
+# Page de résultats GetRecords : fiches lues, nombre total de fiches
+# correspondant à la requête, nombre de fiches de la page, position de la
+# page suivante, nombre de fiches illisibles et validateur de la page
+Page = namedtuple('Page', (
+    'packages', 'matched', 'returned', 'next', 'rejected', 'validator'))
 
 
 class CswBaseError(GenericException):
@@ -74,24 +88,16 @@ class CswExceptionsHandler(object):
         @wraps(f)
         def wrapper(*args, **kwargs):
 
-            root_dir = os.path.dirname(os.path.abspath(__file__))
-            info = inspect.getframeinfo(inspect.stack()[1][0])
-            logger.debug(
-                'Run {} (called by file "{}", line {}, in {})'.format(
-                    f.__qualname__,
-                    info.filename.replace(root_dir, '.'),
-                    info.lineno,
-                    info.function))
-
-            try:
-                return f(*args, **kwargs)
-            except Exception as e:
-                logger.exception(e)
-                if isinstance(e, timeout_decorator.TimeoutError):
-                    raise CswTimeoutError
-                if self.is_ignored(e):
+            with instrument('csw', f.__qualname__):
+                try:
                     return f(*args, **kwargs)
-                raise CswError("Une erreur critique est survenue lors de l'appel au CSW distant.")
+                except Exception as e:
+                    logger.exception(e)
+                    if isinstance(e, (Timeout, DeadlineExceeded)):
+                        raise CswTimeoutError
+                    if self.is_ignored(e):
+                        return f(*args, **kwargs)
+                    raise CswError("Une erreur critique est survenue lors de l'appel au CSW distant.")
         return wrapper
 
     def is_ignored(self, exception):
@@ -104,9 +110,13 @@ class CswBaseHandler(object):
         self.url = url
         self.username = username
         self.password = password
+        # Les requêtes GetRecords (POST) sont mises en cache
+        self.session = get_session(url, cache_post=True)
+        self.validators = None
+        self.matched = self.returned = self.rejected = 0
         try:
             self.remote = CatalogueServiceWeb(
-                self.url, timeout=3600, lang='fr-FR', version='2.0.2',
+                self.url, timeout=remote_timeouts()[1], lang='fr-FR', version='2.0.2',
                 skip_caps=True, username=self.username, password=self.password)
         except Exception:
             raise CswReadError()
@@ -118,33 +128,176 @@ class CswBaseHandler(object):
         self.close()
 
     def close(self):
-        # Fake
+        self.session.close()
         logger.info('Close CSW connection')
 
-    @CswExceptionsHandler()
-    def get_packages(self, *args, **kwargs):
-        self.remote.getrecords2(**kwargs)
-        records = self.remote.records.copy()
-        res = []
-        for k in list(records.keys()):
+    def refresh_timeout(self):
+        # Le délai d'attente est borné par l'échéance de l'opération en cours
+        self.remote.timeout = remote_timeouts()[1]
+
+    def get_getrecords_template(self, xml=None):
+        """Retourner la requête GetRecords servant de modèle aux pages.
+
+        La requête fournie (`xml`) est reprise telle quelle, hormis le
+        schéma de sortie (ISO 19139) et le niveau de détail (`full`).
+        """
+        root = etree.fromstring(
+            xml and xml.strip().encode('utf-8') or DEFAULT_GETRECORDS)
+        if not root.tag == '{%s}GetRecords' % CSW:
+            raise CswError("La requête GetRecords est invalide.")
+
+        root.set('service', 'CSW')
+        root.set('version', '2.0.2')
+        root.set('resultType', 'results')
+        root.set('outputSchema', GMD)
+
+        query = root.find('{%s}Query' % CSW)
+        if query is None:
+            raise CswError("La requête GetRecords est invalide.")
+        for element_name in query.findall('{%s}ElementName' % CSW):
+            query.remove(element_name)
+        element_set_name = query.find('{%s}ElementSetName' % CSW)
+        if element_set_name is None:
+            element_set_name = etree.Element('{%s}ElementSetName' % CSW)
+            query.insert(0, element_set_name)
+        element_set_name.text = 'full'
+
+        return root
+
+    def get_page(self, template, start, timeout):
+        """Retourner une page de résultats (cf. `Page`)."""
+        root = deepcopy(template)
+        root.set('startPosition', str(start))
+        root.set('maxRecords', str(CSW_PAGE_SIZE))
+
+        response = self.session.post(
+            self.url, timeout=timeout, stream=True,
+            data=etree.tostring(root, xml_declaration=True, encoding='utf-8'),
+            headers={'Content-Type': 'application/xml'},
+            auth=self.username and (self.username, self.password) or None)
+        with response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            page = self.parse_records(response.raw)
+        validator = response.headers.get('etag') or response.headers.get('last-modified')
+        return page._replace(validator=validator)
+
+    def parse_records(self, source):
+        """Lire au fil de l'eau les fiches ISO 19139 d'une réponse GetRecords."""
+        matched = returned = rejected = 0
+        next_record = None
+        packages = []
+        tags = (
+            '{%s}SearchResults' % CSW,
+            '{%s}MD_Metadata' % GMD,
+            '{%s}ExceptionReport' % OWS,
+            )
+        for event, elem in etree.iterparse(
+                source, events=('start', 'end'), tag=tags, huge_tree=True):
+            if elem.tag == tags[0]:
+                if event == 'start':
+                    matched = int(elem.get('numberOfRecordsMatched') or 0)
+                    next_record = elem.get('nextRecord')
+                    next_record = next_record and int(next_record)
+                continue
+            if event == 'start':
+                continue
+            if elem.tag == tags[2]:
+                raise CswError(' '.join(elem.itertext()).strip())
+            returned += 1
+            # Une fiche mal formée ne doit pas interrompre le moissonnage,
+            # mais elle est comptée (le moissonnage est alors incomplet)
             try:
-                package = self.get_package(k)
+                packages.append(self.record_to_package(MD_Metadata(elem)))
             except CswBaseError as e:
-                logger.warning(e)
-            else:
-                res.append(package)
-        return res
+                logger.info("Record was ignored: %s" % e)
+            except Exception as e:
+                logger.exception(e)
+                logger.warning("Record was rejected.")
+                rejected += 1
+            # Libérer la mémoire occupée par les fiches déjà lues
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+        return Page(packages, matched, returned, next_record, rejected, None)
+
+    @CswExceptionsHandler()
+    def get_packages(self, xml=None, *args, **kwargs):
+        """Moissonner le catalogue par pages.
+
+        La première page donne le nombre de fiches à moissonner et le nombre
+        de fiches par page effectivement retourné par le service (qui peut
+        être inférieur à `CSW_PAGE_SIZE`) ; les pages suivantes sont
+        récupérées en parallèle (`CSW_MAX_WORKERS`). Si le nombre de fiches
+        est inconnu, les pages sont lues l'une après l'autre (`nextRecord`).
+        Si la requête fournie précise `maxRecords`, celui-ci borne le total.
+
+        Une page incomplète fait échouer le moissonnage. Ensuite :
+        `matched` donne le nombre de fiches à moissonner, `returned` celui
+        des fiches lues, `rejected` celui des fiches illisibles et
+        `validators` les validateurs de chacune des pages (ou None si l'une
+        d'elles n'en a pas).
+        """
+        template = self.get_getrecords_template(xml)
+        limit = xml and template.get('maxRecords')
+
+        timeout = remote_timeouts()
+        first = self.get_page(template, 1, timeout)
+        matched, step = first.matched, first.returned
+        if limit:
+            matched = min(matched, int(limit))
+        pages = [(1, first)]
+
+        if matched:
+            if not step:
+                raise CswError("Le service CSW ne retourne aucune fiche.")
+            starts = range(1 + step, matched + 1, step)
+            with ThreadPoolExecutor(max_workers=CSW_MAX_WORKERS) as executor:
+                pages += zip(starts, executor.map(
+                    lambda start: self.get_page(template, start, timeout), starts))
+            for start, page in pages:
+                expected = min(step, matched - start + 1)
+                if page.returned < expected:
+                    raise CswError(
+                        "Le service CSW n'a retourné que %d fiche(s) sur %d "
+                        "à partir de la position %d." % (page.returned, expected, start))
+        else:
+            # Le nombre de fiches est inconnu : on suit `nextRecord` (0 une
+            # fois la dernière page atteinte) jusqu'à une page vide
+            start, page = pages[-1]
+            count = page.returned
+            while page.returned and page.next != 0 and not (limit and count >= int(limit)):
+                start = page.next or start + page.returned
+                if start <= pages[-1][0]:
+                    break
+                page = self.get_page(template, start, timeout)
+                pages.append((start, page))
+                count += page.returned
+            matched = limit and min(count, int(limit)) or count
+
+        self.matched = matched
+        self.returned = min(sum(page.returned for _, page in pages), matched)
+        self.rejected = sum(page.rejected for _, page in pages)
+        validators = [(start, page.validator) for start, page in pages]
+        if all(validator for _, validator in validators):
+            self.validators = validators
+
+        packages = []
+        for _, page in pages:
+            packages.extend(page.packages)
+        return packages[:matched or None]
 
     @CswExceptionsHandler()
     def get_package(self, id, *args, **kwargs):
 
+        self.refresh_timeout()
         self.remote.getrecordbyid(
             [id], outputschema='http://www.isotc211.org/2005/gmd')
 
         records = self.remote.records.copy()
+        return self.record_to_package(records[id])
 
-        rec = records[id]
-
+    def record_to_package(self, rec):
         xml = rec.xml
         if not rec.__class__.__name__ == 'MD_Metadata':
             raise CswBaseError('outputschema error')
@@ -270,6 +423,7 @@ class CswBaseHandler(object):
             'groups': groups,
             'metadata_created': dataset_creation_date,
             'metadata_modified': dataset_modification_date,
+            'metadata_datestamp': rec.datestamp,
             'dataset_creation_date': dataset_creation_date,
             'dataset_modification_date': dataset_modification_date,
             'dataset_publication_date': dataset_publication_date,
@@ -14,16 +14,18 @@
 # under the License.
 
 
+from collections import Counter
 import inspect
 import json
 import logging
 import os
 import requests
 import rdflib.parser
-import timeout_decorator
 from functools import wraps
 import re
-import xml.etree.ElementTree as ET
+import tempfile
+import threading
+import time
 
 from geomet import wkt
 from rdflib import BNode
@@ -35,8 +37,12 @@ from rdflib.namespace import RDFS
 from rdflib.namespace import SKOS
 
 from idgo_admin.exceptions import GenericException
+from idgo_admin.metrics import instrument
+from idgo_admin.remote_cache import get_session
+from idgo_admin.utils import DeadlineExceeded
+from idgo_admin.utils import remote_timeouts
 
-from idgo_admin import DCAT_TIMEOUT
+from idgo_admin import DCAT_PUBLISHERS_EXPIRATION
 
 
 logger = logging.getLogger('idgo_admin.dcat_module')
@@ -50,6 +56,7 @@ FOAF = Namespace("http://xmlns.com/foaf/0.1/")
 LOCN = Namespace('http://www.w3.org/ns/locn#')
 GSP = Namespace('http://www.opengis.net/ont/geosparql#')
 OWL = Namespace('http://www.w3.org/2002/07/owl#')
+HYDRA = Namespace('http://www.w3.org/ns/hydra/core#')
 
 namespaces = {
     'dct': DCT,
@@ -82,47 +89,40 @@ class DcatError(DcatBaseError):
     """DcatError"""
 
 
-def timeout(fun):
-    t = DCAT_TIMEOUT  # in seconds
-
-    @timeout_decorator.timeout(t, use_signals=False)
-    def return_with_timeout(fun, args=tuple(), kwargs=dict()):
-        return fun(*args, **kwargs)
-
-    @wraps(fun)
-    def wrapper(*args, **kwargs):
-        return return_with_timeout(fun, args=args, kwargs=kwargs)
-
-    return wrapper
-
-
 class DcatExceptionsHandler(object):
 
     def __init__(self, ignore=None):
         self.ignore = ignore or []
 
     def __call__(self, f):
+        if inspect.isgeneratorfunction(f):
+            # Les erreurs surviennent au cours du parcours du générateur
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+
+                with instrument('dcat', f.__qualname__):
+                    try:
+                        yield from f(*args, **kwargs)
+                    except Exception as e:
+                        logger.exception(e)
+                        if isinstance(e, (requests.exceptions.Timeout, DeadlineExceeded)):
+                            raise DcatTimeoutError()
+                        raise DcatError("Une erreur critique est survenue lors de l'appel au DCAT distant.")
+            return wrapper
+
         @wraps(f)
         def wrapper(*args, **kwargs):
 
-            root_dir = os.path.dirname(os.path.abspath(__file__))
-            info = inspect.getframeinfo(inspect.stack()[1][0])
-            logger.debug(
-                'Run {} (called by file "{}", line {}, in {})'.format(
-                    f.__qualname__,
-                    info.filename.replace(root_dir, '.'),
-                    info.lineno,
-                    info.function))
-
-            try:
-                return f(*args, **kwargs)
-            except Exception as e:
-                logger.exception(e)
-                if isinstance(e, timeout_decorator.TimeoutError):
-                    raise DcatTimeoutError()
-                if self.is_ignored(e):
+            with instrument('dcat', f.__qualname__):
+                try:
                     return f(*args, **kwargs)
-                raise DcatError("Une erreur critique est survenue lors de l'appel au DCAT distant.")
+                except Exception as e:
+                    logger.exception(e)
+                    if isinstance(e, (requests.exceptions.Timeout, DeadlineExceeded)):
+                        raise DcatTimeoutError()
+                    if self.is_ignored(e):
+                        return f(*args, **kwargs)
+                    raise DcatError("Une erreur critique est survenue lors de l'appel au DCAT distant.")
         return wrapper
 
     def is_ignored(self, exception):
@@ -465,8 +465,8 @@ class EuropeanDCATAPProfile(RDFProfile):
 
             resource_dict['url'] = (self._object_value(distribution,
                                                        DCAT.downloadURL) or
-                                    self._object_value(distribution,
-                                                       DCAT.accessURL))
+                                    url_cleaner(self._object_value(distribution,
+                                                                   DCAT.accessURL)))
 
             imt = self._distribution_format(distribution)
 
@@ -495,63 +495,29 @@ class EuropeanDCATAPProfile(RDFProfile):
         return dataset_dict
 
 
-class DcatBaseHandler(object):
+def url_cleaner(url):
+    """Remove characters not allowed in an URL."""
+    return url.translate({ord(i): None for i in '<>}{|`""'})
 
-    def __init__(self, url):
-        self.url = url
-        r = requests.head(self.url, verify=False)
-        self.graph = rdflib.Graph()
 
-        # application/rdf+xml, application/xml
-        if 'xml' in r.headers['content-type']:
-            try:
-                logger.info("Je suis le parser RDF et je peux être très lent.")
-                self.graph.parse(self.url)
-                self.profile = EuropeanDCATAPProfile(self.graph)
-                logger.info("J'ai fini de parser le RDF.")
-            except Exception as e:
-                logger.exception(e)
-                raise DcatError("L'url ne semble pas indiquer un service DCAT.")
-            self.xml_dict = self._get_xml_dict()
-
-        # 'application/json', 'application/ld+json'
-        elif 'json' in r.headers['content-type']:
-
-            def json_url_cleaner(obj, key):
-                """Recursively search for values of key in JSON tree."""
-                if isinstance(obj, dict):
-                    for k, v in obj.items():
-                        if isinstance(v, (dict, list)):
-                            json_url_cleaner(v, key)
-                        elif k == key:
-                            obj[k] = v.translate({
-                                ord(i): None for i in '<>}{|`""'})
-                elif isinstance(obj, list):
-                    for item in obj:
-                        json_url_cleaner(item, key)
-                return obj
+class DcatBaseHandler(object):
+    """Lecteur de catalogue DCAT (RDF/XML ou JSON-LD).
 
-            try:
-                raw_data = r.json()
-            except Exception as e:
-                logger.exception(e)
-                raise DcatError("Le document JSON retourné n'est pas lisible")
+    Chaque page du catalogue (cf. pagination Hydra) n'est téléchargée qu'une
+    fois dans un fichier temporaire ; un seul graphe est conservé en mémoire
+    à la fois, chaque page étant relue le temps de son parcours (le graphe
+    de la première page, lu à l'ouverture, sert au premier parcours).
 
-            cleanedData = json_url_cleaner(raw_data, 'accessURL')
+    Les pages sont lues au travers du cache disque du catalogue, sauf si
+    `cache` est faux (lectures ne relevant pas du moissonnage).
+    """
 
-            try:
-                logger.info("Je suis le parser RDF et je peux être très lent.")
-                self.graph.parse(
-                    data=json.dumps(cleanedData), format='json-ld', indent=4)
-                self.profile = EuropeanDCATAPProfile(self.graph)
-                logger.info("J'ai fini de parser le RDF.")
-            except Exception as e:
-                logger.exception(e)
-                raise DcatError("L'url ne semble pas indiquer un service DCAT.")
-            self.xml_dict = {}
+    def __init__(self, url, cache=True):
+        self.url = url
+        self.pages = []
+        self.session = cache and get_session(url) or requests.Session()
 
-        else:
-            raise DcatError("L'url ne semble pas indiquer un service DCAT.")
+        self._graph = self._load_page(self.url)
 
     def __enter__(self):
         return self
@@ -560,43 +526,146 @@ class DcatBaseHandler(object):
         self.close()
 
     def close(self):
-        self.xml_dict = None
-        self.profile = None
-        self.graph = None
+        for page in self.pages:
+            try:
+                os.remove(page['path'])
+            except OSError as e:
+                logger.warning(e)
+        self.pages = []
+        self.session.close()
+        self._graph = None
         self.url = None
 
-    def _get_xml_dict(self):
-        xml_data = requests.get(self.url, verify=False)
-        xml_object = ET.fromstring(xml_data.content)
+    def _download(self, url):
+        headers = {
+            'Accept': 'application/rdf+xml, application/xml;q=0.9, '
+                      'application/ld+json;q=0.8, application/json;q=0.7'}
+        try:
+            r = self.session.get(
+                url, headers=headers, verify=False, stream=True,
+                timeout=remote_timeouts())
+            r.raise_for_status()
+        except (requests.exceptions.Timeout, DeadlineExceeded) as e:
+            logger.exception(e)
+            raise DcatTimeoutError()
+        except Exception as e:
+            logger.exception(e)
+            raise DcatError("L'url ne semble pas indiquer un service DCAT.")
 
-        for key, value in namespaces.items():
-            ET.register_namespace(key, value)
-        xml_dict = {}
-        for root in xml_object[0].findall('dcat:dataset', namespaces):
-            xml_dict[root[0].find('dct:identifier', namespaces).text] = ET.tostring(root)
-        return xml_dict
+        with r:
+            content_type = r.headers.get('content-type', '')
+            # application/rdf+xml, application/xml
+            if 'xml' in content_type:
+                format = 'xml'
+            # 'application/json', 'application/ld+json'
+            elif 'json' in content_type:
+                format = 'json-ld'
+            else:
+                raise DcatError("L'url ne semble pas indiquer un service DCAT.")
+
+            fd, path = tempfile.mkstemp(prefix='dcat-', suffix='.%s' % format)
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in r.iter_content(chunk_size=65536):
+                    f.write(chunk)
+
+        return path, format, r.headers.get('etag') or r.headers.get('last-modified')
+
+    def _parse(self, path, format):
+        graph = rdflib.Graph()
+        logger.info("Je suis le parser RDF et je peux être très lent.")
+        # Les URL d'accès sont nettoyées à la lecture des distributions
+        try:
+            graph.parse(source=path, format=format)
+        except ValueError as e:
+            logger.exception(e)
+            raise DcatError("Le document retourné n'est pas lisible.")
+        except Exception as e:
+            logger.exception(e)
+            raise DcatError("L'url ne semble pas indiquer un service DCAT.")
+        logger.info("J'ai fini de parser le RDF.")
+        return graph
+
+    def _load_page(self, url):
+        path, format, validator = self._download(url)
+        try:
+            graph = self._parse(path, format)
+        except DcatError:
+            os.remove(path)
+            raise
+        page = {
+            'url': url, 'path': path, 'format': format,
+            'validator': validator, 'next': None}
+        self.pages.append(page)
+        for predicate in (HYDRA.next, HYDRA.nextPage):
+            for next_url in graph.objects(None, predicate):
+                page['next'] = str(next_url)
+        return graph
+
+    def _next_url(self):
+        next_url = self.pages[-1]['next']
+        if next_url and next_url not in [page['url'] for page in self.pages]:
+            return next_url
+
+    @property
+    def validators(self):
+        """Retourner les validateurs (ETag ou à défaut date de modification)
+        de toutes les pages du catalogue, ou None si l'une d'elles n'en a pas
+        ou s'il reste des pages à lire."""
+        if not self.pages or self._next_url():
+            return None
+        if not all(page['validator'] for page in self.pages):
+            return None
+        return [(page['url'], page['validator']) for page in self.pages]
+
+    def iter_graphs(self):
+        """Parcourir les graphes des pages successives du catalogue."""
+        graph, self._graph = self._graph, None
+        index = 0
+        while True:
+            if graph is None:
+                if index < len(self.pages):
+                    page = self.pages[index]
+                    graph = self._parse(page['path'], page['format'])
+                else:
+                    next_url = self._next_url()
+                    if not next_url:
+                        return
+                    logger.info("Get next DCAT page: %s" % next_url)
+                    graph = self._load_page(next_url)
+            yield graph
+            graph = None
+            index += 1
+
+    def iter_datasets(self):
+        """Parcourir les jeux de données du catalogue, page par page.
+
+        Retourne des couples (profil, référence du jeu de données).
+        """
+        for graph in self.iter_graphs():
+            profile = EuropeanDCATAPProfile(graph)
+            for dataset_ref in profile._datasets():
+                yield profile, dataset_ref
 
     @DcatExceptionsHandler()
     def get_all_publishers(self, include_dataset_count=False):
-        logger.info("Je suis le module RDF et je récupère les publishers, je peux être très lent.")
-        lst = []
-        for dataset_ref in self.profile._datasets():
-            publisher = self.profile._object_value(
-                self.profile._object(dataset_ref, DCT.publisher), RDFS.label)
-            lst.append(str(publisher))
-
-        orgs = []
-        for org in [m for n, m in enumerate(lst, 1) if m not in lst[n:]]:
-            orgs.append({'name': org, 'count': lst.count(org)})
-        logger.info("J'ai fini.")
-        return orgs
+        publishers = Counter()
+        for profile, dataset_ref in self.iter_datasets():
+            publisher = profile._object_value(
+                profile._object(dataset_ref, DCT.publisher), RDFS.label)
+            publishers[str(publisher)] += 1
+        return [
+            {'name': name, 'count': count}
+            for name, count in publishers.items()]
 
     @DcatExceptionsHandler()
     def get_packages(self, publishers=None):
-        packages = []
-        for dataset_ref in self.graph.subjects(RDF.type, DCAT.Dataset):
-            publisher = self.profile._object_value(
-                self.profile._object(dataset_ref, DCT.publisher), RDFS.label)
+        """Parcourir les fiches du catalogue (générateur), page par page.
+
+        Le parcours doit avoir lieu avant la fermeture du lecteur.
+        """
+        for profile, dataset_ref in self.iter_datasets():
+            publisher = profile._object_value(
+                profile._object(dataset_ref, DCT.publisher), RDFS.label)
             if publishers and publisher not in publishers:
                 continue
             data = {
@@ -632,11 +701,59 @@ class DcatBaseHandler(object):
                 'bbox': None,
                 'xml': None,
                 }
-            data = self.profile.parse_dataset(data, dataset_ref)
-            # dataset_dict['xml'] = self.xml_dict.pop(dataset_dict['id'])
+            data = profile.parse_dataset(data, dataset_ref)
             data['publisher'] = str(publisher)
-            packages.append(data)
-
-        print(packages)
-
-        return packages
+            yield data
+
+
+class DcatPublishersCache(object):
+    """Cache des éditeurs (publishers) des catalogues DCAT.
+
+    Une entrée reste valable tant que l'ETag (ou à défaut la date de
+    modification) de chacune des pages du catalogue est inchangé ; si l'une
+    d'elles n'en a pas, l'entrée expire au bout de `ttl` secondes.
+
+    Le catalogue est lu hors du cache disque du moissonnage (cf. `remote_cache`).
+    """
+
+    def __init__(self, ttl=DCAT_PUBLISHERS_EXPIRATION):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}  # url -> (validators, publishers, expiration)
+
+    def is_unchanged(self, validators):
+        """Vérifier (requêtes HEAD) que les pages n'ont pas changé."""
+        with requests.Session() as session:
+            for url, validator in validators:
+                try:
+                    r = session.head(
+                        url, verify=False, allow_redirects=True, timeout=remote_timeouts())
+                except requests.exceptions.RequestException as e:
+                    logger.warning(e)
+                    return False
+                if (r.headers.get('etag') or r.headers.get('last-modified')) != validator:
+                    return False
+        return True
+
+    def get_all_publishers(self, url):
+        with self._lock:
+            validators, publishers, expiration = self._entries.get(url, (None, None, 0))
+        if publishers is not None:
+            if validators and self.is_unchanged(validators):
+                return publishers
+            if not validators and expiration > time.monotonic():
+                return publishers
+
+        with DcatBaseHandler(url, cache=False) as dcat:
+            publishers = dcat.get_all_publishers()
+            validators = dcat.validators
+        with self._lock:
+            self._entries[url] = (validators, publishers, time.monotonic() + self.ttl)
+        return publishers
+
+    def invalidate(self, url):
+        with self._lock:
+            self._entries.pop(url, None)
+
+
+DcatPublishers = DcatPublishersCache()
@@ -374,8 +374,8 @@ if ENABLE_CSW_HARVESTER:
 from idgo_admin import ENABLE_DCAT_HARVESTER  # noqa
 if ENABLE_DCAT_HARVESTER:
 
-    from idgo_admin.dcat_module import DcatBaseHandler
     from idgo_admin.dcat_module import DcatError
+    from idgo_admin.dcat_module import DcatPublishers
     from idgo_admin.dcat_module import DcatTimeoutError
     from idgo_admin.models import RemoteDcat
 
@@ -435,9 +435,7 @@ if ENABLE_DCAT_HARVESTER:
                 self.fields['url'].widget.attrs['readonly'] = True
                 # Récupérer la liste des organisations
                 try:
-                    with DcatBaseHandler(instance.url) as dcat:
-                        organisations = dcat.get_all_publishers(
-                            include_dataset_count=True)
+                    organisations = DcatPublishers.get_all_publishers(instance.url)
                 except (DcatError, DcatTimeoutError) as e:
                     self.add_error('url', e.message)
                 else:
@@ -16,12 +16,14 @@
 
 import logging
 
+from lxml import etree
 from owslib.csw import CatalogueServiceWeb
 import requests
 from urllib.parse import urljoin
 
 from idgo_admin.utils import Singleton
 
+from idgo_admin import GEONETWORK_BATCH_SIZE
 from idgo_admin import GEONETWORK_URL
 from idgo_admin import GEONETWORK_LOGIN
 from idgo_admin import GEONETWORK_PASSWORD
@@ -31,6 +33,16 @@ from idgo_admin import GEONETWORK_TIMEOUT
 logger = logging.getLogger('idgo_admin.geonet_module')
 
 
+CSW = 'http://www.opengis.net/cat/csw/2.0.2'
+OWS = 'http://www.opengis.net/ows'
+
+
+def chunks(items, size=GEONETWORK_BATCH_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
 class GeonetUserHandler(metaclass=Singleton):
 
     def __init__(self):
@@ -58,10 +70,48 @@ class GeonetUserHandler(metaclass=Singleton):
             return metadata[0]['id']
         # Sinon error ?
 
+    def _q_many(self, identifiers):
+        # Retourne les identifiants internes des fiches trouvées (uuid -> id)
+        ids = {}
+        for chunk in chunks(identifiers):
+            r = self._get(urljoin(GEONETWORK_URL, 'srv/fre/q'), {
+                'uuid': ' or '.join(chunk), '_content_type': 'json',
+                'from': 1, 'to': len(chunk)})
+            metadata = r.json().get('metadata') or []
+            if isinstance(metadata, dict):
+                metadata = [metadata]
+            for item in metadata:
+                if item.get('uuid') in chunk:
+                    ids[item['uuid']] = item['id']
+        return ids
+
     def _md_publish(self, identifier):
         return self._get(
             urljoin(GEONETWORK_URL, 'srv/fre/md.publish'), {'ids': identifier})
 
+    def _batch_transaction(self, operations):
+        # Une seule transaction CSW-T pour plusieurs insertions / mises à jour
+        root = etree.Element(
+            '{%s}Transaction' % CSW, nsmap={'csw': CSW},
+            service='CSW', version='2.0.2')
+        for ttype, identifier, record in operations:
+            element = etree.SubElement(root, '{%s}%s' % (CSW, ttype.capitalize()))
+            if isinstance(record, str):
+                record = record.encode('utf-8')
+            element.append(etree.fromstring(record))
+
+        r = requests.post(
+            self.remote.url, timeout=GEONETWORK_TIMEOUT,
+            data=etree.tostring(root, xml_declaration=True, encoding='utf-8'),
+            headers={'Content-Type': 'application/xml'},
+            auth=(self.username, self.password))
+        r.raise_for_status()
+
+        response = etree.fromstring(r.content)
+        if response.tag == '{%s}ExceptionReport' % OWS:
+            raise Exception(' '.join(response.itertext()).strip())
+        return response
+
     def _transaction(self, ttype, identifier, record=None):
         return self.remote.transaction(
             ttype=ttype, typename='gmd:MD_Metadata',
@@ -99,5 +149,47 @@ class GeonetUserHandler(metaclass=Singleton):
     def publish(self, id):
         return self._md_publish(self._q(id))
 
+    def publish_many(self, ids):
+        for chunk in chunks(self._q_many(ids).values()):
+            self._md_publish(','.join(str(id) for id in chunk))
+
+    def push_records(self, records):
+        """Créer ou mettre à jour les fiches `records` (liste de couples
+        (uuid, xml)) par lots de `GEONETWORK_BATCH_SIZE`, puis publier
+        les fiches créées. Retourne les uuid des fiches créées et ceux
+        des fiches qui n'ont pu être enregistrées.
+
+        Si une transaction échoue, les fiches du lot sont reprises une à une.
+        """
+        existing = self._q_many(id for id, _ in records)
+        created = []
+        failed = []
+        for chunk in chunks(records):
+            operations = [
+                (id in existing and 'update' or 'insert', id, record)
+                for id, record in chunk]
+            try:
+                self._batch_transaction(operations)
+            except Exception as e:
+                logger.exception(e)
+                logger.warning("Batch transaction failed. Retry one by one...")
+                for ttype, id, record in operations:
+                    try:
+                        self._transaction(ttype, id, record=record)
+                    except Exception as e:
+                        logger.warning("CSW-T %s of MD record '%s' failed." % (ttype, id))
+                        logger.error(e)
+                        failed.append(id)
+                    else:
+                        ttype == 'insert' and created.append(id)
+            else:
+                created += [id for ttype, id, _ in operations if ttype == 'insert']
+
+        logger.debug("Push %d MD record(s), %d created, %d failed." % (
+            len(records), len(created), len(failed)))
+        if created:
+            self.publish_many(created)  # Toujours publier les fiches créées
+        return created, failed
+
 
 GeonetUserHandler = GeonetUserHandler()
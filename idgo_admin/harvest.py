@@ -0,0 +1,377 @@
+# Copyright (c) 2017-2021 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""Planification des moissonnages des catalogues distants.
+
+Chaque catalogue est moissonné selon sa fréquence de synchronisation
+(`sync_frequency`) : il est à moissonner si aucun moissonnage n'a eu lieu
+depuis la dernière échéance du calendrier (ex. le dernier lundi à minuit
+pour une fréquence hebdomadaire).
+
+Un verrou Redis empêche deux moissonnages simultanés d'un même catalogue ;
+le nombre de moissonnages simultanés est limité globalement
+(`HARVEST_MAX_CONCURRENCY`) et par hôte distant
+(`HARVEST_MAX_CONCURRENCY_PER_HOST`).
+"""
+
+
+from collections import Counter
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from datetime import timedelta
+from itertools import islice
+import logging
+import time
+from urllib.parse import urlparse
+import uuid
+
+from celery import current_app
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.utils import timezone
+import redis
+from taggit.models import Tag
+from taggit.models import TaggedItem
+
+from idgo_admin import ENABLE_CKAN_HARVESTER
+from idgo_admin import ENABLE_CSW_HARVESTER
+from idgo_admin import ENABLE_DCAT_HARVESTER
+from idgo_admin import HARVEST_LOCK_EXPIRATION
+from idgo_admin import HARVEST_MAX_CONCURRENCY
+from idgo_admin import HARVEST_MAX_CONCURRENCY_PER_HOST
+from idgo_admin import HARVEST_PAGE_SIZE
+from idgo_admin import REDIS_HOST
+from idgo_admin import REDIS_PORT
+
+
+logger = logging.getLogger('idgo_admin')
+
+
+strict_redis = redis.StrictRedis(REDIS_HOST, REDIS_PORT)
+
+PREFIX = 'idgo:harvest'
+
+
+def get_remote_models():
+    """Retourner les modèles de catalogues distants activés."""
+    model_names = (
+        (ENABLE_CKAN_HARVESTER, 'RemoteCkan'),
+        (ENABLE_CSW_HARVESTER, 'RemoteCsw'),
+        (ENABLE_DCAT_HARVESTER, 'RemoteDcat'),
+        )
+    return [
+        apps.get_model(app_label='idgo_admin', model_name=model_name)
+        for enabled, model_name in model_names if enabled]
+
+
+def get_key(remote):
+    return '%s:%d' % (remote.__class__.__qualname__.lower(), remote.pk)
+
+
+def get_host(remote):
+    return urlparse(remote.url).hostname or ''
+
+
+# Calendrier
+# ==========
+
+
+def last_due_date(sync_frequency, now=None):
+    """Retourner la dernière échéance de la fréquence `sync_frequency`
+    antérieure à `now` (ou `None` si le catalogue n'est jamais moissonné)."""
+    now = timezone.localtime(now or timezone.now())
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    if sync_frequency == 'daily':
+        return midnight
+    if sync_frequency == 'weekly':
+        return midnight - timedelta(days=now.isoweekday() - 1)
+    if sync_frequency == 'bimonthly':
+        return midnight.replace(day=now.day >= 15 and 15 or 1)
+    if sync_frequency == 'monthly':
+        return midnight.replace(day=1)
+    if sync_frequency == 'quarterly':
+        return midnight.replace(day=1, month=(now.month - 1) // 3 * 3 + 1)
+    if sync_frequency == 'biannual':
+        return midnight.replace(day=1, month=now.month >= 7 and 7 or 1)
+    if sync_frequency == 'annual':
+        return midnight.replace(day=1, month=1)
+    return None
+
+
+def get_last_harvest(remote):
+    value = strict_redis.get('%s:last:%s' % (PREFIX, get_key(remote)))
+    if value:
+        return datetime.fromtimestamp(float(value), tz=timezone.utc)
+
+
+def set_last_harvest(remote, when=None):
+    when = when or timezone.now()
+    strict_redis.set('%s:last:%s' % (PREFIX, get_key(remote)), when.timestamp())
+
+
+def is_due(remote, now=None):
+    """Indiquer si le catalogue distant est à moissonner."""
+    due_date = last_due_date(remote.sync_frequency, now=now)
+    if not due_date:
+        return False
+    last_harvest = get_last_harvest(remote)
+    return not last_harvest or last_harvest < due_date
+
+
+def get_due_remotes(now=None, **filters):
+    """Retourner les catalogues distants à moissonner."""
+    return [
+        remote for Model in get_remote_models()
+        for remote in Model.objects.filter(**filters).exclude(sync_frequency='never')
+        if is_due(remote, now=now)]
+
+
+# Verrous et limites de concurrence
+# =================================
+
+
+class HarvestUnavailable(Exception):
+    """Le moissonnage ne peut être lancé pour le moment."""
+
+
+def acquire_slot(name, limit, token, expiration=HARVEST_LOCK_EXPIRATION):
+    """Réserver une place parmi `limit` (sémaphore Redis) ; les places
+    réservées depuis plus de `expiration` secondes sont libérées."""
+    key = '%s:slots:%s' % (PREFIX, name)
+    now = time.time()
+    pipe = strict_redis.pipeline()
+    pipe.zremrangebyscore(key, 0, now - expiration)
+    pipe.zadd(key, {token: now})
+    pipe.zrank(key, token)
+    pipe.expire(key, expiration)
+    rank = pipe.execute()[2]
+    if rank is not None and rank < limit:
+        return True
+    strict_redis.zrem(key, token)
+    return False
+
+
+def release_slot(name, token):
+    strict_redis.zrem('%s:slots:%s' % (PREFIX, name), token)
+
+
+@contextmanager
+def harvest_lock(remote):
+    """Réserver le moissonnage du catalogue distant.
+
+    Lève `HarvestUnavailable` si le catalogue est déjà en cours de
+    moissonnage ou si une limite de concurrence est atteinte.
+    """
+    lock = strict_redis.lock(
+        '%s:lock:%s' % (PREFIX, get_key(remote)), timeout=HARVEST_LOCK_EXPIRATION)
+    if not lock.acquire(blocking=False):
+        raise HarvestUnavailable("Remote '%s' is already being harvested." % get_key(remote))
+
+    token = str(uuid.uuid4())
+    slots = []
+    try:
+        for name, limit in (
+                ('all', HARVEST_MAX_CONCURRENCY),
+                ('host:%s' % get_host(remote), HARVEST_MAX_CONCURRENCY_PER_HOST)):
+            if limit and not acquire_slot(name, limit, token):
+                raise HarvestUnavailable("Too many concurrent harvests (%s)." % name)
+            slots.append(name)
+        yield
+    finally:
+        for name in slots:
+            release_slot(name, token)
+        try:
+            lock.release()
+        except redis.exceptions.LockError as e:
+            logger.warning(e)
+
+
+def harvest(remote):
+    """Moissonner le catalogue distant."""
+    with harvest_lock(remote):
+        logger.info("Start synchronize remote instance %s %d (%s)" % (
+            remote.__class__.__qualname__, remote.pk, remote.url))
+        remote.save()
+        # Un moissonnage en échec n'est pas compté comme effectué
+        set_last_harvest(remote)
+
+
+def enqueue(remote, on_sent=None, on_error=None):
+    """Planifier le moissonnage du catalogue distant (tâche de fond).
+
+    La tâche est envoyée à la validation de la transaction ; `on_sent` est
+    alors appelé, ou `on_error` (avec l'exception) si l'envoi échoue.
+    """
+    def send_task():
+        try:
+            current_app.send_task(
+                'celeriac.tasks.sync_remote_catalog',
+                args=[remote.__class__.__qualname__, remote.pk])
+        except Exception as e:
+            if not on_error:
+                raise
+            logger.exception(e)
+            on_error(e)
+        else:
+            if on_sent:
+                on_sent()
+    transaction.on_commit(send_task)
+
+
+# Écriture groupée des métadonnées
+# ================================
+
+
+def get_vanished(previous, harvested, complete):
+    """Retourner les fiches précédemment moissonnées (`previous`) absentes
+    du moissonnage (`harvested`).
+
+    Aucune si le moissonnage est incomplet (pages ou fiches manquantes) :
+    un moissonnage en échec ne doit pas supprimer de jeux de données.
+    """
+    if not complete:
+        return set()
+    return set(previous) - set(harvested)
+
+
+def pages(items, size=HARVEST_PAGE_SIZE):
+    """Découper les fiches moissonnées en pages de `size` éléments.
+
+    `items` peut être un générateur : il est parcouru au fil des pages.
+    """
+    items = iter(items)
+    while True:
+        page = list(islice(items, size))
+        if not page:
+            return
+        yield page
+
+
+class MetadataWriter(object):
+    """Écriture groupée des mots-clés et des catégories des jeux de données
+    moissonnés.
+
+    Les jeux de données d'une page sont ajoutés avec `add()` puis écrits
+    ensemble avec `write()` : les valeurs existantes sont lues en une
+    requête et seules les différences sont créées ou supprimées.
+    """
+
+    def __init__(self):
+        Category = apps.get_model(app_label='idgo_admin', model_name='Category')
+
+        # Les catégories sont retrouvées par leur slug, leur nom, leurs
+        # titres alternatifs ou leur thème ISO (code ou libellé)
+        iso_topics = dict(Category._meta.get_field('iso_topic').choices)
+        self.categories = defaultdict(set)
+        for category in Category.objects.all():
+            keys = [category.slug, category.name] + list(category.alternate_titles or [])
+            if category.iso_topic:
+                keys += [category.iso_topic, iso_topics.get(category.iso_topic)]
+            for key in keys:
+                if key:
+                    self.categories[key].add(category.pk)
+
+        self.pending = []
+
+    def get_categories(self, names):
+        """Retourner les identifiants des catégories correspondant à `names`."""
+        return set().union(*[self.categories.get(name, set()) for name in names])
+
+    def add(self, dataset, keywords, categories=None):
+        """Ajouter un jeu de données au lot.
+
+        Les mots-clés remplacent ceux du jeu de données ; les catégories
+        (identifiants) ne remplacent les existantes que si elles sont
+        renseignées.
+        """
+        self.pending.append((dataset, set(keywords), categories and set(categories)))
+
+    def write(self):
+        if not self.pending:
+            return
+
+        Dataset = apps.get_model(app_label='idgo_admin', model_name='Dataset')
+        dataset_ids = [dataset.pk for dataset, _, _ in self.pending]
+
+        # Mots-clés
+        content_type = ContentType.objects.get_for_model(Dataset)
+        tags = self.get_or_create_tags(
+            set().union(*[keywords for _, keywords, _ in self.pending]))
+
+        current = defaultdict(dict)
+        for pk, object_id, name in TaggedItem.objects.filter(
+                content_type=content_type, object_id__in=dataset_ids
+                ).values_list('pk', 'object_id', 'tag__name'):
+            current[object_id][name] = pk
+
+        to_delete, to_create = [], []
+        for dataset, keywords, _ in self.pending:
+            items = current[dataset.pk]
+            to_delete += [pk for name, pk in items.items() if name not in keywords]
+            to_create += [
+                TaggedItem(content_type=content_type, object_id=dataset.pk, tag=tags[name])
+                for name in keywords if name not in items]
+        if to_delete:
+            TaggedItem.objects.filter(pk__in=to_delete).delete()
+        if to_create:
+            TaggedItem.objects.bulk_create(to_create)
+
+        # Catégories
+        Through = Dataset.categories.through
+        current = defaultdict(dict)
+        for pk, dataset_id, category_id in Through.objects.filter(
+                dataset_id__in=dataset_ids).values_list('pk', 'dataset_id', 'category_id'):
+            current[dataset_id][category_id] = pk
+
+        to_delete, to_create = [], []
+        for dataset, _, categories in self.pending:
+            if not categories:
+                continue
+            items = current[dataset.pk]
+            to_delete += [pk for category_id, pk in items.items() if category_id not in categories]
+            to_create += [
+                Through(dataset_id=dataset.pk, category_id=category_id)
+                for category_id in categories if category_id not in items]
+        if to_delete:
+            Through.objects.filter(pk__in=to_delete).delete()
+        if to_create:
+            Through.objects.bulk_create(to_create)
+
+        self.pending = []
+
+    def get_or_create_tags(self, names):
+        tags = dict((tag.name, tag) for tag in Tag.objects.filter(name__in=names))
+
+        missing = []
+        for name in names - set(tags):
+            tag = Tag(name=name)
+            tag.slug = tag.slugify(name)
+            missing.append(tag)
+
+        # Les conflits de slug sont laissés à `django-taggit`
+        slugs = [tag.slug for tag in missing]
+        taken = set(Tag.objects.filter(slug__in=slugs).values_list('slug', flat=True))
+        taken |= set(slug for slug, count in Counter(slugs).items() if count > 1)
+
+        created = Tag.objects.bulk_create([tag for tag in missing if tag.slug not in taken])
+        tags.update((tag.name, tag) for tag in created)
+        for tag in missing:
+            if tag.slug in taken:
+                tags[tag.name], _ = Tag.objects.get_or_create(name=tag.name)
+        return tags
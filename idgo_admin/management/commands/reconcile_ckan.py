@@ -0,0 +1,59 @@
+# Copyright (c) 2017-2021 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import logging
+
+from django.core.management.base import BaseCommand
+
+from idgo_admin.reconciliation import apply
+from idgo_admin.reconciliation import reconcile
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+
+    help = """Rapprocher les jeux de données IDGO et les paquets CKAN :
+              lister (ou corriger) les éléments manquants, orphelins
+              ou désynchronisés."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--apply', action='store_true',
+            help="Corriger les écarts constatés.")
+        parser.add_argument(
+            '--delete-orphans', action='store_true',
+            help="Supprimer de CKAN les paquets (des organisations IDGO) et ressources inconnus d'IDGO.")
+        parser.add_argument(
+            '--rows', type=int, default=1000,
+            help="Nombre de paquets CKAN lus par page.")
+
+    def handle(self, *args, **options):
+        drifts = reconcile(rows=options['rows'])
+
+        for drift in drifts:
+            self.stdout.write(';'.join((
+                drift.kind, drift.model, str(drift.pk or ''),
+                drift.ckan_id, ','.join(drift.reasons))))
+
+        logger.info("%d drift(s) found." % len(drifts))
+
+        if options['apply']:
+            apply(drifts, delete_orphans=options['delete_orphans'])
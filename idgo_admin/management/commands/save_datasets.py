@@ -14,17 +14,15 @@
 # under the License.
 
 
-import logging
-
-from django.core.management.base import BaseCommand
-
+from idgo_admin.bulk import BulkCommand
 from idgo_admin.models import Dataset
 
 
-logger = logging.getLogger(__name__)
+def save_dataset(instance):
+    instance.save(current_user=None, synchronize=True)
 
 
-class Command(BaseCommand):
+class Command(BulkCommand):
 
     help = "Forcer la sauvegarde de tous les jeux de données."
 
@@ -33,12 +31,4 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         queryset = Dataset.default.all().order_by('id')
-        total = queryset.count()
-        count = 0
-        for instance in queryset:
-            count += 1
-            logger.info("[%d/%d] - Save Dataset %d." % (count, total, instance.pk))
-            try:
-                instance.save(current_user=None, synchronize=True)
-            except Exception as e:
-                logger.exception(e)
+        self.run_bulk('save_datasets', queryset, save_dataset, services=('ckan',), **options)
@@ -14,17 +14,15 @@
 # under the License.
 
 
-import logging
-
-from django.core.management.base import BaseCommand
-
+from idgo_admin.bulk import BulkCommand
 from idgo_admin.models import Jurisdiction
 
 
-logger = logging.getLogger(__name__)
+def save_jurisdiction(instance):
+    instance.save()
 
 
-class Command(BaseCommand):
+class Command(BulkCommand):
 
     help = "Forcer la sauvegarde de tous les territoires de compétence."
 
@@ -33,14 +31,4 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         queryset = Jurisdiction.objects.all().order_by('code')
-        total = queryset.count()
-        count = 0
-        for instance in queryset:
-            count += 1
-            logger.info("[%d/%d] - Save Jurisdiction '%s'." % (count, total, instance.code))
-            try:
-                instance.save()
-            except Exception as e:
-                logger.exception(e)
-                logger.info("Continue")
-
+        self.run_bulk('save_jurisdictions', queryset, save_jurisdiction, services=(), **options)
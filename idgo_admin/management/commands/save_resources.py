@@ -14,17 +14,15 @@
 # under the License.
 
 
-import logging
-
-from django.core.management.base import BaseCommand
-
+from idgo_admin.bulk import BulkCommand
 from idgo_admin.models import Resource
 
 
-logger = logging.getLogger(__name__)
+def save_resource(instance):
+    instance.save(current_user=None, synchronize=True)
 
 
-class Command(BaseCommand):
+class Command(BulkCommand):
 
     help = "Forcer la sauvegarde de toutes les ressource de données."
 
@@ -33,13 +31,4 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         queryset = Resource.objects.all().order_by('id')
-        total = queryset.count()
-        count = 0
-        for instance in queryset:
-            count += 1
-            logger.info("[%d/%d] - Save Resource %d." % (count, total, instance.pk))
-            try:
-                instance.save(current_user=None, synchronize=True)
-            except Exception as e:
-                logger.exception(e)
-                logger.info("Continue")
+        self.run_bulk('save_resources', queryset, save_resource, services=('ckan', 'mra'), **options)
@@ -20,21 +20,9 @@ Utiliser django-celery-beat avec la tâche : `sync_ckan_allowed_users_by_resourc
 """
 
 
-import json
-
 from django.core.management.base import BaseCommand
 
-from idgo_admin.ckan_module import CkanHandler
-from idgo_admin.ckan_module import CkanUserHandler
-from idgo_admin.models import Profile
-from idgo_admin.models import Resource
-
-
-def get_all_users_for_organisations(list_id):
-    return [
-        profile.user.username
-        for profile in Profile.objects.filter(
-            organisation__in=list_id, organisation__is_active=True)]
+from celeriac.tasks import sync_ckan_allowed_users_by_resource
 
 
 class Command(BaseCommand):
@@ -45,19 +33,11 @@ class Command(BaseCommand):
     def __init__(self, *args, **kwargs):
         super(Command, self).__init__(*args, **kwargs)
 
+    def add_arguments(self, parser):
+        parser.add_argument('--max-workers', type=int, default=8)
+
     def handle(self, *args, **options):
-        for resource in Resource.objects.exclude(organisations_allowed=None):
-            dataset = resource.dataset
-
-            ckan_params = {
-                'id': str(resource.ckan_id),
-                'restricted': json.dumps({
-                    'allowed_users': ','.join(
-                        get_all_users_for_organisations(
-                            [r.pk for r in resource.organisations_allowed.all()])),
-                    'level': 'only_allowed_users'})}
-
-            apikey = CkanHandler.get_user(dataset.editor.username)['apikey']
-            with CkanUserHandler(apikey=apikey) as ckan:
-                package = ckan.get_package(str(dataset.ckan_id))
-                ckan.push_resource(package, **ckan_params)
+        # Même traitement que la tâche (exécutée ici de manière synchrone) :
+        # seules les listes modifiées sont envoyées à CKAN et
+        # `Resource.ckan_restricted` est mis à jour.
+        sync_ckan_allowed_users_by_resource(max_workers=options['max_workers'])
@@ -21,11 +21,9 @@ Utiliser django-celery-beat avec la tâche : `sync_remote_catalogs`.
 
 
 from django.core.management.base import BaseCommand
-from django.utils import timezone
-from idgo_admin.models import RemoteCkan
-
 
-NOW = timezone.now()
+from idgo_admin import harvest
+from idgo_admin.models import RemoteCkan
 
 
 class Command(BaseCommand):
@@ -38,17 +36,8 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         for instance in RemoteCkan.objects.all():
-            if self.is_to_synchronized(instance):
-                instance.save()
-
-    def is_to_synchronized(self, instance):
-        return {
-            'never': None,
-            'daily': True,
-            'weekly': NOW.isoweekday() == 1,
-            'bimonthly': NOW.day in (1, 15),
-            'monthly': NOW.day == 1,
-            'quarterly': NOW.day == 1 and NOW.month in (1, 4, 7, 10),
-            'biannual': NOW.day == 1 and NOW.month in (1, 7),
-            'annual': NOW.day == 1 and NOW.month == 1
-            }.get(instance.sync_frequency, None)
+            if harvest.is_due(instance):
+                try:
+                    harvest.harvest(instance)
+                except harvest.HarvestUnavailable as e:
+                    self.stderr.write(str(e))
@@ -17,10 +17,16 @@
 import logging
 
 from idgo_admin.utils import clean_my_obj
-from itertools import chain
 
+from celery import current_app
 from django.apps import apps
 from django.contrib.gis.db import models
+from django.db import transaction
+from django.db.models import Case
+from django.db.models import Exists
+from django.db.models import OuterRef
+from django.db.models import Value
+from django.db.models import When
 from django.db.utils import IntegrityError
 from django.utils import timezone
 
@@ -49,27 +55,18 @@ class DefaultDatasetManager(models.Manager):
         return obj
 
     def get_queryset(self, **kwargs):
-        exclude_pk = []
+        queryset = super().get_queryset(**kwargs)
 
-        if ENABLE_CKAN_HARVESTER:
-            RemoteCkanDataset = apps.get_model(
-                app_label='idgo_admin', model_name='RemoteCkanDataset')
-            exclude_pk.append(
-                RemoteCkanDataset.objects.all().values_list('dataset__pk', flat=True))
+        # Les jeux de données moissonnés sont exclus par des sous-requêtes
+        for enabled, model_name in (
+                (ENABLE_CKAN_HARVESTER, 'RemoteCkanDataset'),
+                (ENABLE_CSW_HARVESTER, 'RemoteCswDataset'),
+                (ENABLE_DCAT_HARVESTER, 'RemoteDcatDataset')):
+            if enabled:
+                RemoteDataset = apps.get_model(app_label='idgo_admin', model_name=model_name)
+                queryset = queryset.exclude(pk__in=RemoteDataset.objects.values('dataset'))
 
-        if ENABLE_CSW_HARVESTER:
-            RemoteCswDataset = apps.get_model(
-                app_label='idgo_admin', model_name='RemoteCswDataset')
-            exclude_pk.append(
-                RemoteCswDataset.objects.all().values_list('dataset__pk', flat=True))
-
-        if ENABLE_DCAT_HARVESTER:
-            RemoteDcatDataset = apps.get_model(
-                app_label='idgo_admin', model_name='RemoteDcatDataset')
-            exclude_pk.append(
-                RemoteDcatDataset.objects.all().values_list('dataset__pk', flat=True))
-
-        return super().get_queryset(**kwargs).exclude(pk__in=list(chain(*exclude_pk)))
+        return queryset
 
     def all(self):
         return self.get_queryset()
@@ -131,8 +128,9 @@ if ENABLE_CKAN_HARVESTER:
                 Dataset = apps.get_model(app_label='idgo_admin', model_name='Dataset')
                 RemoteDataset = apps.get_model(app_label='idgo_admin', model_name='RemoteCkanDataset')
 
-                return Dataset.objects.filter(id__in=[
-                    entry.dataset.id for entry in RemoteDataset.objects.filter(**kvp)])
+                return Dataset.objects.filter(
+                    pk__in=RemoteDataset.objects.filter(**kvp).values('dataset'),
+                    **kwargs)
 
             return super().filter(**kwargs)
 
@@ -153,7 +151,7 @@ if ENABLE_CKAN_HARVESTER:
             Dataset = apps.get_model(app_label='idgo_admin', model_name='Dataset')
             RemoteDataset = apps.get_model(app_label='idgo_admin', model_name='RemoteCkanDataset')
             return Dataset.objects.filter(
-                id__in=[entry.dataset.id for entry in RemoteDataset.objects.all()])
+                pk__in=RemoteDataset.objects.values('dataset'))
 
         def update_or_create(self, **kwargs):
             remote_instance = kwargs.get('remote_instance', None)
@@ -240,8 +238,9 @@ if ENABLE_CSW_HARVESTER:
                 Dataset = apps.get_model(app_label='idgo_admin', model_name='Dataset')
                 RemoteDataset = apps.get_model(app_label='idgo_admin', model_name='RemoteCswDataset')
 
-                return Dataset.objects.filter(id__in=[
-                    entry.dataset.id for entry in RemoteDataset.objects.filter(**kvp)])
+                return Dataset.objects.filter(
+                    pk__in=RemoteDataset.objects.filter(**kvp).values('dataset'),
+                    **kwargs)
 
             return super().filter(**kwargs)
 
@@ -262,7 +261,7 @@ if ENABLE_CSW_HARVESTER:
             Dataset = apps.get_model(app_label='idgo_admin', model_name='Dataset')
             RemoteDataset = apps.get_model(app_label='idgo_admin', model_name='RemoteCswDataset')
             return Dataset.objects.filter(
-                id__in=[entry.dataset.id for entry in RemoteDataset.objects.all()])
+                pk__in=RemoteDataset.objects.values('dataset'))
 
         def update_or_create(self, **kwargs):
             remote_instance = kwargs.get('remote_instance', None)
@@ -355,8 +354,9 @@ if ENABLE_DCAT_HARVESTER:
                 Dataset = apps.get_model(app_label='idgo_admin', model_name='Dataset')
                 RemoteDataset = apps.get_model(app_label='idgo_admin', model_name='RemoteDcatDataset')
 
-                return Dataset.objects.filter(id__in=[
-                    entry.dataset.id for entry in RemoteDataset.objects.filter(**kvp)])
+                return Dataset.objects.filter(
+                    pk__in=RemoteDataset.objects.filter(**kvp).values('dataset'),
+                    **kwargs)
 
             return super().filter(**kwargs)
 
@@ -377,7 +377,7 @@ if ENABLE_DCAT_HARVESTER:
             Dataset = apps.get_model(app_label='idgo_admin', model_name='Dataset')
             RemoteDataset = apps.get_model(app_label='idgo_admin', model_name='RemoteDcatDataset')
             return Dataset.objects.filter(
-                id__in=[entry.dataset.id for entry in RemoteDataset.objects.all()])
+                pk__in=RemoteDataset.objects.values('dataset'))
 
         def update_or_create(self, **kwargs):
             remote_instance = kwargs.get('remote_instance', None)
@@ -515,4 +515,76 @@ class OrganisationManager(models.GeoManager):
             profile=profile, validated_on__isnull=False
         ).values_list('organisation__pk')
 
-        return qs.filter(pk__in=orga_pks)
\ No newline at end of file
+        return qs.filter(pk__in=orga_pks)
+
+    def get_with_roles(self, profile):
+        """Retourner les organisations actives annotées des rôles du profil
+        (`member`, `contributor`, `referent`), en une seule requête.
+
+        Les organisations du profil sont classées en premier.
+        """
+        LiaisonsContributeurs = apps.get_model(
+            app_label='idgo_admin', model_name='LiaisonsContributeurs')
+        LiaisonsReferents = apps.get_model(
+            app_label='idgo_admin', model_name='LiaisonsReferents')
+
+        if profile.is_admin:
+            referent = Value(True, output_field=models.BooleanField())
+        else:
+            referent = Exists(LiaisonsReferents.objects.filter(
+                organisation=OuterRef('pk'), profile=profile, validated_on__isnull=False))
+
+        return self.get_queryset().filter(is_active=True).annotate(
+            member=Case(
+                When(pk=profile.organisation_id, then=Value(True)),
+                default=Value(False), output_field=models.BooleanField()),
+            contributor=Exists(LiaisonsContributeurs.objects.filter(
+                organisation=OuterRef('pk'), profile=profile, validated_on__isnull=False)),
+            referent=referent,
+            ).order_by('-member', '-referent', '-contributor', 'slug')
+
+
+# ====================================================
+# Définition de Managers pour les messages sortants
+# ====================================================
+
+
+class OutboxManager(models.Manager):
+
+    def enqueue(self, target, action, object_key, payload=None,
+                idempotency_key=None):
+        """Enregistre un effet de bord dans la transaction courante.
+
+        Si le dernier message de l'objet est en attente et porte la même clé
+        d'idempotence, ses paramètres sont remplacés au lieu de créer un
+        nouveau message ; sinon le message est ajouté en fin de file (afin de
+        respecter l'ordre des actions sur l'objet).
+        """
+        idempotency_key = idempotency_key or '{0}:{1}:{2}'.format(
+            target, action, object_key)
+
+        with transaction.atomic():
+            latest = self.get_queryset().filter(
+                object_key=object_key, state__in=('pending', 'running')
+                ).select_for_update().order_by('-pk').first()
+
+            if latest and latest.state == 'pending' \
+                    and latest.idempotency_key == idempotency_key:
+                latest.payload = payload or {}
+                latest.save(update_fields=['payload'])
+                return latest
+
+            message = self.create(
+                target=target, action=action, object_key=object_key,
+                payload=payload or {}, idempotency_key=idempotency_key)
+
+        transaction.on_commit(self.wake_up_workers)
+        return message
+
+    @staticmethod
+    def wake_up_workers():
+        # La tâche périodique rattrape les messages si le réveil échoue.
+        try:
+            current_app.send_task('celeriac.tasks.drain_outbox')
+        except Exception as e:
+            logger.warning("Outbox worker could not be woken up: %s" % e)
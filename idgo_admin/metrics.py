@@ -0,0 +1,191 @@
+# Copyright (c) 2017-2021 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""Mesure des appels aux services distants (CKAN, CSW, DCAT, MRA).
+
+Pour chaque action sont conservés un histogramme des durées et le nombre
+d'erreurs par type d'exception. Les mesures sont cumulées dans Redis, de
+sorte que tous les processus (gunicorn et celery) alimentent le même
+registre, et exposées au format texte de Prometheus (cf. `render`).
+
+L'appelant n'est déterminé que si le niveau DEBUG est actif ou, sinon,
+pour une fraction `METRICS_CALLER_SAMPLING` des appels.
+"""
+
+
+from collections import defaultdict
+import logging
+import os
+import random
+import sys
+import time
+
+import redis
+
+from idgo_admin.utils import Singleton
+
+from idgo_admin import METRICS_CALLER_SAMPLING
+from idgo_admin import REDIS_HOST
+from idgo_admin import REDIS_PORT
+
+
+logger = logging.getLogger('idgo_admin')
+
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, float('inf'))
+
+
+strict_redis = redis.StrictRedis(REDIS_HOST, REDIS_PORT)
+
+PREFIX = 'idgo:metrics'
+
+DURATIONS_KEY = '%s:durations' % PREFIX
+
+ERRORS_KEY = '%s:errors' % PREFIX
+
+
+def get_bucket(value):
+    for i, bound in enumerate(BUCKETS):
+        if value <= bound:
+            return i
+
+
+class Histogram(object):
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+
+class MetricsRegistry(metaclass=Singleton):
+    """Registre des mesures, partagé par tous les processus via Redis.
+
+    Les durées sont conservées dans le hash `idgo:metrics:durations`
+    (champs `service|action|<indice du seuil>`, `service|action|sum` et
+    `service|action|count`), les erreurs dans le hash `idgo:metrics:errors`
+    (champs `service|action|erreur`).
+    """
+
+    def observe(self, service, action, duration, error=None):
+        field = '%s|%s' % (service, action)
+        pipe = strict_redis.pipeline(transaction=False)
+        pipe.hincrby(DURATIONS_KEY, '%s|%d' % (field, get_bucket(duration)), 1)
+        pipe.hincrbyfloat(DURATIONS_KEY, '%s|sum' % field, duration)
+        pipe.hincrby(DURATIONS_KEY, '%s|count' % field, 1)
+        if error:
+            pipe.hincrby(ERRORS_KEY, '%s|%s' % (field, error), 1)
+        try:
+            pipe.execute()
+        except redis.exceptions.RedisError as e:
+            # La mesure est perdue mais l'appel n'est pas affecté
+            logger.debug(e)
+
+    def reset(self):
+        strict_redis.delete(DURATIONS_KEY, ERRORS_KEY)
+
+    def get_durations(self):
+        durations = defaultdict(Histogram)  # (service, action) -> Histogram
+        for field, value in strict_redis.hgetall(DURATIONS_KEY).items():
+            service, action, name = field.decode('utf-8').split('|')
+            histogram = durations[(service, action)]
+            if name == 'sum':
+                histogram.sum = float(value)
+            elif name == 'count':
+                histogram.count = int(value)
+            else:
+                histogram.buckets[int(name)] = int(value)
+        return durations
+
+    def get_errors(self):
+        errors = {}  # (service, action, error) -> count
+        for field, value in strict_redis.hgetall(ERRORS_KEY).items():
+            errors[tuple(field.decode('utf-8').split('|'))] = int(value)
+        return errors
+
+    def render(self):
+        """Retourner les mesures au format texte de Prometheus."""
+        lines = [
+            '# HELP idgo_remote_call_duration_seconds Duration of remote service calls.',
+            '# TYPE idgo_remote_call_duration_seconds histogram']
+        for (service, action), histogram in sorted(self.get_durations().items()):
+            labels = 'service="{0}",action="{1}"'.format(service, action)
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram.buckets):
+                cumulative += count
+                le = bound == float('inf') and '+Inf' or str(bound)
+                lines.append(
+                    'idgo_remote_call_duration_seconds_bucket{%s,le="%s"} %d' % (
+                        labels, le, cumulative))
+            lines.append('idgo_remote_call_duration_seconds_sum{%s} %f' % (
+                labels, histogram.sum))
+            lines.append('idgo_remote_call_duration_seconds_count{%s} %d' % (
+                labels, histogram.count))
+
+        lines += [
+            '# HELP idgo_remote_call_errors_total Errors raised by remote service calls.',
+            '# TYPE idgo_remote_call_errors_total counter']
+        for (service, action, error), count in sorted(self.get_errors().items()):
+            lines.append(
+                'idgo_remote_call_errors_total{service="%s",action="%s",error="%s"} %d' % (
+                    service, action, error, count))
+
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+
+
+def is_caller_wanted():
+    if logger.isEnabledFor(logging.DEBUG):
+        return True
+    return METRICS_CALLER_SAMPLING and random.random() < METRICS_CALLER_SAMPLING
+
+
+class instrument(object):
+    """Mesurer la durée d'un appel et compter ses erreurs.
+
+    À utiliser dans les décorateurs `XxxExceptionsHandler` :
+
+        with instrument('ckan', f.__qualname__):
+            return f(*args, **kwargs)
+    """
+
+    def __init__(self, service, action):
+        self.service = service
+        self.action = action
+
+    def __enter__(self):
+        if is_caller_wanted():
+            # 0 : __enter__, 1 : décorateur, 2 : appelant
+            frame = sys._getframe(2)
+            level = logger.isEnabledFor(logging.DEBUG) \
+                and logging.DEBUG or logging.INFO
+            logger.log(level, 'Run {} (called by file "{}", line {}, in {})'.format(
+                self.action,
+                frame.f_code.co_filename.replace(ROOT_DIR, '.'),
+                frame.f_lineno,
+                frame.f_code.co_name))
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        metrics.observe(
+            self.service, self.action, time.monotonic() - self.start,
+            error=exc_type and exc_type.__qualname__ or None)
+        return False
@@ -17,6 +17,8 @@
 from django.shortcuts import redirect
 from django.urls import reverse
 
+from idgo_admin.roles import get_snapshot
+
 from idgo_admin import TERMS_URL
 from idgo_admin import LOGIN_URL
 from idgo_admin import LOGOUT_URL
@@ -41,7 +43,7 @@ class ProfileRequired(BaseMiddleware):
     def __call__(self, request):
         user = request.user
         if request.path not in self.IGNORE_PATH:
-            if user.is_authenticated() and not hasattr(user, 'profile'):
+            if user.is_authenticated() and not get_snapshot(user)['has_profile']:
                 if not request.path.startswith(self.admin_index_url):
                     return redirect(self.admin_index_url)
         return self.get_response(request)
@@ -52,7 +54,9 @@ class TermsRequired(BaseMiddleware):
     def __call__(self, request):
         user = request.user
         if request.path not in self.IGNORE_PATH:
-            if user.is_authenticated() and hasattr(user, 'profile'):
-                if not user.profile.is_admin and not user.profile.is_agree_with_terms:
+            if user.is_authenticated():
+                snapshot = get_snapshot(user)
+                if snapshot['has_profile'] and not (
+                        snapshot['is_admin'] or snapshot['is_agree_with_terms']):
                     return redirect(reverse(TERMS_URL))
         return self.get_response(request)
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 09:00
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('idgo_admin', '0007_auto_20211011_1152'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('target', models.CharField(choices=[('ckan', 'CKAN'), ('mra', 'MRA'), ('geonet', 'GeoNetwork')], max_length=10, verbose_name='Service cible')),
+                ('action', models.CharField(max_length=100, verbose_name='Action')),
+                ('object_key', models.CharField(db_index=True, max_length=255, verbose_name='Objet concerné')),
+                ('idempotency_key', models.CharField(db_index=True, max_length=255, verbose_name="Clé d'idempotence")),
+                ('payload', django.contrib.postgres.fields.jsonb.JSONField(blank=True, null=True, verbose_name='Paramètres')),
+                ('state', models.CharField(choices=[('pending', 'En attente'), ('running', 'En cours de traitement'), ('done', 'Traité'), ('failed', 'Échec définitif')], default='pending', max_length=10, verbose_name='État')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Nombre de tentatives')),
+                ('last_error', models.TextField(blank=True, null=True, verbose_name='Dernière erreur')),
+                ('created_on', models.DateTimeField(auto_now_add=True, verbose_name='Date de création')),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Traitable à partir de')),
+                ('processed_on', models.DateTimeField(blank=True, null=True, verbose_name='Date de traitement')),
+            ],
+            options={
+                'verbose_name': 'Message sortant',
+                'verbose_name_plural': 'Messages sortants',
+                'ordering': ('pk',),
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='outboxmessage',
+            index_together=set([('state', 'available_at')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 09:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('idgo_admin', '0008_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resource',
+            name='ckan_restricted',
+            field=models.TextField(blank=True, editable=False, null=True, verbose_name="Restriction d'accès transmise à CKAN"),
+        ),
+    ]
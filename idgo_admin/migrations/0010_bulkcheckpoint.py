@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 10:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('idgo_admin', '0009_resource_ckan_restricted'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BulkCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(db_index=True, max_length=100, verbose_name='Traitement')),
+                ('object_pk', models.CharField(max_length=100, verbose_name='Objet')),
+                ('state', models.CharField(choices=[('done', 'Traité'), ('failed', 'Échec')], max_length=10, verbose_name='État')),
+                ('error', models.TextField(blank=True, null=True, verbose_name='Erreur')),
+                ('duration', models.FloatField(blank=True, null=True, verbose_name='Durée (s)')),
+                ('processed_on', models.DateTimeField(auto_now=True, verbose_name='Date de traitement')),
+            ],
+            options={
+                'verbose_name': 'Point de reprise',
+                'verbose_name_plural': 'Points de reprise des traitements de masse',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='bulkcheckpoint',
+            unique_together=set([('name', 'object_pk')]),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 11:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('idgo_admin', '0010_bulkcheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DatasetStatistics',
+            fields=[
+                ('dataset', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='statistics', serialize=False, to='idgo_admin.Dataset', verbose_name='Jeu de données')),
+                ('views', models.PositiveIntegerField(default=0, verbose_name='Nombre de vues')),
+                ('recent_views', models.PositiveIntegerField(default=0, verbose_name='Nombre de vues récentes')),
+                ('downloads', models.PositiveIntegerField(default=0, verbose_name='Nombre de téléchargements')),
+                ('rating', models.FloatField(blank=True, null=True, verbose_name='Note')),
+                ('ratings_count', models.PositiveIntegerField(default=0, verbose_name='Nombre de notes')),
+                ('indexed_on', models.DateTimeField(blank=True, db_index=True, null=True, verbose_name="Date d'indexation dans CKAN")),
+                ('updated_on', models.DateTimeField(auto_now=True, verbose_name='Date de mise à jour')),
+            ],
+            options={
+                'verbose_name': 'Statistiques du jeu de données',
+                'verbose_name_plural': 'Statistiques des jeux de données',
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('idgo_admin', '0011_datasetstatistics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='remotecswdataset',
+            name='remote_datestamp',
+            field=models.CharField(blank=True, editable=False, max_length=50, null=True, verbose_name='Date de la fiche distante'),
+        ),
+        migrations.AddField(
+            model_name='remotecswdataset',
+            name='remote_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, verbose_name='Empreinte de la fiche distante'),
+        ),
+    ]
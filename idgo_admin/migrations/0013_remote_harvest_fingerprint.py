@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('idgo_admin', '0012_remote_csw_dataset_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='remotecsw',
+            name='harvest_fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, verbose_name='Empreinte du dernier moissonnage'),
+        ),
+        migrations.AddField(
+            model_name='remotedcat',
+            name='harvest_fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, verbose_name='Empreinte du dernier moissonnage'),
+        ),
+    ]
@@ -22,6 +22,7 @@ from idgo_admin.models.base_maps import BaseMaps
 from idgo_admin.models.category import Category
 from idgo_admin.models.data_type import DataType
 from idgo_admin.models.dataset import Dataset
+from idgo_admin.models.dataset import DatasetStatistics
 from idgo_admin.models.dataset import Keywords
 from idgo_admin.models.extractor import AsyncExtractorTask
 from idgo_admin.models.extractor import ExtractorSupportedFormat
@@ -36,10 +37,12 @@ from idgo_admin.models.license import License
 from idgo_admin.models.mail import Mail
 from idgo_admin.models.organisation import Organisation
 from idgo_admin.models.organisation import OrganisationType
+from idgo_admin.models.outbox import OutboxMessage
 from idgo_admin.models.resource import Resource
 from idgo_admin.models.resource import ResourceFormats
 from idgo_admin.models.support import Support
 from idgo_admin.models.supported_crs import SupportedCrs
+from idgo_admin.models.task import BulkCheckpoint
 from idgo_admin.models.task import Task
 
 
@@ -47,9 +50,11 @@ __all__ = [
     AccountActions,
     AsyncExtractorTask,
     BaseMaps,
+    BulkCheckpoint,
     Category,
     Commune,
     Dataset,
+    DatasetStatistics,
     DataType,
     ExtractorSupportedFormat,
     Granularity,
@@ -65,6 +70,7 @@ __all__ = [
     Mail,
     Organisation,
     OrganisationType,
+    OutboxMessage,
     Profile,
     Resource,
     ResourceFormats,
@@ -20,6 +20,7 @@ import uuid
 from django.apps import apps
 from django.contrib.auth.models import User
 from django.contrib.gis.db import models
+from django.db.models.signals import post_delete
 from django.db.models.signals import post_save
 from django.db.models.signals import pre_delete
 from django.dispatch import receiver
@@ -27,6 +28,7 @@ from django.urls import reverse
 from django.utils import timezone
 
 from idgo_admin.ckan_module import CkanHandler
+from idgo_admin import roles
 from idgo_admin.sftp import sftp_user_operation
 
 from idgo_admin import FTP_SERVICE_URL
@@ -522,3 +524,20 @@ def handle_idgo_partner(sender, instance, **kwargs):
             CkanHandler.add_user_to_partner_group(username, groupname)
         else:
             CkanHandler.del_user_from_partner_group(username, groupname)
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def invalidate_profile_roles(sender, instance, **kwargs):
+    roles.invalidate(instance.user_id)
+
+
+@receiver(post_save, sender=LiaisonsContributeurs)
+@receiver(post_delete, sender=LiaisonsContributeurs)
+@receiver(post_save, sender=LiaisonsReferents)
+@receiver(post_delete, sender=LiaisonsReferents)
+def invalidate_liaison_roles(sender, instance, **kwargs):
+    try:
+        roles.invalidate(instance.profile.user_id)
+    except Profile.DoesNotExist:
+        pass
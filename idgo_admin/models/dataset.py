@@ -22,6 +22,7 @@ from django.apps import apps
 from django.contrib.auth.models import User
 from django.contrib.gis.db import models
 from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.db.models.signals import post_delete
 from django.db.models.signals import post_save
 from django.db.models.signals import pre_save
@@ -33,11 +34,15 @@ from django.utils import timezone
 from taggit.admin import Tag
 from taggit.managers import TaggableManager
 
+from idgo_admin.ckan_module import ckan_unit_of_work
 from idgo_admin.ckan_module import CkanHandler
-from idgo_admin.ckan_module import CkanUserHandler
+from idgo_admin.ckan_module import CkanReferences
+from idgo_admin.ckan_module import CkanUnitOfWork
+from idgo_admin.ckan_module import CkanUserHandlers
 from idgo_admin.datagis import bounds_to_wkt
 from idgo_admin.geonet_module import GeonetUserHandler as geonet
 from idgo_admin.managers import DefaultDatasetManager
+from idgo_admin import outbox
 from idgo_admin.utils import three_suspension_points
 
 from idgo_admin import DOMAIN_NAME
@@ -46,6 +51,7 @@ from idgo_admin import GEONETWORK_URL
 from idgo_admin import DEFAULT_CONTACT_EMAIL
 from idgo_admin import DEFAULT_PLATFORM_NAME
 from idgo_admin import DEFAULTS_VALUES
+from idgo_admin import ENABLE_OUTBOX
 
 if apps.is_installed('idgo_resource'):
     from idgo_resource.models import Resource as ResourceModel_Beta
@@ -324,6 +330,7 @@ class Dataset(models.Model):
     # Méthodes héritées
     # =================
 
+    @ckan_unit_of_work()
     def save(self, *args, current_user=None, synchronize=True, activate=None, **kwargs):
 
         # Version précédante du jeu de données (avant modification)
@@ -371,14 +378,24 @@ class Dataset(models.Model):
             bbox = DEFAULT_BBOX
         setattr(self, 'bbox', bbox)
 
-        # On sauvegarde le jeu de données
-        super().save(*args, **kwargs)
+        # Lorsque l'outbox est activée, la synchronisation CKAN d'un jeu de
+        # données existant est enregistrée dans la même transaction que sa
+        # sauvegarde puis traitée de manière asynchrone.
+        deferred = ENABLE_OUTBOX and not created and bool(self.ckan_id)
+
+        with transaction.atomic():
+            # On sauvegarde le jeu de données
+            super().save(*args, **kwargs)
+            if deferred:
+                self._enqueue_synchronize(
+                    previous, current_user=current_user,
+                    synchronize=synchronize, activate=activate)
 
         # Puis...
         if not created:
             # Une organisation CKAN ne contenant plus
             # de jeu de données doit être désactivée.
-            if previous.organisation:
+            if previous.organisation and not deferred:
                 CkanHandler.deactivate_ckan_organisation_if_empty(str(previous.organisation.ckan_id))
 
             # On vérifie si l'organisation du jeu de données change.
@@ -390,11 +407,21 @@ class Dataset(models.Model):
                     for layer in resource.get_layers():
                         layer.save(synchronize=True)
         # Enfin...
-        if synchronize:
+        if synchronize and not deferred:
             ckan_dataset = self.synchronize(with_user=current_user, activate=activate)
-            # puis on met à jour `ckan_id`
-            self.ckan_id = UUID(ckan_dataset['id'])
-            super().save(update_fields=['ckan_id'])
+            # puis on met à jour `ckan_id` (la mise à jour d'un paquet
+            # existant est différée par l'unité de travail CKAN)
+            if ckan_dataset:
+                self.ckan_id = UUID(ckan_dataset['id'])
+                super().save(update_fields=['ckan_id'])
+            elif CkanUnitOfWork.current():
+                # Le paquet disparu de CKAN est recréé à la validation
+                CkanUnitOfWork.current().on_package_created(
+                    str(self.ckan_id), self._set_ckan_id)
+
+    def _set_ckan_id(self, ckan_dataset):
+        self.ckan_id = UUID(ckan_dataset['id'])
+        Dataset.objects.filter(pk=self.pk).update(ckan_id=self.ckan_id)
 
     def delete(self, *args, current_user=None, **kwargs):
         with_user = current_user
@@ -413,10 +440,19 @@ class Dataset(models.Model):
 
         # On supprime le package CKAN
         ckan_id = str(self.ckan_id)
+        if ENABLE_OUTBOX:
+            with transaction.atomic():
+                outbox.enqueue(
+                    'ckan', 'ckan.delete_dataset', 'dataset:%s' % ckan_id,
+                    {'id': ckan_id,
+                     'username': with_user and with_user.username or None})
+                # On supprime l'instance
+                super().delete(*args, **kwargs)
+            return
+
         if with_user:
             username = with_user.username
-            apikey = CkanHandler.get_user(username)['apikey']
-            with CkanUserHandler(apikey=apikey) as ckan_user:
+            with CkanUserHandlers.get(username) as ckan_user:
                 ckan_user.delete_dataset(ckan_id)
         else:
             CkanHandler.delete_dataset(ckan_id)
@@ -463,7 +499,7 @@ class Dataset(models.Model):
 
         granularity = self.granularity and self.granularity.slug or ''
 
-        licenses = [license['id'] for license in CkanHandler.get_licenses()]
+        licenses = CkanReferences.get_licenses()
         if self.license and self.license.ckan_id in licenses:
             license_id = self.license.ckan_id
         else:
@@ -556,7 +592,7 @@ class Dataset(models.Model):
 
         # Synchronisation de l'organisation ; si l'organisation
         # n'existe pas il faut la créer
-        ckan_organisation = CkanHandler.get_organisation(organisation_id)
+        ckan_organisation = CkanReferences.get_organisation(organisation_id)
         if not ckan_organisation:
             CkanHandler.add_organisation(self.organisation)
         # et si l'organisation est désactiver il faut l'activer
@@ -566,19 +602,34 @@ class Dataset(models.Model):
         if with_user:
             username = with_user.username
 
-            # TODO: C'est très lourd de faire cela systématiquement -> voir pour améliorer cela
-            CkanHandler.add_user_to_organisation(username, organisation_id)
+            # Les appels à CKAN n'ont lieu que si l'utilisateur
+            # n'est pas déjà membre de l'organisation ou du groupe.
+            CkanReferences.add_user_to_organisation(username, organisation_id)
             for category in self.categories.all():
                 category_id = str(category.ckan_id)
-                CkanHandler.add_user_to_group(username, category_id)
-            #
+                CkanReferences.add_user_to_group(username, category_id)
 
-            apikey = CkanHandler.get_user(username)['apikey']
-            with CkanUserHandler(apikey=apikey) as ckan_user:
+            with CkanUserHandlers.get(username) as ckan_user:
                 return ckan_user.publish_dataset(id=id, **data)
         else:
             return CkanHandler.publish_dataset(id=id, **data)
 
+    def _enqueue_synchronize(self, previous, current_user=None,
+                             synchronize=True, activate=None):
+        ckan_id = str(self.ckan_id)
+        if previous.organisation:
+            organisation_id = str(previous.organisation.ckan_id)
+            outbox.enqueue(
+                'ckan', 'organisation.deactivate_if_empty',
+                'organisation:%s' % organisation_id, {'id': organisation_id})
+        if synchronize:
+            username = current_user and current_user.username or None
+            outbox.enqueue(
+                'ckan', 'dataset.synchronize', 'dataset:%s' % ckan_id,
+                {'dataset': self.pk, 'username': username, 'activate': activate},
+                idempotency_key='dataset.synchronize:%s:%s:%s' % (
+                    ckan_id, username, activate))
+
     def get_resources(self, **kwargs):
         Model = apps.get_model(app_label='idgo_admin', model_name='Resource')
         return Model.objects.filter(dataset=self, **kwargs)
@@ -657,6 +708,66 @@ class Keywords(Tag):
         proxy = True
 
 
+# ===============================================
+# Statistiques de consultation issues de CKAN
+# ===============================================
+
+
+class DatasetStatistics(models.Model):
+    """Copie locale des statistiques de consultation et des notes des jeux
+    de données dans CKAN (cf. tâche `sync_ckan_statistics`)."""
+
+    class Meta(object):
+        verbose_name = "Statistiques du jeu de données"
+        verbose_name_plural = "Statistiques des jeux de données"
+
+    dataset = models.OneToOneField(
+        to='Dataset',
+        verbose_name="Jeu de données",
+        primary_key=True,
+        on_delete=models.CASCADE,
+        related_name='statistics',
+        )
+
+    views = models.PositiveIntegerField(
+        verbose_name="Nombre de vues",
+        default=0,
+        )
+
+    recent_views = models.PositiveIntegerField(
+        verbose_name="Nombre de vues récentes",
+        default=0,
+        )
+
+    downloads = models.PositiveIntegerField(
+        verbose_name="Nombre de téléchargements",
+        default=0,
+        )
+
+    rating = models.FloatField(
+        verbose_name="Note",
+        blank=True,
+        null=True,
+        )
+
+    ratings_count = models.PositiveIntegerField(
+        verbose_name="Nombre de notes",
+        default=0,
+        )
+
+    indexed_on = models.DateTimeField(
+        verbose_name="Date d'indexation dans CKAN",
+        blank=True,
+        null=True,
+        db_index=True,
+        )
+
+    updated_on = models.DateTimeField(
+        verbose_name="Date de mise à jour",
+        auto_now=True,
+        )
+
+
 # Signaux
 # =======
 
@@ -670,13 +781,24 @@ def pre_save_dataset(sender, instance, **kwargs):
 @receiver(post_delete, sender=Dataset)
 def delete_attached_md(sender, instance, **kwargs):
     if instance.geonet_id:
+        if ENABLE_OUTBOX:
+            outbox.enqueue(
+                'geonet', 'geonet.delete_record',
+                'geonet:%s' % instance.geonet_id, {'id': instance.geonet_id})
+            return
         geonet.delete_record(instance.geonet_id)
         logger.info("Dataset MD '%s' has been deleted." % instance.geonet_id)
 
 
 @receiver(post_delete, sender=Dataset)
 def post_delete_dataset(sender, instance, **kwargs):
-    CkanHandler.deactivate_ckan_organisation_if_empty(str(instance.organisation.ckan_id))
+    organisation_id = str(instance.organisation.ckan_id)
+    if ENABLE_OUTBOX:
+        outbox.enqueue(
+            'ckan', 'organisation.deactivate_if_empty',
+            'organisation:%s' % organisation_id, {'id': organisation_id})
+        return
+    CkanHandler.deactivate_ckan_organisation_if_empty(organisation_id)
 
 
 @receiver(post_save, sender=Dataset)
@@ -18,8 +18,13 @@ from markdown import markdown
 
 from django.contrib.auth.models import User
 from django.contrib.gis.db import models
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 from django.utils import timezone
 
+from idgo_admin import roles
+
 
 class Gdpr(models.Model):
 
@@ -70,3 +75,20 @@ class GdprUser(models.Model):
         null=True,
         default=timezone.now,
         )
+
+
+# Signaux
+# =======
+
+
+@receiver(post_save, sender=Gdpr)
+@receiver(post_delete, sender=Gdpr)
+def invalidate_all_roles(sender, instance, **kwargs):
+    # De nouvelles modalités doivent être acceptées par tous
+    roles.invalidate_all()
+
+
+@receiver(post_save, sender=GdprUser)
+@receiver(post_delete, sender=GdprUser)
+def invalidate_user_roles(sender, instance, **kwargs):
+    roles.invalidate(instance.user_id)
@@ -22,22 +22,25 @@ import re
 
 from django.apps import apps
 from django.contrib.gis.db import models
+from django.db import transaction
 from django.db.models.signals import post_delete
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
 from idgo_admin.ckan_module import CkanHandler
-from idgo_admin.ckan_module import CkanUserHandler
+from idgo_admin.ckan_module import CkanUserHandlers
 from idgo_admin.datagis import drop_table
 from idgo_admin.managers import RasterLayerManager
 from idgo_admin.managers import VectorLayerManager
 from idgo_admin.mra_client import MraBaseError
 from idgo_admin.mra_client import MRAHandler
+from idgo_admin import outbox
 
 from idgo_admin import OWS_URL_PATTERN
 from idgo_admin import CKAN_STORAGE_PATH
 from idgo_admin import MAPSERV_STORAGE_PATH
 from idgo_admin import DEFAULTS_VALUES
+from idgo_admin import ENABLE_OUTBOX
 
 
 logger = logging.getLogger('idgo_admin')
@@ -278,16 +281,56 @@ class Layer(models.Model):
         # self.handle_layergroup()
 
         if synchronize:
-            self.synchronize()
+            if ENABLE_OUTBOX:
+                self._enqueue_synchronize()
+            else:
+                self.synchronize()
+
+    def _enqueue_synchronize(self):
+        outbox.enqueue(
+            'ckan', 'layer.synchronize',
+            'dataset:%s' % self.resource.dataset.ckan_id,
+            {'layer': self.name},
+            idempotency_key='layer.synchronize:%s' % self.name)
 
     def delete(self, *args, current_user=None, **kwargs):
+        with transaction.atomic():
+            # On supprime les ressources CKAN et MRA
+            if ENABLE_OUTBOX:
+                self._enqueue_delete(current_user=current_user)
+            else:
+                self._delete_remote(current_user=current_user)
+
+            # On supprime la table de données PostGIS
+            try:
+                drop_table(self.name)
+            except Exception as e:
+                logger.error(e)
+                pass
+
+            # Puis on supprime l'instance
+            super().delete(*args, **kwargs)
+
+    def _enqueue_delete(self, current_user=None):
+        username = current_user and current_user.username or None
+        outbox.enqueue(
+            'ckan', 'ckan.delete_resource',
+            'dataset:%s' % self.resource.dataset.ckan_id,
+            {'id': self.name, 'username': username},
+            idempotency_key='ckan.delete_resource:%s' % self.name)
+        outbox.enqueue(
+            'mra', 'mra.delete_layer', 'layer:%s' % self.name,
+            {'name': self.name,
+             'ws_name': self.resource.dataset.organisation.slug,
+             'type': self.type})
+
+    def _delete_remote(self, current_user=None):
         with_user = current_user
 
         # On supprime la ressource CKAN
         if with_user:
             username = with_user.username
-            apikey = CkanHandler.get_user(username)['apikey']
-            with CkanUserHandler(apikey=apikey) as ckan_user:
+            with CkanUserHandlers.get(username) as ckan_user:
                 ckan_user.delete_resource(self.name)
         else:
             CkanHandler.delete_resource(self.name)
@@ -305,16 +348,6 @@ class Layer(models.Model):
             logger.error(e)
             pass
 
-        # On supprime la table de données PostGIS
-        try:
-            drop_table(self.name)
-        except Exception as e:
-            logger.error(e)
-            pass
-
-        # Puis on supprime l'instance
-        super().delete(*args, **kwargs)
-
     # Autres méthodes
     # ===============
 
@@ -14,9 +14,13 @@
 # under the License.
 
 
+from collections import defaultdict
 from datetime import datetime
 from functools import reduce
+import hashlib
 import inspect
+from itertools import chain
+import json
 import logging
 from operator import iand
 from operator import ior
@@ -30,7 +34,17 @@ from django.contrib.auth.models import User
 from django.contrib.gis.db import models
 from django.contrib.postgres.fields import ArrayField
 from django.core.exceptions import ValidationError
+from django.db.models import BooleanField
+from django.db.models import Case
+from django.db.models import Count
+from django.db.models import Exists
+from django.db.models.functions import Coalesce
+from django.db.models import IntegerField
+from django.db.models import OuterRef
 from django.db.models import Q
+from django.db.models import Subquery
+from django.db.models import Value
+from django.db.models import When
 from django.db.models.signals import post_delete
 from django.db.models.signals import post_save
 from django.db.models.signals import pre_save
@@ -43,8 +57,13 @@ from django.utils import timezone
 from idgo_admin.ckan_module import CkanHandler
 from idgo_admin.exceptions import CriticalError
 from idgo_admin.geonet_module import GeonetUserHandler as geonet
+from idgo_admin.harvest import get_vanished
+from idgo_admin.harvest import MetadataWriter
+from idgo_admin.harvest import pages
 from idgo_admin.managers import OrganisationManager
 from idgo_admin.mra_client import MRAHandler
+from idgo_admin import remote_cache
+from idgo_admin import roles
 
 from idgo_admin import DOMAIN_NAME
 from idgo_admin import DEFAULT_CONTACT_EMAIL
@@ -239,39 +258,95 @@ class Organisation(models.Model):
         kwargs = {'organisation_name': self.slug}
         return reverse('api:organisation_show', kwargs=kwargs)
 
-    @property
-    def members(self):
-        Dataset = apps.get_model(app_label='idgo_admin', model_name='Dataset')
+    # Tris possibles de la liste des membres (cf. `get_members_list()`)
+    MEMBERS_ORDERING = {
+        'username': ('user__username',),
+        'full_name': ('user__first_name', 'user__last_name'),
+        'is_member': ('is_member',),
+        'is_contributor': ('is_contributor',),
+        'is_referent': ('is_referent',),
+        'is_idgo_partner': ('crige_membership',),
+        'datasets_count': ('datasets_count',),
+        }
+
+    def get_members_profiles(self):
+        """Retourner les profils membres, contributeurs ou référents de
+        l'organisation (sans annotation)."""
         Profile = apps.get_model(app_label='idgo_admin', model_name='Profile')
         LiaisonsContributeurs = apps.get_model(app_label='idgo_admin', model_name='LiaisonsContributeurs')
         LiaisonsReferents = apps.get_model(app_label='idgo_admin', model_name='LiaisonsReferents')
 
-        filter = reduce(ior, [
-            Q(organisation=self.pk),
-            reduce(iand, [
-                Q(liaisonscontributeurs__organisation=self.pk),
-                Q(liaisonscontributeurs__validated_on__isnull=False)
-                ]),
-            reduce(iand, [
-                Q(liaisonsreferents__organisation=self.pk),
-                Q(liaisonsreferents__validated_on__isnull=False),
-                ])
-            ])
-
-        profiles = Profile.objects.filter(filter).distinct().order_by('user__username')
-
-        data = [{
-            'username': member.user.username,
-            'full_name': member.user.get_full_name(),
-            'is_member': Profile.objects.filter(organisation=self.pk, id=member.id).exists(),
-            'is_contributor': LiaisonsContributeurs.objects.filter(profile=member, organisation__id=self.pk, validated_on__isnull=False).exists(),
-            'is_referent': LiaisonsReferents.objects.filter(profile=member, organisation__id=self.pk, validated_on__isnull=False).exists(),
-            'is_idgo_partner': member.is_idgo_partner,
-            'datasets_count': len(Dataset.objects.filter(organisation=self.pk, editor=member.user)),
-            'profile_id': member.id
-            } for member in profiles]
-
-        return data
+        return Profile.objects.filter(
+            Q(organisation=self.pk)
+            | Q(pk__in=LiaisonsContributeurs.objects.filter(
+                organisation=self.pk, validated_on__isnull=False).values('profile'))
+            | Q(pk__in=LiaisonsReferents.objects.filter(
+                organisation=self.pk, validated_on__isnull=False).values('profile')))
+
+    def get_members_queryset(self):
+        """Retourner les profils membres, contributeurs ou référents de
+        l'organisation, annotés de leurs rôles et de leur nombre de jeux de
+        données (une seule requête).
+
+        Les profils sont d'abord restreints à ceux liés à l'organisation ;
+        seuls ceux-ci sont annotés.
+        """
+        Dataset = apps.get_model(app_label='idgo_admin', model_name='Dataset')
+        LiaisonsContributeurs = apps.get_model(app_label='idgo_admin', model_name='LiaisonsContributeurs')
+        LiaisonsReferents = apps.get_model(app_label='idgo_admin', model_name='LiaisonsReferents')
+
+        datasets_count = Dataset.objects.filter(
+            organisation=self.pk, editor=OuterRef('user')
+            ).order_by().values('editor').annotate(count=Count('pk')).values('count')
+
+        return self.get_members_profiles().annotate(
+            is_member=Case(
+                When(organisation=self.pk, then=Value(True)),
+                default=Value(False), output_field=BooleanField()),
+            is_contributor=Exists(LiaisonsContributeurs.objects.filter(
+                profile=OuterRef('pk'), organisation=self.pk, validated_on__isnull=False)),
+            is_referent=Exists(LiaisonsReferents.objects.filter(
+                profile=OuterRef('pk'), organisation=self.pk, validated_on__isnull=False)),
+            datasets_count=Coalesce(
+                Subquery(datasets_count, output_field=IntegerField()), Value(0)),
+            )
+
+    def get_members_list(self, ordering='username', offset=0, limit=None):
+        """Retourner la liste des membres de l'organisation.
+
+        Le tri (`ordering`, éventuellement préfixé de `-`, cf.
+        `MEMBERS_ORDERING`) et la pagination (`offset`, `limit`) sont
+        effectués par la base de données.
+        """
+        descending = ordering.startswith('-')
+        fields = self.MEMBERS_ORDERING.get(ordering.lstrip('-'), ('user__username',))
+        order_by = [descending and '-%s' % field or field for field in fields]
+        if 'user__username' not in fields:
+            order_by.append('user__username')
+
+        queryset = self.get_members_queryset().order_by(*order_by).values(
+            'pk', 'user__username', 'user__first_name', 'user__last_name',
+            'is_member', 'is_contributor', 'is_referent', 'crige_membership',
+            'datasets_count')
+        if limit is not None:
+            queryset = queryset[offset:offset + limit]
+        elif offset:
+            queryset = queryset[offset:]
+
+        return [{
+            'username': member['user__username'],
+            'full_name': ('%s %s' % (member['user__first_name'], member['user__last_name'])).strip(),
+            'is_member': member['is_member'],
+            'is_contributor': member['is_contributor'],
+            'is_referent': member['is_referent'],
+            'is_idgo_partner': member['crige_membership'],
+            'datasets_count': member['datasets_count'],
+            'profile_id': member['pk'],
+            } for member in queryset]
+
+    @property
+    def members(self):
+        return self.get_members_list()
 
     def get_datasets(self, **kwargs):
         Dataset = apps.get_model(app_label='idgo_admin', model_name='Dataset')
@@ -335,6 +410,32 @@ def post_delete_organisation(sender, instance, **kwargs):
         CkanHandler.purge_organisation(str(instance.ckan_id))
 
 
+# Le nom et l'état des organisations figurent dans les instantanés des
+# rôles : ceux-ci sont invalidés à la validation de la transaction, afin
+# qu'une requête concurrente ne reconstruise pas un instantané périmé.
+
+ROLES_FIELDS = ('legal_name', 'is_active')
+
+
+@receiver(pre_save, sender=Organisation)
+def pre_save_organisation_roles(sender, instance, **kwargs):
+    previous = instance.pk and sender.objects.filter(
+        pk=instance.pk).values(*ROLES_FIELDS).first()
+    instance._roles_changed = not previous or any(
+        previous[field] != getattr(instance, field) for field in ROLES_FIELDS)
+
+
+@receiver(post_save, sender=Organisation)
+def post_save_organisation_roles(sender, instance, **kwargs):
+    if getattr(instance, '_roles_changed', True):
+        transaction.on_commit(roles.invalidate_all)
+
+
+@receiver(post_delete, sender=Organisation)
+def post_delete_organisation_roles(sender, instance, **kwargs):
+    transaction.on_commit(roles.invalidate_all)
+
+
 def check_or_create_contrib(organisation, user):
     LiaisonsContributeurs = apps.get_model(
         app_label='idgo_admin', model_name='LiaisonsContributeurs')
@@ -353,6 +454,50 @@ def check_or_create_contrib(organisation, user):
             validated_on=timezone.now().date())
 
 
+def get_harvest_preview(local, remote, is_modified, deleted=None):
+    """Comparer les jeux de données déjà moissonnés à ceux du catalogue
+    distant, sans rien écrire.
+
+    `local` et `remote` associent l'identifiant distant de chaque jeu de
+    données à un couple (titre, état) ; `is_modified(remote_state,
+    local_state)` indique si le jeu de données serait mis à jour. Par défaut,
+    les jeux de données absents du catalogue distant seraient supprimés.
+    """
+    if deleted is None:
+        deleted = set(local) - set(remote)
+
+    preview = {'create': [], 'update': [], 'unchanged': [], 'delete': []}
+    for remote_id, (title, state) in remote.items():
+        if remote_id not in local:
+            preview['create'].append(title or remote_id)
+        elif is_modified(state, local[remote_id][1]):
+            preview['update'].append(title or remote_id)
+        else:
+            preview['unchanged'].append(title or remote_id)
+    for remote_id in deleted:
+        preview['delete'].append(local[remote_id][0] or remote_id)
+
+    for titles in preview.values():
+        titles.sort()
+    return preview
+
+
+def get_harvest_fingerprint(validators, *options):
+    """Calculer l'empreinte d'un moissonnage à partir des validateurs des
+    pages lues (cf. `validators` des lecteurs CSW et DCAT) et des paramètres
+    du moissonnage. Retourne None si les validateurs sont inconnus.
+    """
+    if not validators:
+        return None
+    data = json.dumps([validators, options], sort_keys=True)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def is_modified_since(remote_date, local_date):
+    # Faute de date de part ou d'autre, le jeu de données est mis à jour
+    return not (remote_date and local_date and remote_date < local_date)
+
+
 from idgo_admin import ENABLE_CKAN_HARVESTER  # noqa
 if ENABLE_CKAN_HARVESTER:
 
@@ -360,6 +505,9 @@ if ENABLE_CKAN_HARVESTER:
 
     from idgo_admin.ckan_module import CkanBaseHandler
     from idgo_admin.ckan_module import CkanBaseError
+    from idgo_admin.ckan_module import CkanNotFoundError
+    from idgo_admin.utils import deadline
+    from idgo_admin import CKAN_TIMEOUT
 
     # ================================================
     # MODÈLE DE SYNCHRONISATION AVEC UN CATALOGUE CKAN
@@ -411,6 +559,7 @@ if ENABLE_CKAN_HARVESTER:
         def __str__(self):
             return self.url
 
+        @deadline(CKAN_TIMEOUT)
         def save(self, *args, harvest=True, **kwargs):
             Category = apps.get_model(app_label='idgo_admin', model_name='Category')
             Dataset = apps.get_model(app_label='idgo_admin', model_name='Dataset')
@@ -452,11 +601,18 @@ if ENABLE_CKAN_HARVESTER:
             check_or_create_contrib(self.organisation, editor)
 
             if harvest and self.sync_with:
+                # Correspondance des catégories distantes et locales
+                mapping_categories = defaultdict(set)
+                for slug, category_id in MappingCategory.objects.filter(
+                        remote_ckan=self).values_list('slug', 'category_id'):
+                    mapping_categories[slug].add(category_id)
+
                 try:
+                    metadata = MetadataWriter()
                     dataset_ids = []
                     ckan_ids = []
                     for value in self.sync_with:
-                        with CkanBaseHandler(self.url) as ckan:
+                        with CkanBaseHandler(self.url, cache=True) as ckan:
                             ckan_organisation = ckan.get_organisation(
                                 value, include_datasets=True,
                                 include_groups=True, include_tags=True)
@@ -465,134 +621,136 @@ if ENABLE_CKAN_HARVESTER:
                         if total == 0:
                             continue
                         count = 0
-                        for package in ckan_organisation.get('packages'):
-                            count += 1
-                            ckan_id = uuid.UUID(package['id'])
-
-                            logger.info("[%d/%d] - Get CKAN Package '%s'." % (count, total, str(ckan_id)))
-                            if not package['state'] == 'active':
-                                logger.info("Package is deactivated. Continue...")
-                                continue
-                            if not package['type'] == 'dataset':
-                                logger.info("Package is not a dataset. Continue...")
-                                continue
+                        for page in pages(ckan_organisation.get('packages')):
+                            harvested = []
+                            for package in page:
+                                count += 1
+                                ckan_id = uuid.UUID(package['id'])
+
+                                logger.info("[%d/%d] - Get CKAN Package '%s'." % (count, total, str(ckan_id)))
+                                if not package['state'] == 'active':
+                                    logger.info("Package is deactivated. Continue...")
+                                    continue
+                                if not package['type'] == 'dataset':
+                                    logger.info("Package is not a dataset. Continue...")
+                                    continue
 
-                            with CkanBaseHandler(self.url) as ckan:
-                                package = ckan.get_package(package['id'])
+                                with CkanBaseHandler(self.url, cache=True) as ckan:
+                                    package = ckan.get_package(package['id'])
 
-                            update_frequency = dict(Dataset.FREQUENCY_CHOICES).get(
-                                package.get('frequency'), 'unknown')
-                            update_frequency = package.get('frequency')
-                            if not(update_frequency and update_frequency
-                                    in dict(Dataset.FREQUENCY_CHOICES).keys()):
-                                update_frequency = 'unknown'
+                                update_frequency = dict(Dataset.FREQUENCY_CHOICES).get(
+                                    package.get('frequency'), 'unknown')
+                                update_frequency = package.get('frequency')
+                                if not(update_frequency and update_frequency
+                                        in dict(Dataset.FREQUENCY_CHOICES).keys()):
+                                    update_frequency = 'unknown'
 
-                            date_creation = None
-                            metadata_created = package.get('metadata_created', None)
-                            if metadata_created:
-                                metadata_created = parse_datetime(metadata_created)
-                                date_creation = metadata_created.date()
+                                date_creation = None
+                                metadata_created = package.get('metadata_created', None)
+                                if metadata_created:
+                                    metadata_created = parse_datetime(metadata_created)
+                                    date_creation = metadata_created.date()
 
-                            date_modification = None
-                            metadata_modified = package.get('metadata_modified', None)
-                            if metadata_modified:
-                                metadata_modified = parse_datetime(metadata_modified)
-                                date_modification = metadata_modified.date()
+                                date_modification = None
+                                metadata_modified = package.get('metadata_modified', None)
+                                if metadata_modified:
+                                    metadata_modified = parse_datetime(metadata_modified)
+                                    date_modification = metadata_modified.date()
 
-                            try:
-                                mapping_licence = MappingLicence.objects.get(
-                                    remote_ckan=self, slug=package.get('license_id'))
-                            except MappingLicence.DoesNotExist:
                                 try:
-                                    license = License.objects.get(slug='other-at')
-                                except License.DoesNotExist:
-                                    license = None
-                            else:
-                                license = mapping_licence.licence
-
-                            slug = ('sync-%s' % ckan_id)[:100]
-                            kvp = {
-                                'slug': slug,
-                                'title': package.get('title'),
-                                'description': package.get('notes'),
-                                'date_creation': date_creation,
-                                'date_modification': date_modification,
-                                'editor': editor,
-                                'license': license,
-                                'owner_email': self.organisation.email or DEFAULT_CONTACT_EMAIL,
-                                'owner_name': self.organisation.legal_name or DEFAULT_PLATFORM_NAME,
-                                'organisation': self.organisation,
-                                'published': not package.get('private'),
-                                'remote_instance': self,
-                                'remote_dataset': ckan_id,
-                                'remote_organisation': value,
-                                'update_frequency': update_frequency,
-                                }
-
-                            try:
-                                dataset, created = Dataset.harvested_ckan.update_or_create(**kvp)
-                            except Exception as e:
-                                logger.exception(e)
-                                logger.warning("Dataset was not saved.")
-                                warnings.warn("Impossible de moissonner le jeu de données '%s' : `%s`" % (ckan_id, e.__str__()))
-                                continue
-
-                            mapping_categories = MappingCategory.objects.filter(
-                                remote_ckan=self, slug__in=[m['name'] for m in package.get('groups', [])])
-                            if mapping_categories:
-                                dataset.categories = set(mc.category for mc in mapping_categories)
-
-                            if not created:
-                                dataset.keywords.clear()
-                            keywords = [tag['display_name'] for tag in package.get('tags')]
-                            dataset.keywords.add(*keywords)
-                            dataset.save(current_user=None, synchronize=True, activate=False)
+                                    mapping_licence = MappingLicence.objects.get(
+                                        remote_ckan=self, slug=package.get('license_id'))
+                                except MappingLicence.DoesNotExist:
+                                    try:
+                                        license = License.objects.get(slug='other-at')
+                                    except License.DoesNotExist:
+                                        license = None
+                                else:
+                                    license = mapping_licence.licence
 
-                            dataset_ids.append(dataset.pk)
-                            ckan_ids.append(dataset.ckan_id)
+                                slug = ('sync-%s' % ckan_id)[:100]
+                                kvp = {
+                                    'slug': slug,
+                                    'title': package.get('title'),
+                                    'description': package.get('notes'),
+                                    'date_creation': date_creation,
+                                    'date_modification': date_modification,
+                                    'editor': editor,
+                                    'license': license,
+                                    'owner_email': self.organisation.email or DEFAULT_CONTACT_EMAIL,
+                                    'owner_name': self.organisation.legal_name or DEFAULT_PLATFORM_NAME,
+                                    'organisation': self.organisation,
+                                    'published': not package.get('private'),
+                                    'remote_instance': self,
+                                    'remote_dataset': ckan_id,
+                                    'remote_organisation': value,
+                                    'update_frequency': update_frequency,
+                                    }
 
-                            for resource in package.get('resources', []):
                                 try:
-                                    ckan_id = uuid.UUID(resource['id'])
-                                except ValueError as e:
+                                    dataset, created = Dataset.harvested_ckan.update_or_create(**kvp)
+                                except Exception as e:
                                     logger.exception(e)
-                                    logger.warning("Error was ignored.")
+                                    logger.warning("Dataset was not saved.")
+                                    warnings.warn("Impossible de moissonner le jeu de données '%s' : `%s`" % (ckan_id, e.__str__()))
                                     continue
 
-                                try:
-                                    ckan_format = resource['format'].upper()
-                                    format_type = ResourceFormats.objects.get(ckan_format=ckan_format)
-                                except (ResourceFormats.MultipleObjectsReturned, ResourceFormats.DoesNotExist, TypeError) as e:
-                                    logger.exception(e)
-                                    logger.warning("Error was ignored.")
-                                    format_type = None
+                                metadata.add(
+                                    dataset, [tag['display_name'] for tag in package.get('tags')],
+                                    set().union(*[
+                                        mapping_categories.get(m['name'], set())
+                                        for m in package.get('groups', [])]))
 
-                                save_opts = {
-                                    'current_user': editor,
-                                    'synchronize': True,
-                                    'update_dataset': False,
-                                    }
+                                dataset_ids.append(dataset.pk)
+                                ckan_ids.append(dataset.ckan_id)
+                                harvested.append((dataset, package))
 
-                                kvp = {
-                                    'ckan_id': ckan_id,
-                                    'dataset': dataset,
-                                    'format_type': format_type,
-                                    'title': resource['name'],
-                                    'referenced_url': resource['url']}
+                            metadata.write()
+                            for dataset, package in harvested:
+                                dataset.save(current_user=None, synchronize=True, activate=False)
 
-                                try:
-                                    resource = Resource.objects.get(ckan_id=ckan_id)
-                                except Resource.DoesNotExist:
+                                for resource in package.get('resources', []):
                                     try:
-                                        resource = Resource.default.create(
-                                            save_opts=save_opts, **kvp)
-                                    except Exception as e:
+                                        ckan_id = uuid.UUID(resource['id'])
+                                    except ValueError as e:
                                         logger.exception(e)
-                                        warnings.warn("Impossible de moissonner la ressource '%s' : `%s`" % (ckan_id, e.__str__()))
-                                else:
-                                    for k, v in kvp.items():
-                                        setattr(resource, k, v)
-                                    resource.save(**save_opts)
+                                        logger.warning("Error was ignored.")
+                                        continue
+
+                                    try:
+                                        ckan_format = resource['format'].upper()
+                                        format_type = ResourceFormats.objects.get(ckan_format=ckan_format)
+                                    except (ResourceFormats.MultipleObjectsReturned, ResourceFormats.DoesNotExist, TypeError) as e:
+                                        logger.exception(e)
+                                        logger.warning("Error was ignored.")
+                                        format_type = None
+
+                                    save_opts = {
+                                        'current_user': editor,
+                                        'synchronize': True,
+                                        'update_dataset': False,
+                                        }
+
+                                    kvp = {
+                                        'ckan_id': ckan_id,
+                                        'dataset': dataset,
+                                        'format_type': format_type,
+                                        'title': resource['name'],
+                                        'referenced_url': resource['url']}
+
+                                    try:
+                                        resource = Resource.objects.get(ckan_id=ckan_id)
+                                    except Resource.DoesNotExist:
+                                        try:
+                                            resource = Resource.default.create(
+                                                save_opts=save_opts, **kvp)
+                                        except Exception as e:
+                                            logger.exception(e)
+                                            warnings.warn("Impossible de moissonner la ressource '%s' : `%s`" % (ckan_id, e.__str__()))
+                                    else:
+                                        for k, v in kvp.items():
+                                            setattr(resource, k, v)
+                                        resource.save(**save_opts)
 
                 except Exception as e:
                     logger.exception(e)
@@ -601,11 +759,43 @@ if ENABLE_CKAN_HARVESTER:
                         dataset.delete()
                     # for id in ckan_ids:
                     #     CkanHandler.purge_dataset(str(id))
+                    # Les documents mis en cache ne doivent pas masquer l'échec
+                    remote_cache.invalidate(self.url)
                     raise CriticalError()
                 else:
                     for id in ckan_ids:
                         CkanHandler.publish_dataset(id=str(id), state='active')
 
+        def preview(self):
+            """Aperçu du moissonnage (cf. `get_harvest_preview`)."""
+            sync_with = self.sync_with or []
+
+            local, deleted = {}, set()
+            for remote_dataset, remote_organisation, title, date_modification \
+                    in RemoteCkanDataset.objects.filter(remote_instance=self).values_list(
+                        'remote_dataset', 'remote_organisation',
+                        'dataset__title', 'dataset__date_modification'):
+                local[str(remote_dataset)] = (title, date_modification)
+                if remote_organisation not in sync_with:
+                    deleted.add(str(remote_dataset))
+
+            remote = {}
+            with CkanBaseHandler(self.url, cache=True) as ckan:
+                for value in sync_with:
+                    ckan_organisation = ckan.get_organisation(value, include_datasets=True)
+                    if not ckan_organisation:
+                        raise CkanNotFoundError(
+                            "L'organisation distante « %s » n'existe pas." % value)
+                    for package in ckan_organisation.get('packages') or []:
+                        if not (package['state'] == 'active' and package['type'] == 'dataset'):
+                            continue
+                        metadata_modified = package.get('metadata_modified')
+                        remote[package['id']] = (
+                            package.get('title'),
+                            metadata_modified and parse_datetime(metadata_modified).date())
+
+            return get_harvest_preview(local, remote, is_modified_since, deleted=deleted)
+
         def delete(self, *args, **kwargs):
             Dataset = apps.get_model(app_label='idgo_admin', model_name='Dataset')
             for dataset in Dataset.harvested_ckan.filter(remote_instance=self):
@@ -704,6 +894,8 @@ if ENABLE_CSW_HARVESTER:
 
     from idgo_admin.csw_module import CswBaseHandler
     from idgo_admin.csw_module import CswBaseError
+    from idgo_admin.utils import deadline
+    from idgo_admin import CSW_TIMEOUT
 
     # ===============================================
     # MODÈLE DE SYNCHRONISATION AVEC UN CATALOGUE CWS
@@ -751,28 +943,28 @@ if ENABLE_CSW_HARVESTER:
             default='never',
             )
 
+        harvest_fingerprint = models.CharField(
+            verbose_name="Empreinte du dernier moissonnage",
+            max_length=64,
+            blank=True,
+            null=True,
+            editable=False,
+            )
+
         def __str__(self):
             return self.url
 
+        @deadline(CSW_TIMEOUT)
         def save(self, *args, harvest=True, **kwargs):
-            Category = apps.get_model(app_label='idgo_admin', model_name='Category')
             Dataset = apps.get_model(app_label='idgo_admin', model_name='Dataset')
             License = apps.get_model(app_label='idgo_admin', model_name='License')
             Resource = apps.get_model(app_label='idgo_admin', model_name='Resource')
             ResourceFormats = apps.get_model(app_label='idgo_admin', model_name='ResourceFormats')
 
-            # (1) Supprimer les jeux de données qui ne sont plus synchronisés
+            # (1) Les jeux de données déjà moissonnés sont mis à jour (cf. (3))
             previous = self.pk and RemoteCsw.objects.get(pk=self.pk)
 
-            if previous:
-                try:
-                    with transaction.atomic():
-                        for dataset in Dataset.harvested_csw.filter(remote_instance=previous):
-                            dataset.delete()
-                except Exception as e:
-                    logger.exception(e)
-                    raise CriticalError()
-            else:
+            if not previous:
                 # Dans le cas d'une création, on vérifie si l'URL CSW est valide
                 try:
                     with CswBaseHandler(self.url):
@@ -794,189 +986,229 @@ if ENABLE_CSW_HARVESTER:
 
             if harvest:
                 # Puis on moissonne le catalogue
+                # Empreintes des fiches moissonnées lors de la précédente synchronisation
+                fingerprints = dict(
+                    (remote_dataset, (datestamp, hash))
+                    for remote_dataset, datestamp, hash
+                    in RemoteCswDataset.objects.filter(remote_instance=self).values_list(
+                        'remote_dataset', 'remote_datestamp', 'remote_hash'))
+                if previous.getrecords != self.getrecords:
+                    fingerprints = dict((k, (None, None)) for k in fingerprints.keys())
+
                 try:
+                    metadata = MetadataWriter()
                     dataset_ids = []
                     ckan_ids = []
                     geonet_ids = []
+                    harvested_ids = set()
+                    geonet_records = []
+                    harvested_fingerprints = {}
+                    # L'empreinte n'est enregistrée qu'à l'issue d'un moissonnage complet
+                    complete = True
                     with CswBaseHandler(self.url) as csw:
                         packages = csw.get_packages(xml=self.getrecords or None)
+                    fingerprint = get_harvest_fingerprint(csw.validators, self.getrecords)
+                    if csw.rejected or csw.returned != csw.matched:
+                        # Les fiches manquantes seront reprises au prochain moissonnage
+                        logger.warning("%d/%d CSW record(s) read, %d could not be read." % (
+                            csw.returned, csw.matched, csw.rejected))
+                        complete = False
+
+                    # Aucune page n'a changé depuis le précédent moissonnage
+                    if fingerprint and fingerprint == self.harvest_fingerprint:
+                        logger.info("CSW catalogue '%s' is not modified." % self.url)
+                        return
 
                     total = len(packages)
                     count = 0
-                    for package in packages:
-                        count += 1
-                        geonet_id = package['id']
-                        logger.info("[%d/%d] - Get CSW Record '%s'." % (count, total, str(geonet_id)))
+                    for page in pages(packages):
+                        harvested = []
+                        for package in page:
+                            count += 1
+                            geonet_id = package['id']
+                            logger.info("[%d/%d] - Get CSW Record '%s'." % (count, total, str(geonet_id)))
 
-                        if not package['type'] == 'dataset':
-                            logger.info("Record is not a dataset. Continue...")
-                            continue
+                            if not package['type'] == 'dataset':
+                                logger.info("Record is not a dataset. Continue...")
+                                continue
 
-                        update_frequency = dict(Dataset.FREQUENCY_CHOICES).get(
-                            package.get('frequency'), 'unknown')
-                        update_frequency = package.get('frequency')
-                        if not(update_frequency and update_frequency
-                                in dict(Dataset.FREQUENCY_CHOICES).keys()):
-                            update_frequency = 'unknown'
+                            harvested_ids.add(geonet_id)
+                            datestamp = package.get('metadata_datestamp') or None
+                            xml = package['xml']
+                            hash = hashlib.sha256(
+                                isinstance(xml, bytes) and xml or xml.encode('utf-8')).hexdigest()
 
-                        date_creation = package.get('dataset_creation_date', None)
-                        if date_creation:
-                            try:
-                                date_creation = datetime.strptime(date_creation, ISOFORMAT_DATE)
-                            except ValueError as e:
-                                logger.warning(e)
-                                date_creation = None
+                            previous_datestamp, previous_hash = fingerprints.get(geonet_id, (None, None))
+                            if (datestamp and datestamp == previous_datestamp) or hash == previous_hash:
+                                logger.info("Record is unchanged. Continue...")
+                                continue
 
-                        date_modification = package.get('dataset_modification_date', None)
-                        if date_modification:
-                            try:
-                                date_modification = datetime.strptime(date_modification, ISOFORMAT_DATE)
-                            except ValueError as e:
-                                logger.warning(e)
-                                date_modification = None
+                            update_frequency = dict(Dataset.FREQUENCY_CHOICES).get(
+                                package.get('frequency'), 'unknown')
+                            update_frequency = package.get('frequency')
+                            if not(update_frequency and update_frequency
+                                    in dict(Dataset.FREQUENCY_CHOICES).keys()):
+                                update_frequency = 'unknown'
 
-                        date_publication = package.get('dataset_publication_date', None)
-                        if date_publication:
-                            try:
-                                date_publication = datetime.strptime(date_publication, ISOFORMAT_DATE)
-                            except ValueError as e:
-                                logger.warning(e)
-                                date_publication = None
-
-                        # Licence
-                        license_titles = package.get('license_titles')
-                        filters = [
-                            Q(slug__in=license_titles),
-                            Q(title__in=license_titles),
-                            Q(alternate_titles__overlap=license_titles),
-                            ]
-                        license = License.objects.filter(reduce(ior, filters)).distinct().first()
-                        if not license:
-                            try:
-                                license = License.objects.get(slug=DEFAULT_VALUE_LICENSE)
-                            except License.DoesNotExist:
-                                license = License.objects.first()
+                            date_creation = package.get('dataset_creation_date', None)
+                            if date_creation:
+                                try:
+                                    date_creation = datetime.strptime(date_creation, ISOFORMAT_DATE)
+                                except ValueError as e:
+                                    logger.warning(e)
+                                    date_creation = None
 
-                        # On pousse la fiche de MD dans Geonet
-                        try:
-                            geonet_record = geonet.get_record(geonet_id)
-                        except Exception as e:
-                            logger.error(e)
-                        else:
-                            if not geonet_record:
+                            date_modification = package.get('dataset_modification_date', None)
+                            if date_modification:
                                 try:
-                                    geonet.create_record(geonet_id, package['xml'])
-                                except Exception as e:
-                                    logger.warning('La création de la fiche de métadonnées a échoué.')
-                                    logger.error(e)
-                                else:
-                                    geonet_ids.append(geonet_id)
-                                    geonet.publish(geonet_id)  # Toujours publier la fiche
-                            else:
+                                    date_modification = datetime.strptime(date_modification, ISOFORMAT_DATE)
+                                except ValueError as e:
+                                    logger.warning(e)
+                                    date_modification = None
+
+                            date_publication = package.get('dataset_publication_date', None)
+                            if date_publication:
                                 try:
-                                    geonet.update_record(geonet_id, package['xml'])
-                                except Exception as e:
-                                    logger.warning('La mise à jour de la fiche de métadonnées a échoué.')
-                                    logger.error(e)
-
-                        slug = ('sync-%s' % str(geonet_id))[:100]
-                        kvp = {
-                            'slug': slug,
-                            'title': package.get('title'),
-                            'description': package.get('notes'),
-                            'date_creation': date_creation and date_creation.date(),
-                            'date_modification': date_modification and date_modification.date(),
-                            'date_publication': date_publication and date_publication.date(),
-                            'editor': editor,
-                            'license': license,
-                            'owner_email': self.organisation.email or DEFAULT_CONTACT_EMAIL,
-                            'owner_name': self.organisation.legal_name or DEFAULT_PLATFORM_NAME,
-                            'organisation': self.organisation,
-                            'published': not package.get('private'),
-                            'remote_instance': self,
-                            'remote_dataset': geonet_id,
-                            'update_frequency': update_frequency,
-                            'bbox': package.get('bbox'),
-                            'geonet_id': geonet_id,
-                            }
+                                    date_publication = datetime.strptime(date_publication, ISOFORMAT_DATE)
+                                except ValueError as e:
+                                    logger.warning(e)
+                                    date_publication = None
+
+                            # Licence
+                            license_titles = package.get('license_titles')
+                            filters = [
+                                Q(slug__in=license_titles),
+                                Q(title__in=license_titles),
+                                Q(alternate_titles__overlap=license_titles),
+                                ]
+                            license = License.objects.filter(reduce(ior, filters)).distinct().first()
+                            if not license:
+                                try:
+                                    license = License.objects.get(slug=DEFAULT_VALUE_LICENSE)
+                                except License.DoesNotExist:
+                                    license = License.objects.first()
 
-                        try:
-                            dataset, created = Dataset.harvested_csw.update_or_create(**kvp)
-                        except Exception as e:
-                            logger.exception(e)
-                            warnings.warn("Impossible de moissonner le jeu de données '%s' : `%s`" % (geonet_id, e.__str__()))
-                            continue
+                            # La fiche de MD est poussée dans Geonet avec les autres (cf. ci-après)
+                            geonet_records.append((geonet_id, package['xml']))
 
-                        if created:
-                            dataset_ids.append(dataset.pk)
-                            ckan_ids.append(dataset.ckan_id)
+                            slug = ('sync-%s' % str(geonet_id))[:100]
+                            kvp = {
+                                'slug': slug,
+                                'title': package.get('title'),
+                                'description': package.get('notes'),
+                                'date_creation': date_creation and date_creation.date(),
+                                'date_modification': date_modification and date_modification.date(),
+                                'date_publication': date_publication and date_publication.date(),
+                                'editor': editor,
+                                'license': license,
+                                'owner_email': self.organisation.email or DEFAULT_CONTACT_EMAIL,
+                                'owner_name': self.organisation.legal_name or DEFAULT_PLATFORM_NAME,
+                                'organisation': self.organisation,
+                                'published': not package.get('private'),
+                                'remote_instance': self,
+                                'remote_dataset': geonet_id,
+                                'update_frequency': update_frequency,
+                                'bbox': package.get('bbox'),
+                                'geonet_id': geonet_id,
+                                }
+
+                            try:
+                                dataset, created = Dataset.harvested_csw.update_or_create(**kvp)
+                            except Exception as e:
+                                logger.exception(e)
+                                warnings.warn("Impossible de moissonner le jeu de données '%s' : `%s`" % (geonet_id, e.__str__()))
+                                complete = False
+                                continue
 
-                        categories_name = [m['name'] for m in package.get('groups', [])]
-                        iso_topic_reverse = dict((v, k) for k, v in Category._meta.fields[5].choices)
+                            if created:
+                                dataset_ids.append(dataset.pk)
+                                ckan_ids.append(dataset.ckan_id)
 
-                        filters = [
-                            Q(slug__in=categories_name),
-                            Q(name__in=categories_name),
-                            Q(iso_topic__in=[m['name'] for m in package.get('groups', [])]),
-                            Q(iso_topic__in=[iso_topic_reverse.get(name) for name in categories_name]),
-                            Q(alternate_titles__overlap=categories_name),
-                            ]
+                            metadata.add(
+                                dataset, [tag['display_name'] for tag in package.get('tags')],
+                                metadata.get_categories([m['name'] for m in package.get('groups', [])]))
 
-                        categories = Category.objects.filter(reduce(ior, filters)).distinct()
-                        if categories:
-                            dataset.categories.set(categories, clear=True)
+                            harvested_fingerprints[geonet_id] = (datestamp, hash)
+                            harvested.append((dataset, package))
 
-                        if not created:
-                            dataset.keywords.clear()
-                        keywords = [tag['display_name'] for tag in package.get('tags')]
-                        dataset.keywords.add(*keywords)
+                        metadata.write()
+                        for dataset, package in harvested:
+                            dataset.save(current_user=None, synchronize=True, activate=False)
 
-                        dataset.save(current_user=None, synchronize=True, activate=False)
+                            # Les ressources sont identifiées par leur URL puis par leur
+                            # titre (ex. couches WMS et WFS d'un même service)
+                            resources = defaultdict(list)
+                            for instance in Resource.objects.filter(dataset=dataset).order_by('pk'):
+                                resources[instance.referenced_url].append(instance)
 
-                        for resource in package.get('resources', []):
-                            try:
-                                ckan_id = uuid.uuid4()
-                            except ValueError as e:
-                                logger.exception(e)
-                                logger.warning("Error was ignored.")
-                                continue
+                            for resource in package.get('resources', []):
+                                filters = []
+                                protocol = resource.get('protocol')
+                                protocol and filters.append(Q(protocol=protocol))
+                                mimetype = resource.get('mimetype')
+                                mimetype and filters.append(Q(mimetype__overlap=[mimetype]))
+                                try:
+                                    format_type = ResourceFormats.objects.get(reduce(iand, filters))
+                                except (ResourceFormats.MultipleObjectsReturned, ResourceFormats.DoesNotExist, TypeError):
+                                    format_type = None
 
-                            filters = []
-                            protocol = resource.get('protocol')
-                            protocol and filters.append(Q(protocol=protocol))
-                            mimetype = resource.get('mimetype')
-                            mimetype and filters.append(Q(mimetype__overlap=[mimetype]))
-                            try:
-                                format_type = ResourceFormats.objects.get(reduce(iand, filters))
-                            except (ResourceFormats.MultipleObjectsReturned, ResourceFormats.DoesNotExist, TypeError):
-                                format_type = None
-
-                            save_opts = {
-                                'current_user': editor,
-                                'synchronize': True,
-                                'update_dataset': False,
-                                }
+                                save_opts = {
+                                    'current_user': editor,
+                                    'synchronize': True,
+                                    'update_dataset': False,
+                                    }
 
-                            kvp = {
-                                'ckan_id': ckan_id,
-                                'dataset': dataset,
-                                'format_type': format_type,
-                                'title': resource['name'] or resource['url'],
-                                'referenced_url': resource['url']}
+                                kvp = {
+                                    'dataset': dataset,
+                                    'format_type': format_type,
+                                    'title': resource['name'] or resource['url'],
+                                    'referenced_url': resource['url']}
 
-                            try:
-                                resource = Resource.objects.get(ckan_id=ckan_id)
-                            except Resource.DoesNotExist:
-                                try:
-                                    resource = Resource.default.create(
-                                        save_opts=save_opts, **kvp)
-                                except Exception as e:
-                                    logger.exception(e)
-                                    warnings.warn("Impossible de moissonner la ressource '%s' : `%s`" % (ckan_id, e.__str__()))
-                            else:
-                                for k, v in kvp.items():
-                                    setattr(resource, k, v)
-                                resource.save(**save_opts)
+                                candidates = resources[resource['url']]
+                                instance = next(
+                                    (x for x in candidates if x.title == kvp['title']),
+                                    candidates and candidates[0] or None)
+                                if not instance:
+                                    ckan_id = uuid.uuid4()
+                                    try:
+                                        Resource.default.create(
+                                            save_opts=save_opts, ckan_id=ckan_id, **kvp)
+                                    except Exception as e:
+                                        logger.exception(e)
+                                        warnings.warn("Impossible de moissonner la ressource '%s' : `%s`" % (ckan_id, e.__str__()))
+                                        harvested_fingerprints.pop(package['id'], None)
+                                        complete = False
+                                else:
+                                    candidates.remove(instance)
+                                    for k, v in kvp.items():
+                                        setattr(instance, k, v)
+                                    instance.save(**save_opts)
+
+                            # Les ressources qui ne figurent plus dans la fiche (ou
+                            # en double) sont supprimées
+                            for instance in chain(*resources.values()):
+                                instance.delete()
+
+                    # On pousse les fiches de MD dans Geonet par lots
+                    try:
+                        created, failed = geonet.push_records(geonet_records)
+                    except Exception as e:
+                        logger.warning("L'enregistrement des fiches de métadonnées a échoué.")
+                        logger.error(e)
+                        complete = False
+                    else:
+                        geonet_ids += created
+                        if failed:
+                            # Les fiches en échec seront reprises au prochain moissonnage
+                            logger.warning("%d MD record(s) could not be pushed." % len(failed))
+                            complete = False
+                        # Les fiches inchangées ne seront plus traitées
+                        for geonet_id, (datestamp, hash) in harvested_fingerprints.items():
+                            if geonet_id in failed:
+                                continue
+                            RemoteCswDataset.objects.filter(
+                                remote_instance=self, remote_dataset=geonet_id
+                                ).update(remote_datestamp=datestamp, remote_hash=hash)
 
                 except Exception as e:
                     logger.exception(e)
@@ -987,11 +1219,72 @@ if ENABLE_CSW_HARVESTER:
                     #     CkanHandler.purge_dataset(str(id))
                     # for id in geonet_ids:
                     #     geonet.delete_record(id)
+                    remote_cache.invalidate(self.url)
                     raise CriticalError()
                 else:
                     for id in ckan_ids:
                         CkanHandler.publish_dataset(id=str(id), state='active')
 
+                    RemoteCsw.objects.filter(pk=self.pk).update(
+                        harvest_fingerprint=complete and fingerprint or None)
+
+                    # (4) Supprimer les jeux de données qui ne sont plus moissonnés,
+                    # seulement si toutes les fiches du catalogue ont été traitées
+                    vanished = get_vanished(fingerprints.keys(), harvested_ids, complete)
+                    if not complete:
+                        logger.warning("CSW harvest is incomplete: no dataset is deleted.")
+                    if vanished:
+                        logger.info("Delete %d vanished CSW Dataset(s)." % len(vanished))
+                    for remote_dataset in vanished:
+                        try:
+                            with transaction.atomic():
+                                Dataset.harvested_csw.get(
+                                    remote_instance=self, remote_dataset=remote_dataset).delete()
+                        except Exception as e:
+                            logger.exception(e)
+                            logger.warning("Error was ignored.")
+
+        def preview(self):
+            """Aperçu du moissonnage (cf. `get_harvest_preview`)."""
+            previous = self.pk and RemoteCsw.objects.get(pk=self.pk)
+            # Toutes les fiches sont reprises si la requête GetRecords change
+            reset = not previous or previous.getrecords != self.getrecords
+
+            local = dict(
+                (remote_dataset, (title, reset and (None, None) or (datestamp, hash)))
+                for remote_dataset, title, datestamp, hash
+                in RemoteCswDataset.objects.filter(remote_instance=self).values_list(
+                    'remote_dataset', 'dataset__title', 'remote_datestamp', 'remote_hash'))
+
+            with CswBaseHandler(self.url) as csw:
+                packages = csw.get_packages(xml=self.getrecords or None)
+
+            remote = {}
+            for package in packages:
+                if not package['type'] == 'dataset':
+                    continue
+                xml = package['xml']
+                remote[package['id']] = (package.get('title'), (
+                    package.get('metadata_datestamp') or None,
+                    hashlib.sha256(
+                        isinstance(xml, bytes) and xml or xml.encode('utf-8')).hexdigest()))
+
+            def is_modified(remote_state, local_state):
+                # Cf. (3) dans `save()`
+                datestamp, hash = remote_state
+                return not ((datestamp and datestamp == local_state[0]) or hash == local_state[1])
+
+            return get_harvest_preview(local, remote, is_modified)
+
+        def reset_harvest(self):
+            """Oublier les empreintes du précédent moissonnage : le prochain
+            moissonnage relit et met à jour toutes les fiches."""
+            RemoteCswDataset.objects.filter(remote_instance=self).update(
+                remote_datestamp=None, remote_hash=None)
+            RemoteCsw.objects.filter(pk=self.pk).update(harvest_fingerprint=None)
+            self.harvest_fingerprint = None
+            remote_cache.invalidate(self.url)
+
         def delete(self, *args, **kwargs):
             Dataset = apps.get_model(app_label='idgo_admin', model_name='Dataset')
             for dataset in Dataset.harvested_csw.filter(remote_instance=self):
@@ -1044,6 +1337,22 @@ if ENABLE_CSW_HARVESTER:
             auto_now_add=True,
             )
 
+        remote_datestamp = models.CharField(
+            verbose_name="Date de la fiche distante",
+            max_length=50,
+            editable=False,
+            null=True,
+            blank=True,
+            )
+
+        remote_hash = models.CharField(
+            verbose_name="Empreinte de la fiche distante",
+            max_length=64,
+            editable=False,
+            null=True,
+            blank=True,
+            )
+
         def __str__(self):
             return '{0} - {1}'.format(self.remote_instance, self.dataset)
 
@@ -1058,6 +1367,8 @@ if ENABLE_DCAT_HARVESTER:
 
     from idgo_admin.dcat_module import DcatBaseHandler
     from idgo_admin.dcat_module import DcatBaseError
+    from idgo_admin.utils import deadline
+    from idgo_admin import DCAT_TIMEOUT
 
     # ================================================
     # MODÈLE DE SYNCHRONISATION AVEC UN CATALOGUE DCAT
@@ -1106,11 +1417,19 @@ if ENABLE_DCAT_HARVESTER:
             default='never',
             )
 
+        harvest_fingerprint = models.CharField(
+            verbose_name="Empreinte du dernier moissonnage",
+            max_length=64,
+            blank=True,
+            null=True,
+            editable=False,
+            )
+
         def __str__(self):
             return self.url
 
+        @deadline(DCAT_TIMEOUT)
         def save(self, *args, harvest=True, **kwargs):
-            Category = apps.get_model(app_label='idgo_admin', model_name='Category')
             Dataset = apps.get_model(app_label='idgo_admin', model_name='Dataset')
             License = apps.get_model(app_label='idgo_admin', model_name='License')
             Resource = apps.get_model(app_label='idgo_admin', model_name='Resource')
@@ -1157,163 +1476,165 @@ if ENABLE_DCAT_HARVESTER:
             if harvest and self.sync_with:
                 # Puis on moissonne le catalogue
                 try:
+                    metadata = MetadataWriter()
                     dataset_ids = []
                     ckan_ids = []
+                    # L'empreinte n'est enregistrée qu'à l'issue d'un moissonnage complet
+                    complete = True
                     with DcatBaseHandler(self.url) as dcat:
-                        packages = dcat.get_packages(publishers=self.sync_with)
-                    total = len(packages)
-                    count = 0
-                    for package in packages:
-                        count += 1
-                        dcat_id = package.get('id')
-                        logger.info("[%d/%d] - Get DCAT Record '%s'." % (count, total, str(dcat_id)))
-
-                        update_frequency = dict(Dataset.FREQUENCY_CHOICES).get(
-                            package.get('frequency'), 'unknown')
-                        update_frequency = package.get('frequency')
-                        if not(update_frequency and update_frequency
-                                in dict(Dataset.FREQUENCY_CHOICES).keys()):
-                            update_frequency = 'unknown'
-
-                        date_creation = package.get('dataset_creation_date', None)
-                        if date_creation:
-                            try:
-                                date_creation = date_creation.split('T')[0]
-                                date_creation = datetime.strptime(date_creation, ISOFORMAT_DATE)
-                            except ValueError as e:
-                                logger.warning(e)
-                                date_creation = None
-
-                        date_modification = package.get('dataset_modification_date', None)
-                        if date_modification:
-                            try:
-                                date_modification = date_modification.split('T')[0]
-                                date_modification = datetime.strptime(date_modification, ISOFORMAT_DATE)
-                            except ValueError as e:
-                                logger.warning(e)
-                                date_modification = None
-
-                        date_publication = package.get('dataset_publication_date', None)
-                        if date_publication:
-                            try:
-                                date_publication = date_publication.split('T')[0]
-                                date_publication = datetime.strptime(date_publication, ISOFORMAT_DATE)
-                            except ValueError as e:
-                                logger.warning(e)
-                                date_publication = None
-
-                        # Licence
-                        license_titles = package.get('license_titles')
-                        filters = [
-                            Q(slug__in=license_titles),
-                            Q(title__in=license_titles),
-                            Q(alternate_titles__overlap=license_titles),
-                            ]
-                        license = License.objects.filter(reduce(ior, filters)).distinct().first()
-                        if not license:
-                            try:
-                                license = License.objects.get(slug=DEFAULT_VALUE_LICENSE)
-                            except License.DoesNotExist:
-                                license = License.objects.first()
-
-                        slug = ('sync-%s' % slugify(package.get('id')))[:100]
-                        kvp = {
-                            'slug': slug,
-                            'title': package.get('title'),
-                            'description': package.get('notes'),
-                            'date_creation': date_creation and date_creation.date(),
-                            'date_modification': date_modification and date_modification.date(),
-                            'date_publication': date_publication and date_publication.date(),
-                            'editor': editor,
-                            'license': license,
-                            'owner_email': self.organisation.email or DEFAULT_CONTACT_EMAIL,
-                            'owner_name': self.organisation.legal_name or DEFAULT_PLATFORM_NAME,
-                            'organisation': self.organisation,
-                            'published': not package.get('private'),
-                            'remote_instance': self,
-                            'remote_dataset': dcat_id,
-                            'remote_organisation': package.get('publisher'),
-                            'update_frequency': update_frequency,
-                            'bbox': package.get('bbox'),
-                            }
-
-                        try:
-                            dataset, created = Dataset.harvested_dcat.update_or_create(**kvp)
-                        except Exception as e:
-                            logger.exception(e)
-                            warnings.warn("Impossible de moissonner le jeu de données '%s' : `%s`" % (dcat_id, e.__str__()))
-                            continue
+                        # La première page suffit si le catalogue n'est pas paginé
+                        fingerprint = get_harvest_fingerprint(dcat.validators, self.sync_with)
+                        if fingerprint and fingerprint == self.harvest_fingerprint:
+                            logger.info("DCAT catalogue '%s' is not modified." % self.url)
+                            return
 
-                        if created:
-                            dataset_ids.append(dataset.pk)
-                            ckan_ids.append(dataset.ckan_id)
-
-                        categories_name = [m['name'] for m in package.get('groups', [])]
-                        iso_topic_reverse = dict((v, k) for k, v in Category._meta.fields[5].choices)
-
-                        filters = [
-                            Q(slug__in=categories_name),
-                            Q(name__in=categories_name),
-                            Q(iso_topic__in=[m['name'] for m in package.get('groups', [])]),
-                            Q(iso_topic__in=[iso_topic_reverse.get(name) for name in categories_name]),
-                            Q(alternate_titles__overlap=categories_name),
-                            ]
+                        # Les fiches sont lues au fil des pages du catalogue
+                        count = 0
+                        for page in pages(dcat.get_packages(publishers=self.sync_with)):
+                            harvested = []
+                            for package in page:
+                                count += 1
+                                dcat_id = package.get('id')
+                                logger.info("[%d] - Get DCAT Record '%s'." % (count, str(dcat_id)))
+
+                                update_frequency = dict(Dataset.FREQUENCY_CHOICES).get(
+                                    package.get('frequency'), 'unknown')
+                                update_frequency = package.get('frequency')
+                                if not(update_frequency and update_frequency
+                                        in dict(Dataset.FREQUENCY_CHOICES).keys()):
+                                    update_frequency = 'unknown'
+
+                                date_creation = package.get('dataset_creation_date', None)
+                                if date_creation:
+                                    try:
+                                        date_creation = date_creation.split('T')[0]
+                                        date_creation = datetime.strptime(date_creation, ISOFORMAT_DATE)
+                                    except ValueError as e:
+                                        logger.warning(e)
+                                        date_creation = None
+
+                                date_modification = package.get('dataset_modification_date', None)
+                                if date_modification:
+                                    try:
+                                        date_modification = date_modification.split('T')[0]
+                                        date_modification = datetime.strptime(date_modification, ISOFORMAT_DATE)
+                                    except ValueError as e:
+                                        logger.warning(e)
+                                        date_modification = None
+
+                                date_publication = package.get('dataset_publication_date', None)
+                                if date_publication:
+                                    try:
+                                        date_publication = date_publication.split('T')[0]
+                                        date_publication = datetime.strptime(date_publication, ISOFORMAT_DATE)
+                                    except ValueError as e:
+                                        logger.warning(e)
+                                        date_publication = None
+
+                                # Licence
+                                license_titles = package.get('license_titles')
+                                filters = [
+                                    Q(slug__in=license_titles),
+                                    Q(title__in=license_titles),
+                                    Q(alternate_titles__overlap=license_titles),
+                                    ]
+                                license = License.objects.filter(reduce(ior, filters)).distinct().first()
+                                if not license:
+                                    try:
+                                        license = License.objects.get(slug=DEFAULT_VALUE_LICENSE)
+                                    except License.DoesNotExist:
+                                        license = License.objects.first()
 
-                        categories = Category.objects.filter(reduce(ior, filters)).distinct()
-                        if categories:
-                            dataset.categories.set(categories, clear=True)
+                                slug = ('sync-%s' % slugify(package.get('id')))[:100]
+                                kvp = {
+                                    'slug': slug,
+                                    'title': package.get('title'),
+                                    'description': package.get('notes'),
+                                    'date_creation': date_creation and date_creation.date(),
+                                    'date_modification': date_modification and date_modification.date(),
+                                    'date_publication': date_publication and date_publication.date(),
+                                    'editor': editor,
+                                    'license': license,
+                                    'owner_email': self.organisation.email or DEFAULT_CONTACT_EMAIL,
+                                    'owner_name': self.organisation.legal_name or DEFAULT_PLATFORM_NAME,
+                                    'organisation': self.organisation,
+                                    'published': not package.get('private'),
+                                    'remote_instance': self,
+                                    'remote_dataset': dcat_id,
+                                    'remote_organisation': package.get('publisher'),
+                                    'update_frequency': update_frequency,
+                                    'bbox': package.get('bbox'),
+                                    }
 
-                        if not created:
-                            dataset.keywords.clear()
-                        keywords = [tag['display_name'] for tag in package.get('tags')]
-                        dataset.keywords.add(*keywords)
+                                try:
+                                    dataset, created = Dataset.harvested_dcat.update_or_create(**kvp)
+                                except Exception as e:
+                                    logger.exception(e)
+                                    warnings.warn("Impossible de moissonner le jeu de données '%s' : `%s`" % (dcat_id, e.__str__()))
+                                    complete = False
+                                    continue
 
-                        dataset.save(current_user=None, synchronize=True, activate=False)
+                                if created:
+                                    dataset_ids.append(dataset.pk)
+                                    ckan_ids.append(dataset.ckan_id)
 
-                        for resource in package.get('resources', []):
-                            try:
-                                ckan_id = uuid.uuid4()
-                            except ValueError as e:
-                                logger.exception(e)
-                                logger.warning("Error was ignored.")
-                                continue
+                                metadata.add(
+                                    dataset, [tag['display_name'] for tag in package.get('tags')],
+                                    metadata.get_categories([m['name'] for m in package.get('groups', [])]))
+                                harvested.append((dataset, package))
 
-                            filters = []
-                            protocol = resource.get('protocol')
-                            protocol and filters.append(Q(protocol=protocol))
-                            mimetype = resource.get('mimetype')
-                            mimetype and filters.append(Q(mimetype__overlap=[mimetype]))
-                            try:
-                                format_type = ResourceFormats.objects.get(reduce(iand, filters))
-                            except (ResourceFormats.MultipleObjectsReturned, ResourceFormats.DoesNotExist, TypeError):
-                                format_type = None
+                            metadata.write()
+                            for dataset, package in harvested:
+                                dataset.save(current_user=None, synchronize=True, activate=False)
 
-                            save_opts = {
-                                'current_user': editor,
-                                'synchronize': True,
-                                'update_dataset': False,
-                            }
+                                for resource in package.get('resources', []):
+                                    try:
+                                        ckan_id = uuid.uuid4()
+                                    except ValueError as e:
+                                        logger.exception(e)
+                                        logger.warning("Error was ignored.")
+                                        continue
+
+                                    filters = []
+                                    protocol = resource.get('protocol')
+                                    protocol and filters.append(Q(protocol=protocol))
+                                    mimetype = resource.get('mimetype')
+                                    mimetype and filters.append(Q(mimetype__overlap=[mimetype]))
+                                    try:
+                                        format_type = ResourceFormats.objects.get(reduce(iand, filters))
+                                    except (ResourceFormats.MultipleObjectsReturned, ResourceFormats.DoesNotExist, TypeError):
+                                        format_type = None
+
+                                    save_opts = {
+                                        'current_user': editor,
+                                        'synchronize': True,
+                                        'update_dataset': False,
+                                    }
 
-                            kvp = {
-                                'ckan_id': ckan_id,
-                                'dataset': dataset,
-                                'format_type': format_type,
-                                'title': resource['name'] or resource['url'],
-                                'referenced_url': resource['url']}
+                                    kvp = {
+                                        'ckan_id': ckan_id,
+                                        'dataset': dataset,
+                                        'format_type': format_type,
+                                        'title': resource['name'] or resource['url'],
+                                        'referenced_url': resource['url']}
 
-                            try:
-                                resource = Resource.objects.get(ckan_id=ckan_id)
-                            except Resource.DoesNotExist:
-                                try:
-                                    resource = Resource.default.create(
-                                        save_opts=save_opts, **kvp)
-                                except Exception as e:
-                                    logger.exception(e)
-                                    warnings.warn("Impossible de moissonner la ressource '%s' : `%s`" % (ckan_id, e.__str__()))
-                            else:
-                                for k, v in kvp.items():
-                                    setattr(resource, k, v)
-                                resource.save(**save_opts)
+                                    try:
+                                        resource = Resource.objects.get(ckan_id=ckan_id)
+                                    except Resource.DoesNotExist:
+                                        try:
+                                            resource = Resource.default.create(
+                                                save_opts=save_opts, **kvp)
+                                        except Exception as e:
+                                            logger.exception(e)
+                                            warnings.warn("Impossible de moissonner la ressource '%s' : `%s`" % (ckan_id, e.__str__()))
+                                            complete = False
+                                    else:
+                                        for k, v in kvp.items():
+                                            setattr(resource, k, v)
+                                        resource.save(**save_opts)
+
+                        # Toutes les pages ont été lues
+                        fingerprint = get_harvest_fingerprint(dcat.validators, self.sync_with)
 
                 except Exception as e:
                     logger.exception(e)
@@ -1322,11 +1643,50 @@ if ENABLE_DCAT_HARVESTER:
                         dataset.delete()
                     # for id in ckan_ids:
                     #     CkanHandler.purge_dataset(str(id))
+                    remote_cache.invalidate(self.url)
                     raise CriticalError()
                 else:
                     for id in ckan_ids:
                         CkanHandler.publish_dataset(id=str(id), state='active')
 
+                    RemoteDcat.objects.filter(pk=self.pk).update(
+                        harvest_fingerprint=complete and fingerprint or None)
+
+        def preview(self):
+            """Aperçu du moissonnage (cf. `get_harvest_preview`)."""
+            sync_with = self.sync_with or []
+
+            local, deleted = {}, set()
+            for remote_dataset, remote_organisation, title, date_modification \
+                    in RemoteDcatDataset.objects.filter(remote_instance=self).values_list(
+                        'remote_dataset', 'remote_organisation',
+                        'dataset__title', 'dataset__date_modification'):
+                local[remote_dataset] = (title, date_modification)
+                if remote_organisation not in sync_with:
+                    deleted.add(remote_dataset)
+
+            remote = {}
+            if sync_with:
+                with DcatBaseHandler(self.url) as dcat:
+                    for package in dcat.get_packages(publishers=sync_with):
+                        date_modification = package.get('dataset_modification_date', None)
+                        if date_modification:
+                            try:
+                                date_modification = datetime.strptime(
+                                    date_modification.split('T')[0], ISOFORMAT_DATE).date()
+                            except ValueError:
+                                date_modification = None
+                        remote[package.get('id')] = (package.get('title'), date_modification)
+
+            return get_harvest_preview(local, remote, is_modified_since, deleted=deleted)
+
+        def reset_harvest(self):
+            """Oublier l'empreinte du précédent moissonnage : le prochain
+            moissonnage relit tout le catalogue."""
+            RemoteDcat.objects.filter(pk=self.pk).update(harvest_fingerprint=None)
+            self.harvest_fingerprint = None
+            remote_cache.invalidate(self.url)
+
         def delete(self, *args, **kwargs):
             Dataset = apps.get_model(app_label='idgo_admin', model_name='Dataset')
             for dataset in Dataset.harvested_dcat.filter(remote_instance=self):
@@ -0,0 +1,119 @@
+# Copyright (c) 2017-2021 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+from django.contrib.gis.db import models
+from django.contrib.postgres.fields import JSONField
+from django.utils import timezone
+
+from idgo_admin.managers import OutboxManager
+
+
+class OutboxMessage(models.Model):
+    """Effet de bord (CKAN, MRA, GeoNetwork) en attente de traitement.
+
+    Les messages sont écrits dans la même transaction que la modification
+    du modèle, puis traités de manière asynchrone par la tâche Celery
+    `drain_outbox`.
+    """
+
+    class Meta(object):
+        verbose_name = "Message sortant"
+        verbose_name_plural = "Messages sortants"
+        ordering = ('pk',)
+        index_together = (
+            ('state', 'available_at'),
+            )
+
+    objects = OutboxManager()
+
+    TARGET_CHOICES = (
+        ('ckan', "CKAN"),
+        ('mra', "MRA"),
+        ('geonet', "GeoNetwork"),
+        )
+
+    target = models.CharField(
+        verbose_name="Service cible",
+        max_length=10,
+        choices=TARGET_CHOICES,
+        )
+
+    action = models.CharField(
+        verbose_name="Action",
+        max_length=100,
+        )
+
+    object_key = models.CharField(
+        verbose_name="Objet concerné",
+        max_length=255,
+        db_index=True,
+        )
+
+    idempotency_key = models.CharField(
+        verbose_name="Clé d'idempotence",
+        max_length=255,
+        db_index=True,
+        )
+
+    payload = JSONField(
+        verbose_name="Paramètres",
+        blank=True,
+        null=True,
+        )
+
+    STATE_CHOICES = (
+        ('pending', "En attente"),
+        ('running', "En cours de traitement"),
+        ('done', "Traité"),
+        ('failed', "Échec définitif"),
+        )
+
+    state = models.CharField(
+        verbose_name="État",
+        max_length=10,
+        choices=STATE_CHOICES,
+        default='pending',
+        )
+
+    attempts = models.PositiveIntegerField(
+        verbose_name="Nombre de tentatives",
+        default=0,
+        )
+
+    last_error = models.TextField(
+        verbose_name="Dernière erreur",
+        blank=True,
+        null=True,
+        )
+
+    created_on = models.DateTimeField(
+        verbose_name="Date de création",
+        auto_now_add=True,
+        )
+
+    available_at = models.DateTimeField(
+        verbose_name="Traitable à partir de",
+        default=timezone.now,
+        )
+
+    processed_on = models.DateTimeField(
+        verbose_name="Date de traitement",
+        blank=True,
+        null=True,
+        )
+
+    def __str__(self):
+        return '{0} {1} ({2})'.format(self.target, self.action, self.object_key)
@@ -32,14 +32,16 @@ from django.contrib.postgres.fields import ArrayField
 from django.core.exceptions import ValidationError
 from django.core.files import File
 from django.db import IntegrityError
+from django.db import transaction
 from django.db.models.signals import post_delete
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.urls import reverse
 from django.utils import timezone
 
+from idgo_admin.ckan_module import ckan_unit_of_work
 from idgo_admin.ckan_module import CkanHandler
-from idgo_admin.ckan_module import CkanUserHandler
+from idgo_admin.ckan_module import CkanUserHandlers
 from idgo_admin.datagis import bounds_to_wkt
 from idgo_admin.datagis import DataDecodingError
 from idgo_admin.datagis import drop_table
@@ -55,6 +57,7 @@ from idgo_admin.datagis import WrongDataError
 from idgo_admin.exceptions import ExceedsMaximumLayerNumberFixedError
 from idgo_admin.exceptions import SizeLimitExceededError
 from idgo_admin.managers import DefaultResourceManager
+from idgo_admin import outbox
 from idgo_admin.utils import download
 from idgo_admin.utils import remove_file
 from idgo_admin.utils import slugify
@@ -64,6 +67,7 @@ from idgo_admin import CKAN_STORAGE_PATH
 from idgo_admin import CKAN_URL
 from idgo_admin import DATA_TRANSMISSION_SIZE_LIMITATION
 from idgo_admin import DOWNLOAD_SIZE_LIMIT
+from idgo_admin import ENABLE_OUTBOX
 from idgo_admin import PROTOCOL_CHOICES
 from idgo_admin import IDGO_USER_PARTNER_LABEL_PLURAL
 
@@ -73,10 +77,11 @@ logger = logging.getLogger('idgo_admin')
 
 def get_all_users_for_organisations(list_id):
     Profile = apps.get_model(app_label='idgo_admin', model_name='Profile')
-    return [
-        profile.user.username
-        for profile in Profile.objects.filter(
-            organisation__in=list_id, organisation__is_active=True)]
+    # Trié en Python, comme dans `sync_ckan_allowed_users_by_resource`
+    # (l'ordre de la base dépend de sa collation)
+    return sorted(set(Profile.objects.filter(
+        organisation__in=list_id, organisation__is_active=True
+        ).values_list('user__username', flat=True)))
 
 
 # =======================
@@ -281,6 +286,13 @@ class Resource(models.Model):
         blank=True,
         )
 
+    ckan_restricted = models.TextField(
+        verbose_name="Restriction d'accès transmise à CKAN",
+        blank=True,
+        null=True,
+        editable=False,
+        )
+
     dataset = models.ForeignKey(
         to='Dataset',
         verbose_name='Jeu de données',
@@ -430,6 +442,7 @@ class Resource(models.Model):
     # Méthodes héritées
     # =================
 
+    @ckan_unit_of_work()
     def save(self, *args, current_user=None, synchronize=False,
              file_extras=None, skip_download=False,
              update_m2m=False, update_dataset=True, **kwargs):
@@ -753,8 +766,7 @@ class Resource(models.Model):
                     if created:
                         if current_user:
                             username = current_user.username
-                            apikey = CkanHandler.get_user(username)['apikey']
-                            with CkanUserHandler(apikey) as ckan:
+                            with CkanUserHandlers.get(username) as ckan:
                                 ckan.delete_resource(str(self.ckan_id))
                         else:
                             CkanHandler.delete_resource(str(self.ckan_id))
@@ -804,13 +816,17 @@ class Resource(models.Model):
             remove_file(filename)
 
         # [Crado] on met à jour la ressource CKAN
-        if synchronize:
-            try:
-                CkanHandler.update_resource(
-                    str(self.ckan_id), extracting_service=str(self.extractable))
-            except Exception as e:
-                logger.exception(e)
-                logger.warning("Error was ignored.")
+        if synchronize and ENABLE_OUTBOX:
+            ckan_id = str(self.ckan_id)
+            outbox.enqueue(
+                'ckan', 'ckan.update_resource',
+                'dataset:%s' % self.dataset.ckan_id,
+                {'id': ckan_id, 'extracting_service': str(self.extractable)},
+                idempotency_key='ckan.update_resource:%s' % ckan_id)
+        elif synchronize:
+            CkanHandler.update_resource(
+                str(self.ckan_id), ignore_errors=True,
+                extracting_service=str(self.extractable))
 
         for layer in self.get_layers():
             layer.save(synchronize=synchronize)
@@ -821,6 +837,7 @@ class Resource(models.Model):
                               synchronize=True,
                               update_fields=['date_modification'])
 
+    @ckan_unit_of_work()
     def delete(self, *args, current_user=None, synchronize_dataset=True, **kwargs):
         with_user = current_user
 
@@ -829,17 +846,27 @@ class Resource(models.Model):
 
         # On supprime la ressource CKAN
         ckan_id = str(self.ckan_id)
-        if with_user:
-            username = with_user.username
-
-            apikey = CkanHandler.get_user(username)['apikey']
-            with CkanUserHandler(apikey=apikey) as ckan_user:
-                ckan_user.delete_resource(ckan_id)
+        if ENABLE_OUTBOX:
+            with transaction.atomic():
+                outbox.enqueue(
+                    'ckan', 'ckan.delete_resource',
+                    'dataset:%s' % self.dataset.ckan_id,
+                    {'id': ckan_id,
+                     'username': with_user and with_user.username or None},
+                    idempotency_key='ckan.delete_resource:%s' % ckan_id)
+                # On supprime l'instance
+                super().delete(*args, **kwargs)
         else:
-            CkanHandler.delete_resource(ckan_id)
+            if with_user:
+                username = with_user.username
 
-        # On supprime l'instance
-        super().delete(*args, **kwargs)
+                with CkanUserHandlers.get(username) as ckan_user:
+                    ckan_user.delete_resource(ckan_id)
+            else:
+                CkanHandler.delete_resource(ckan_id)
+
+            # On supprime l'instance
+            super().delete(*args, **kwargs)
 
         # Ce n'est vraiment pas une bonne idée de synchroniser ici le dataset :
         self.dataset.date_modification = timezone.now().date()
@@ -962,11 +989,18 @@ class Resource(models.Model):
         if with_user:
             username = with_user.username
 
-            apikey = CkanHandler.get_user(username)['apikey']
-            with CkanUserHandler(apikey=apikey) as ckan:
+            with CkanUserHandlers.get(username) as ckan:
                 ckan.publish_resource(ckan_package, **data)
+            ckan_resource = None
         else:
-            return CkanHandler.publish_resource(ckan_package, **data)
+            ckan_resource = CkanHandler.publish_resource(ckan_package, **data)
+
+        # On conserve la dernière valeur transmise à CKAN afin de ne
+        # pas la renvoyer inutilement (cf. `sync_ckan_allowed_users_by_resource`)
+        Resource.objects.filter(pk=self.pk).update(ckan_restricted=restricted)
+        self.ckan_restricted = restricted
+
+        return ckan_resource
 
     def get_layers(self, **kwargs):
         Layer = apps.get_model(app_label='idgo_admin', model_name='Layer')
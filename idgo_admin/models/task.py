@@ -68,3 +68,51 @@ class Task(models.Model):
         blank=True,
         null=True,
         )
+
+
+class BulkCheckpoint(models.Model):
+    """Point de reprise des traitements de masse (cf. `idgo_admin.bulk`)."""
+
+    class Meta(object):
+        verbose_name = "Point de reprise"
+        verbose_name_plural = "Points de reprise des traitements de masse"
+        unique_together = (('name', 'object_pk'),)
+
+    name = models.CharField(
+        verbose_name="Traitement",
+        max_length=100,
+        db_index=True,
+        )
+
+    object_pk = models.CharField(
+        verbose_name="Objet",
+        max_length=100,
+        )
+
+    STATE_CHOICES = (
+        ('done', "Traité"),
+        ('failed', "Échec"),
+        )
+
+    state = models.CharField(
+        verbose_name="État",
+        max_length=10,
+        choices=STATE_CHOICES,
+        )
+
+    error = models.TextField(
+        verbose_name="Erreur",
+        blank=True,
+        null=True,
+        )
+
+    duration = models.FloatField(
+        verbose_name="Durée (s)",
+        blank=True,
+        null=True,
+        )
+
+    processed_on = models.DateTimeField(
+        verbose_name="Date de traitement",
+        auto_now=True,
+        )
@@ -17,11 +17,9 @@
 import ast
 from functools import reduce
 from functools import wraps
-import inspect
 import logging
 from lxml import etree
 from lxml import objectify
-import os
 from urllib.parse import urljoin
 
 from requests import request
@@ -29,6 +27,7 @@ from requests import request
 from django.apps import apps
 
 from idgo_admin.exceptions import GenericException
+from idgo_admin.metrics import instrument
 from idgo_admin.utils import Singleton
 from idgo_admin.utils import kill_all_special_characters
 
@@ -119,30 +118,22 @@ class MRAExceptionsHandler(object):
         @wraps(f)
         def wrapper(*args, **kwargs):
 
-            root_dir = os.path.dirname(os.path.abspath(__file__))
-            info = inspect.getframeinfo(inspect.stack()[1][0])
-            logger.debug(
-                'Run {} (called by file "{}", line {}, in {})'.format(
-                    f.__qualname__,
-                    info.filename.replace(root_dir, '.'),
-                    info.lineno,
-                    info.function))
-
-            try:
-                return f(*args, **kwargs)
-            except Exception as e:
-                if self.is_ignored(e):
-                    return f(*args, **kwargs)
-                if e.__class__.__qualname__ == 'HTTPError':
-                    if e.response.status_code == 404:
-                        raise MRANotFoundError()
-                    if e.response.status_code == 409:
-                        raise MRAConflictError()
-                    if e.response.status_code == 500:
-                        raise MRACriticalError()
-                if self.is_ignored(e):
+            with instrument('mra', f.__qualname__):
+                try:
                     return f(*args, **kwargs)
-                raise MRASyncingError(e.__str__())
+                except Exception as e:
+                    if self.is_ignored(e):
+                        return f(*args, **kwargs)
+                    if e.__class__.__qualname__ == 'HTTPError':
+                        if e.response.status_code == 404:
+                            raise MRANotFoundError()
+                        if e.response.status_code == 409:
+                            raise MRAConflictError()
+                        if e.response.status_code == 500:
+                            raise MRACriticalError()
+                    if self.is_ignored(e):
+                        return f(*args, **kwargs)
+                    raise MRASyncingError(e.__str__())
         return wrapper
 
     def is_ignored(self, exception):
@@ -0,0 +1,250 @@
+# Copyright (c) 2017-2021 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""Outbox transactionnelle des effets de bord CKAN, MRA et GeoNetwork.
+
+Les modèles enregistrent leurs appels aux services distants sous la forme
+de messages (`OutboxMessage`) écrits dans la même transaction que leurs
+propres modifications. La tâche Celery `drain_outbox` traite ensuite ces
+messages :
+
+* un seul message en cours par objet, dans l'ordre d'insertion ;
+* un nombre maximal de messages en cours par service (`OUTBOX_CONCURRENCY`) ;
+* nouvelle tentative avec délai exponentiel en cas d'échec, jusqu'à
+  `OUTBOX_MAX_ATTEMPTS` tentatives.
+"""
+
+
+import logging
+import zlib
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db import transaction
+from django.db.models import Exists
+from django.db.models import OuterRef
+from django.utils import timezone
+
+from idgo_admin.ckan_module import ckan_unit_of_work
+from idgo_admin.ckan_module import CkanHandler
+from idgo_admin.ckan_module import CkanUserHandlers
+from idgo_admin.geonet_module import GeonetUserHandler as geonet
+from idgo_admin.mra_client import MRAHandler
+from idgo_admin.mra_client import MRANotFoundError
+
+from idgo_admin import OUTBOX_CONCURRENCY
+from idgo_admin import OUTBOX_MAX_ATTEMPTS
+from idgo_admin import OUTBOX_RETRY_DELAY
+
+
+logger = logging.getLogger('idgo_admin')
+
+
+# Durée au-delà de laquelle un message en cours de traitement est considéré
+# comme abandonné (par exemple suite à l'arrêt brutal d'un worker).
+LEASE = timezone.timedelta(hours=1)
+
+
+def enqueue(target, action, object_key, payload=None, idempotency_key=None):
+    OutboxMessage = apps.get_model(
+        app_label='idgo_admin', model_name='OutboxMessage')
+    return OutboxMessage.objects.enqueue(
+        target, action, object_key, payload=payload,
+        idempotency_key=idempotency_key)
+
+
+# Actions
+# =======
+
+
+ACTIONS = {}
+
+
+def outbox_action(name):
+    def decorate(f):
+        ACTIONS[name] = f
+        return f
+    return decorate
+
+
+def _get_user(username):
+    if username:
+        try:
+            return User.objects.get(username=username)
+        except User.DoesNotExist:
+            logger.warning("User '%s' does not exist anymore." % username)
+
+
+@outbox_action('dataset.synchronize')
+def synchronize_dataset(dataset=None, username=None, activate=None):
+    Dataset = apps.get_model(app_label='idgo_admin', model_name='Dataset')
+    try:
+        instance = Dataset.objects.get(pk=dataset)
+    except Dataset.DoesNotExist:
+        logger.info("Dataset '%s' has been deleted meanwhile." % dataset)
+        return
+    with ckan_unit_of_work():
+        instance.synchronize(with_user=_get_user(username), activate=activate)
+
+
+@outbox_action('layer.synchronize')
+def synchronize_layer(layer=None):
+    Layer = apps.get_model(app_label='idgo_admin', model_name='Layer')
+    try:
+        instance = Layer.objects.get(pk=layer)
+    except Layer.DoesNotExist:
+        logger.info("Layer '%s' has been deleted meanwhile." % layer)
+        return
+    with ckan_unit_of_work():
+        instance.synchronize()
+
+
+@outbox_action('ckan.update_resource')
+def update_ckan_resource(id=None, **kwargs):
+    CkanHandler.update_resource(id, **kwargs)
+
+
+@outbox_action('organisation.deactivate_if_empty')
+def deactivate_organisation_if_empty(id=None):
+    CkanHandler.deactivate_ckan_organisation_if_empty(id)
+
+
+@outbox_action('ckan.delete_resource')
+def delete_ckan_resource(id=None, username=None):
+    if username:
+        with CkanUserHandlers.get(username) as ckan_user:
+            ckan_user.delete_resource(id)
+    else:
+        CkanHandler.delete_resource(id)
+
+
+@outbox_action('ckan.delete_dataset')
+def delete_ckan_dataset(id=None, username=None):
+    if username:
+        with CkanUserHandlers.get(username) as ckan_user:
+            ckan_user.delete_dataset(id)
+    else:
+        CkanHandler.delete_dataset(id)
+    CkanHandler.purge_dataset(id)
+
+
+@outbox_action('geonet.delete_record')
+def delete_geonet_record(id=None):
+    geonet.delete_record(id)
+
+
+@outbox_action('mra.delete_layer')
+def delete_mra_layer(name=None, ws_name=None, type=None):
+    # Les objets déjà supprimés sont ignorés pour que l'action reste rejouable.
+    try:
+        MRAHandler.del_layer(name)
+    except MRANotFoundError:
+        pass
+    try:
+        if type == 'vector':
+            MRAHandler.del_featuretype(ws_name, 'public', name)
+        if type == 'raster':
+            MRAHandler.del_coverage(ws_name, name, name)
+    except MRANotFoundError:
+        pass
+
+
+# Traitement des messages
+# =======================
+
+
+def claim(target):
+    """Réserver le plus ancien message traitable pour le service `target`."""
+    OutboxMessage = apps.get_model(
+        app_label='idgo_admin', model_name='OutboxMessage')
+
+    now = timezone.now()
+    with transaction.atomic():
+        # Sérialise les réservations d'un même service afin de garantir
+        # le respect de la limite de concurrence.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT pg_advisory_xact_lock(%s)', [zlib.crc32(target.encode())])
+
+        # Les messages abandonnés sont remis en attente.
+        OutboxMessage.objects.filter(
+            target=target, state='running', available_at__lt=now
+            ).update(state='pending')
+
+        running = OutboxMessage.objects.filter(target=target, state='running')
+        if running.count() >= OUTBOX_CONCURRENCY.get(target, 1):
+            return None
+
+        older = OutboxMessage.objects.filter(
+            object_key=OuterRef('object_key'),
+            state__in=('pending', 'running'),
+            pk__lt=OuterRef('pk'))
+
+        message = OutboxMessage.objects \
+            .filter(target=target, state='pending', available_at__lte=now) \
+            .annotate(blocked=Exists(older)) \
+            .filter(blocked=False) \
+            .order_by('pk') \
+            .select_for_update(skip_locked=True) \
+            .first()
+
+        if message:
+            message.state = 'running'
+            message.available_at = now + LEASE
+            message.save(update_fields=['state', 'available_at'])
+        return message
+
+
+def process(message):
+    action = ACTIONS.get(message.action)
+    try:
+        if not action:
+            raise ValueError("Unknown outbox action '%s'" % message.action)
+        action(**(message.payload or {}))
+    except Exception as e:
+        logger.exception(e)
+        message.attempts += 1
+        message.last_error = str(e)
+        if message.attempts >= OUTBOX_MAX_ATTEMPTS:
+            message.state = 'failed'
+            message.processed_on = timezone.now()
+        else:
+            message.state = 'pending'
+            delay = OUTBOX_RETRY_DELAY * 2 ** (message.attempts - 1)
+            message.available_at = \
+                timezone.now() + timezone.timedelta(seconds=delay)
+    else:
+        message.state = 'done'
+        message.processed_on = timezone.now()
+    message.save()
+
+
+def drain(limit=100):
+    """Traiter au plus `limit` messages en attente, tous services confondus."""
+    targets = list(OUTBOX_CONCURRENCY.keys()) or ['ckan', 'mra', 'geonet']
+    count = 0
+    while count < limit:
+        claimed = 0
+        for target in targets:
+            message = claim(target)
+            if message:
+                process(message)
+                claimed += 1
+                count += 1
+        if not claimed:
+            break
+    return count
@@ -0,0 +1,218 @@
+# Copyright (c) 2017-2021 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""Rapprochement des jeux de données IDGO et des paquets CKAN.
+
+L'état de CKAN est récupéré de manière compacte (champs de l'index Solr
+uniquement, dont la description validée des paquets pour en extraire les
+ressources) puis comparé en mémoire avec les jeux de données IDGO et leurs
+ressources. Seuls les paquets des organisations IDGO sont considérés.
+"""
+
+
+from collections import defaultdict
+from collections import namedtuple
+import json
+import logging
+
+from django.apps import apps
+from django.db.models import Count
+
+from idgo_admin.ckan_module import CkanHandler
+
+
+logger = logging.getLogger('idgo_admin')
+
+
+# Champs de l'index CKAN utilisés pour la comparaison
+CKAN_FIELDS = (
+    'id', 'name', 'owner_org', 'capacity', 'metadata_modified', 'num_resources',
+    'validated_data_dict')
+
+
+# kind : 'missing' (absent de CKAN), 'orphaned' (absent d'IDGO) ou 'stale'
+# model : 'dataset' ou 'resource'
+Drift = namedtuple('Drift', ('kind', 'model', 'pk', 'ckan_id', 'reasons'))
+
+
+def get_ckan_resources(package):
+    """Extraire les ressources (identifiant et date de modification) de
+    la description validée d'un paquet de l'index."""
+    try:
+        data = json.loads(package.pop('validated_data_dict'))
+    except (KeyError, TypeError, ValueError):
+        return None
+    return {
+        resource['id']: {
+            'modified': (
+                resource.get('metadata_modified') or resource.get('last_modified')
+                or resource.get('created') or '')[:10],
+            }
+        for resource in data.get('resources') or []}
+
+
+def get_ckan_state(**kwargs):
+    """Retourner l'état compact des paquets CKAN, indexé par identifiant."""
+    state = {}
+    for package in CkanHandler.iter_packages(fl=CKAN_FIELDS, **kwargs):
+        package['resources'] = get_ckan_resources(package)
+        state[package['id']] = package
+    return state
+
+
+def get_idgo_state(**filters):
+    """Retourner l'état des jeux de données IDGO, indexé par `ckan_id`."""
+    Dataset = apps.get_model(app_label='idgo_admin', model_name='Dataset')
+    Resource = apps.get_model(app_label='idgo_admin', model_name='Resource')
+
+    resources = defaultdict(dict)
+    for dataset_id, pk, ckan_id, last_update in Resource.objects.filter(
+            dataset__in=Dataset.objects.filter(**filters)).values_list(
+            'dataset_id', 'pk', 'ckan_id', 'last_update'):
+        if ckan_id:
+            resources[dataset_id][str(ckan_id)] = {
+                'pk': pk,
+                'modified': last_update and last_update.date().isoformat() or '',
+                }
+
+    queryset = Dataset.objects.filter(**filters) \
+        .annotate(num_resources=Count('resource')) \
+        .values_list(
+            'pk', 'ckan_id', 'slug', 'organisation__ckan_id',
+            'published', 'date_modification', 'num_resources')
+
+    return {
+        str(ckan_id): {
+            'pk': pk,
+            'name': slug,
+            'owner_org': organisation_id and str(organisation_id) or None,
+            'capacity': published and 'public' or 'private',
+            'date_modification': date_modification,
+            'num_resources': num_resources,
+            'resources': resources[pk],
+            }
+        for pk, ckan_id, slug, organisation_id, published, date_modification,
+        num_resources in queryset if ckan_id}
+
+
+def get_idgo_organisations():
+    """Retourner les identifiants CKAN des organisations IDGO."""
+    Organisation = apps.get_model(app_label='idgo_admin', model_name='Organisation')
+    return set(
+        str(ckan_id) for ckan_id
+        in Organisation.objects.exclude(ckan_id=None).values_list('ckan_id', flat=True))
+
+
+def compare_datasets(idgo, ckan, organisations):
+    """Comparer les états IDGO et CKAN des jeux de données.
+
+    Seuls les paquets des organisations IDGO (`organisations`) sont
+    considérés comme orphelins : ceux des autres organisations CKAN ne
+    relèvent pas d'IDGO.
+    """
+    drifts = []
+
+    for ckan_id in idgo.keys() - ckan.keys():
+        drifts.append(Drift('missing', 'dataset', idgo[ckan_id]['pk'], ckan_id, []))
+
+    for ckan_id in ckan.keys() - idgo.keys():
+        if ckan[ckan_id].get('owner_org') in organisations:
+            drifts.append(Drift('orphaned', 'dataset', None, ckan_id, []))
+
+    for ckan_id in idgo.keys() & ckan.keys():
+        local, remote = idgo[ckan_id], ckan[ckan_id]
+        reasons = [
+            field for field in ('name', 'owner_org', 'capacity', 'num_resources')
+            if local[field] != remote.get(field)]
+
+        metadata_modified = (remote.get('metadata_modified') or '')[:10]
+        if local['date_modification'] \
+                and local['date_modification'].isoformat() > metadata_modified:
+            reasons.append('metadata_modified')
+
+        if reasons:
+            drifts.append(Drift('stale', 'dataset', local['pk'], ckan_id, reasons))
+
+        drifts.extend(compare_resources(local, remote))
+
+    return drifts
+
+
+def compare_resources(local, remote):
+    """Comparer les ressources d'un jeu de données avec celles du paquet CKAN.
+
+    IDGO ne conservant pas l'empreinte (`hash`) des ressources, une
+    ressource est désynchronisée si elle a été modifiée dans IDGO après
+    sa dernière modification dans CKAN.
+    """
+    idgo = local['resources']
+    ckan = remote.get('resources')
+    if ckan is None:
+        # La description validée n'est pas dans l'index : le paquet est lu
+        package = CkanHandler.get_package(remote['id'], include_tracking=False) or {}
+        ckan = get_ckan_resources({
+            'validated_data_dict': json.dumps(package)}) or {}
+
+    drifts = [
+        Drift('missing', 'resource', idgo[id]['pk'], id, [])
+        for id in idgo.keys() - ckan.keys()]
+    drifts += [
+        Drift('orphaned', 'resource', None, id, [])
+        for id in ckan.keys() - idgo.keys()]
+    for id in idgo.keys() & ckan.keys():
+        if idgo[id]['modified'] > ckan[id]['modified']:
+            drifts.append(Drift('stale', 'resource', idgo[id]['pk'], id, ['modified']))
+    return drifts
+
+
+def reconcile(filters=None, **kwargs):
+    """Retourner l'ensemble des écarts entre IDGO et CKAN."""
+    idgo = get_idgo_state(**(filters or {}))
+    ckan = get_ckan_state(**kwargs)
+    return compare_datasets(idgo, ckan, get_idgo_organisations())
+
+
+def apply(drifts, delete_orphans=False):
+    """Corriger les écarts ; les éléments orphelins (paquets des seules
+    organisations IDGO, cf. `compare_datasets`) ne sont supprimés de CKAN
+    que si `delete_orphans` est vrai.
+    """
+    Dataset = apps.get_model(app_label='idgo_admin', model_name='Dataset')
+    Resource = apps.get_model(app_label='idgo_admin', model_name='Resource')
+
+    datasets = set()
+    resources = set()
+    for drift in drifts:
+        try:
+            if drift.kind == 'orphaned':
+                if not delete_orphans:
+                    continue
+                if drift.model == 'dataset':
+                    CkanHandler.delete_dataset(drift.ckan_id)
+                    CkanHandler.purge_dataset(drift.ckan_id)
+                else:
+                    CkanHandler.delete_resource(drift.ckan_id)
+            elif drift.model == 'dataset' and drift.pk not in datasets:
+                datasets.add(drift.pk)
+                Dataset.objects.get(pk=drift.pk).save(
+                    current_user=None, synchronize=True)
+            elif drift.model == 'resource' and drift.pk not in resources:
+                resources.add(drift.pk)
+                Resource.objects.get(pk=drift.pk).save(
+                    current_user=None, synchronize=True)
+        except Exception as e:
+            logger.exception(e)
+            logger.warning("Error was ignored.")
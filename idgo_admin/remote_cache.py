@@ -0,0 +1,193 @@
+# Copyright (c) 2017-2021 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""Cache disque des documents retournés par les catalogues distants.
+
+Les réponses portant un en-tête `ETag` ou `Last-Modified` sont conservées
+compressées (gzip) avec ces en-têtes ; les requêtes suivantes sont
+conditionnelles (`If-None-Match`, `If-Modified-Since`) et une réponse 304
+est servie depuis le cache. L'attribut `not_modified` des réponses l'indique.
+
+Les entrées sont regroupées par catalogue (`namespace`), ce qui permet de
+toutes les oublier après un moissonnage en échec (cf. `invalidate`).
+"""
+
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from urllib.parse import urlencode
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from idgo_admin import ENABLE_REMOTE_CACHE
+from idgo_admin import REMOTE_CACHE_DIR
+
+
+logger = logging.getLogger('idgo_admin')
+
+
+CACHE_DIR = REMOTE_CACHE_DIR or os.path.join(tempfile.gettempdir(), 'idgo-remote-cache')
+
+# En-têtes conservés avec le document
+STORED_HEADERS = ('content-type', 'etag', 'last-modified')
+
+
+def get_directory(namespace):
+    return os.path.join(
+        CACHE_DIR, hashlib.sha256(namespace.encode('utf-8')).hexdigest())
+
+
+def invalidate(namespace):
+    """Oublier les documents mis en cache pour le catalogue `namespace`."""
+    shutil.rmtree(get_directory(namespace), ignore_errors=True)
+
+
+class CachingSession(requests.Session):
+    """Session HTTP s'appuyant sur le cache disque.
+
+    Les requêtes GET sont mises en cache, ainsi que les requêtes POST si
+    `cache_post` est vrai (ex. requêtes GetRecords d'un service CSW).
+    """
+
+    def __init__(self, namespace, cache_post=False):
+        super().__init__()
+        self.directory = get_directory(namespace)
+        self.cache_post = cache_post
+
+    def _get_key(self, method, url, params=None, data=None):
+        key = hashlib.sha256()
+        key.update(method.encode('utf-8'))
+        key.update(url.encode('utf-8'))
+        if params:
+            key.update(urlencode(sorted(dict(params).items()), doseq=True).encode('utf-8'))
+        if data:
+            key.update(isinstance(data, bytes) and data or str(data).encode('utf-8'))
+        return key.hexdigest()
+
+    def _load(self, key):
+        try:
+            with open(os.path.join(self.directory, '%s.json' % key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _discard(self, key):
+        for ext in ('json', 'gz'):
+            try:
+                os.remove(os.path.join(self.directory, '%s.%s' % (key, ext)))
+            except OSError:
+                pass
+
+    def _store(self, key, response):
+        os.makedirs(self.directory, exist_ok=True)
+        body_path = os.path.join(self.directory, '%s.gz' % key)
+
+        fd, path = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f, gzip.GzipFile(fileobj=f, mode='wb') as gz:
+                for chunk in response.iter_content(chunk_size=65536):
+                    gz.write(chunk)
+            os.replace(path, body_path)
+        except OSError:
+            os.remove(path)
+            raise
+
+        entry = {
+            'url': response.url,
+            'headers': dict(
+                (k, v) for k, v in response.headers.items() if k.lower() in STORED_HEADERS),
+            }
+        fd, path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entry, f)
+        os.replace(path, os.path.join(self.directory, '%s.json' % key))
+        return entry
+
+    def _from_cache(self, key, entry, response, not_modified):
+        cached = requests.Response()
+        cached.status_code = 200
+        cached.reason = 'OK'
+        cached.url = response.url
+        cached.request = response.request
+        cached.headers = CaseInsensitiveDict(entry['headers'])
+        cached.encoding = requests.utils.get_encoding_from_headers(cached.headers)
+        cached.raw = gzip.open(os.path.join(self.directory, '%s.gz' % key), 'rb')
+        cached.not_modified = not_modified
+        return cached
+
+    def request(self, method, url, params=None, data=None, headers=None, **kwargs):
+        method = method.upper()
+        if not (method == 'GET' or (method == 'POST' and self.cache_post)):
+            return super().request(
+                method, url, params=params, data=data, headers=headers, **kwargs)
+
+        key = self._get_key(method, url, params=params, data=data)
+        entry = self._load(key)
+
+        request_headers = headers
+        headers = dict(headers or {})
+        if entry:
+            etag = entry['headers'].get('ETag') or entry['headers'].get('etag')
+            last_modified = entry['headers'].get('Last-Modified') \
+                or entry['headers'].get('last-modified')
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        kwargs['stream'] = True
+        response = super().request(
+            method, url, params=params, data=data, headers=headers, **kwargs)
+
+        if response.status_code == 304 and entry:
+            response.close()
+            logger.debug("Not modified: %s" % url)
+            return self._from_cache(key, entry, response, True)
+
+        if response.status_code == 200:
+            # Une réponse sans validateur ne pourrait pas être revalidée
+            if not (response.headers.get('etag') or response.headers.get('last-modified')):
+                if entry:
+                    self._discard(key)
+                response.not_modified = False
+                return response
+            try:
+                with response:
+                    entry = self._store(key, response)
+            except OSError as e:
+                logger.warning(e)
+                # Le corps de la réponse est consommé : la requête est rejouée sans le cache
+                self._discard(key)
+                response = super().request(
+                    method, url, params=params, data=data, headers=request_headers, **kwargs)
+            else:
+                return self._from_cache(key, entry, response, False)
+
+        response.not_modified = False
+        return response
+
+
+def get_session(namespace, cache_post=False):
+    """Retourner une session HTTP pour le catalogue `namespace`."""
+    if ENABLE_REMOTE_CACHE:
+        return CachingSession(namespace, cache_post=cache_post)
+    return requests.Session()
@@ -0,0 +1,125 @@
+# Copyright (c) 2017-2021 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""Instantané des rôles d'un utilisateur, conservé dans Redis.
+
+L'instantané (profil, administrateur, acceptation des CGU, organisations
+pour lesquelles l'utilisateur est contributeur ou référent) est consulté
+par les middlewares et le processeur de contexte à chaque requête.
+
+Il est invalidé par les signaux des modèles concernés : par utilisateur
+(`invalidate`) ou pour tous (`invalidate_all`, ex. nouvelles CGU).
+"""
+
+
+import json
+import logging
+
+from django.apps import apps
+import redis
+
+from idgo_admin import REDIS_HOST
+from idgo_admin import REDIS_PORT
+from idgo_admin import ROLES_SNAPSHOT_EXPIRATION
+
+
+logger = logging.getLogger('idgo_admin')
+
+
+strict_redis = redis.StrictRedis(REDIS_HOST, REDIS_PORT)
+
+PREFIX = 'idgo:roles'
+
+GENERATION_KEY = '%s:generation' % PREFIX
+
+
+def get_key(user_id):
+    return '%s:user:%d' % (PREFIX, user_id)
+
+
+def build_snapshot(user, generation=0):
+    Organisation = apps.get_model(app_label='idgo_admin', model_name='Organisation')
+    Profile = apps.get_model(app_label='idgo_admin', model_name='Profile')
+
+    snapshot = {
+        'generation': generation,
+        'has_profile': False,
+        'is_admin': False,
+        'is_agree_with_terms': False,
+        'contributor': [],
+        'referent': [],
+        }
+
+    try:
+        profile = Profile.objects.get(user=user)
+    except Profile.DoesNotExist:
+        return snapshot
+
+    snapshot.update({
+        'has_profile': True,
+        'is_admin': profile.is_admin,
+        'is_agree_with_terms': profile.is_agree_with_terms,
+        'contributor': list(
+            Organisation.extras.get_contribs(profile).values_list('pk', 'legal_name')),
+        'referent': list(
+            Organisation.extras.get_subordinated_organisations(profile).values_list('pk', 'legal_name')),
+        })
+    return snapshot
+
+
+def get_snapshot(user):
+    """Retourner l'instantané des rôles de l'utilisateur authentifié.
+
+    L'instantané est aussi conservé sur l'objet `user` le temps de la requête.
+    """
+    snapshot = getattr(user, '_roles_snapshot', None)
+    if snapshot:
+        return snapshot
+
+    key = get_key(user.pk)
+    try:
+        generation, cached = strict_redis.mget(GENERATION_KEY, key)
+    except redis.exceptions.RedisError as e:
+        logger.warning(e)
+        generation, cached = None, None
+
+    generation = int(generation or 0)
+    snapshot = cached and json.loads(cached.decode('utf-8'))
+    if not snapshot or snapshot['generation'] != generation:
+        snapshot = build_snapshot(user, generation=generation)
+        try:
+            strict_redis.set(key, json.dumps(snapshot), ex=ROLES_SNAPSHOT_EXPIRATION)
+        except redis.exceptions.RedisError as e:
+            logger.warning(e)
+
+    user._roles_snapshot = snapshot
+    return snapshot
+
+
+def invalidate(user_id):
+    """Invalider l'instantané des rôles de l'utilisateur."""
+    try:
+        strict_redis.delete(get_key(user_id))
+    except redis.exceptions.RedisError as e:
+        logger.warning(e)
+
+
+def invalidate_all():
+    """Invalider les instantanés des rôles de tous les utilisateurs."""
+    try:
+        strict_redis.incr(GENERATION_KEY)
+    except redis.exceptions.RedisError as e:
+        logger.warning(e)
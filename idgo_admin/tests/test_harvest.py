@@ -0,0 +1,87 @@
+# Copyright (c) 2017-2021 Neogeo-Technologies.
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from idgo_admin.csw_module import CswBaseHandler
+from idgo_admin.csw_module import CswError
+from idgo_admin.csw_module import Page
+from idgo_admin.harvest import get_vanished
+
+
+def get_handler():
+    # Le constructeur interroge le service CSW
+    csw = CswBaseHandler.__new__(CswBaseHandler)
+    csw.validators = None
+    csw.matched = csw.returned = csw.rejected = 0
+    return csw
+
+
+def get_pages(total, size, matched=None, short=None, rejected=0):
+    """Simuler `CswBaseHandler.get_page` pour un service retournant `size`
+    fiches par page (la page débutant à `short` n'en retourne qu'une)."""
+    def get_page(template, start, timeout):
+        returned = max(min(size, total - start + 1), 0)
+        if start == short:
+            returned = 1
+        next_record = start + returned <= total and start + returned or 0
+        packages = [{'id': str(i)} for i in range(start, start + returned)]
+        return Page(
+            packages, total if matched is None else matched,
+            returned, next_record, rejected, None)
+    return get_page
+
+
+class GetPackagesTestCase(SimpleTestCase):
+
+    def test_pages_by_returned_count(self):
+        csw = get_handler()
+        with mock.patch.object(csw, 'get_page', side_effect=get_pages(25, 10)) as get_page:
+            packages = csw.get_packages()
+        self.assertEqual(len(packages), 25)
+        self.assertEqual(
+            sorted(call[0][1] for call in get_page.call_args_list), [1, 11, 21])
+        self.assertEqual((csw.matched, csw.returned, csw.rejected), (25, 25, 0))
+
+    def test_short_page_fails(self):
+        csw = get_handler()
+        with mock.patch.object(csw, 'get_page', side_effect=get_pages(25, 10, short=11)):
+            with self.assertRaises(CswError):
+                csw.get_packages()
+
+    def test_follows_next_record_when_matched_is_unknown(self):
+        csw = get_handler()
+        with mock.patch.object(csw, 'get_page', side_effect=get_pages(25, 10, matched=0)):
+            packages = csw.get_packages()
+        self.assertEqual(len(packages), 25)
+        self.assertEqual((csw.matched, csw.returned), (25, 25))
+
+    def test_counts_rejected_records(self):
+        csw = get_handler()
+        with mock.patch.object(csw, 'get_page', side_effect=get_pages(25, 10, rejected=1)):
+            csw.get_packages()
+        self.assertEqual(csw.rejected, 3)
+
+
+class GetVanishedTestCase(SimpleTestCase):
+
+    def test_complete_harvest(self):
+        self.assertEqual(get_vanished(['a', 'b', 'c'], {'a'}, True), {'b', 'c'})
+
+    def test_incomplete_harvest_deletes_nothing(self):
+        self.assertEqual(get_vanished(['a', 'b', 'c'], {'a'}, False), set())
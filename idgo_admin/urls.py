@@ -57,6 +57,7 @@ from idgo_admin.views.organisation import CreateOrganisation
 from idgo_admin.views.organisation import idgo_partnership
 from idgo_admin.views.organisation import handle_show_organisation
 from idgo_admin.views.organisation import OrganisationOWS
+from idgo_admin.views.organisation import search_organisations
 from idgo_admin.views.organisation import show_organisation
 from idgo_admin.views.organisation import Subscription
 from idgo_admin.views.organisation import UpdateOrganisation
@@ -65,6 +66,7 @@ from idgo_admin.views.resource import ResourceManager
 from idgo_admin.views.sld_preview import SLDPreviewGetter
 from idgo_admin.views.sld_preview import SLDPreviewSetter
 from idgo_admin.views.stuffs import DisplayLicenses
+from idgo_admin.views.stuffs import export_metrics
 from idgo_admin.views.stuffs import ows_preview
 
 
@@ -112,6 +114,7 @@ urlpatterns = [
 
     url('^organisation(/all)?/?$', handle_show_organisation, name='handle_show_organisation'),
     url('^organisation/(?P<id>(\d+))/show/?$', show_organisation, name='show_organisation'),
+    url('^organisation/search/?$', search_organisations, name='search_organisations'),
     url('^organisation/new/edit/?$', CreateOrganisation.as_view(), name='create_organisation'),
     url('^organisation/(?P<id>(\d+))/edit/?$', UpdateOrganisation.as_view(), name='update_organisation'),
 
@@ -131,6 +134,7 @@ urlpatterns = [
 
     url('^action/?$', ActionsManager.as_view(), name='action'),
     url('^licences/?$', DisplayLicenses.as_view(), name='licences'),
+    url('^metrics/?$', export_metrics, name='metrics'),
 
     url('^owspreview/?$', ows_preview, name='ows_preview'),
     url('^sldpreview/?$', SLDPreviewSetter.as_view(), name='sld_preview_setter'),
@@ -14,6 +14,7 @@
 # under the License.
 
 
+from contextlib import ContextDecorator
 from decimal import Decimal
 import json
 import logging
@@ -21,6 +22,7 @@ import os
 import re
 import shutil
 import string
+import threading
 import time
 import unicodedata
 from urllib.parse import urlparse
@@ -38,6 +40,8 @@ from django.utils.safestring import SafeText
 from idgo_admin.exceptions import SizeLimitExceededError
 
 from idgo_admin import DATA_DOWNLOAD_TIMEOUT
+from idgo_admin import REMOTE_CONNECT_TIMEOUT
+from idgo_admin import REMOTE_READ_TIMEOUT
 
 
 logger = logging.getLogger('idgo_admin')
@@ -64,6 +68,68 @@ class Singleton(type):
         return cls.__instances[cls]
 
 
+# Délais d'attente des services distants
+
+
+class DeadlineExceeded(Exception):
+    """L'échéance fixée pour l'opération en cours est dépassée."""
+
+
+class deadline(ContextDecorator):
+    """Fixer une échéance (en secondes) à l'ensemble des appels distants
+    effectués dans le bloc ou la fonction décorée.
+
+    En cas d'imbrication, c'est l'échéance la plus proche qui s'applique.
+    """
+
+    _local = threading.local()
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    @classmethod
+    def _stack(cls):
+        if not hasattr(cls._local, 'stack'):
+            cls._local.stack = []
+        return cls._local.stack
+
+    def __enter__(self):
+        stack = self._stack()
+        previous = stack and stack[-1] or None
+        value = self.seconds and time.monotonic() + self.seconds or None
+        if previous and (not value or previous < value):
+            value = previous
+        stack.append(value)
+        return self
+
+    def __exit__(self, *exc):
+        self._stack().pop()
+        return False
+
+    @classmethod
+    def remaining(cls):
+        """Retourner le temps restant avant l'échéance (ou `None`)."""
+        stack = cls._stack()
+        value = stack and stack[-1] or None
+        if value is None:
+            return None
+        remaining = value - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded()
+        return remaining
+
+
+def remote_timeouts(connect=None, read=None):
+    """Retourner le couple (connexion, lecture) des délais d'attente
+    d'une requête, borné par l'échéance de l'opération en cours."""
+    connect = connect or REMOTE_CONNECT_TIMEOUT
+    read = read or REMOTE_READ_TIMEOUT
+    remaining = deadline.remaining()
+    if remaining is not None:
+        connect, read = min(connect, remaining), min(read, remaining)
+    return connect, read
+
+
 # Others stuffs
 
 
@@ -28,6 +28,7 @@ from django.db.models import CharField
 from django.db.models import Count
 from django.db.models import F
 from django.db.models import Func
+from django.db.models.functions import Coalesce
 from django.db.models.functions import Concat
 from django.db.models import Q
 from django.db.models import Value
@@ -39,7 +40,6 @@ from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from django.views import View
 
-from idgo_admin.ckan_module import CkanHandler
 from idgo_admin.exceptions import ExceptionsHandler
 from idgo_admin.exceptions import ProfileHttp404
 from idgo_admin.models import Dataset
@@ -108,10 +108,11 @@ IDGO_DIFFUSEUR_EMAIL = F('broadcaster_email')
 IDGO_COUV_TERR = F('granularity')
 IDGO_DATE_CREATION = F('date_creation')
 IDGO_RESSOURCE_TYPES = FORMAT_RESSOURCES
-IDGO_DATASET_VUES = Value('', output_field=CharField())
-IDGO_RESSOURCES_TELECHARGEMENT = Value('', output_field=CharField())
-IDGO_DATASET_NOTE = Value('', output_field=CharField())
-IDGO_DATASET_NB_NOTES = Value('', output_field=CharField())
+# Statistiques CKAN recopiées localement (cf. tâche `sync_ckan_statistics`)
+IDGO_DATASET_VUES = Coalesce(F('statistics__views'), Value(0))
+IDGO_RESSOURCES_TELECHARGEMENT = Coalesce(F('statistics__downloads'), Value(0))
+IDGO_DATASET_NOTE = F('statistics__rating')
+IDGO_DATASET_NB_NOTES = F('statistics__ratings_count')
 
 
 @method_decorator([csrf_exempt], name='dispatch')
@@ -247,18 +248,6 @@ class Export(View):
         writer = unicodecsv.writer(response, encoding='utf-8', quoting=csv.QUOTE_ALL, delimiter=',', quotechar='"')
         writer.writerow(values)
         for row in datasets.annotate(**annotate).values(*values):
-            if outputformat == 'odl-idgo-extent':
-                dataset_view = 0
-                resources_dl = 0
-                package = CkanHandler.get_package(str(row['ID']), include_tracking=True)
-                if 'tracking_summary' in package:
-                    dataset_view = package['tracking_summary'].get('total')
-                    resources_dl = package['tracking_summary'].get('download')
-                row['%s_DATASET_VUES' % PREFIX] = dataset_view
-                row['%s_RESSOURCES_TELECHARGEMENT' % PREFIX] = resources_dl
-                row['%s_DATASET_NOTE' % PREFIX] = package.get('rating')
-                row['%s_DATASET_NB_NOTES' % PREFIX] = package.get('ratings_count')
-
             writer.writerow([row[value] for value in values])
 
         return response
@@ -14,7 +14,7 @@
 # under the License.
 
 
-import operator
+from math import ceil
 import warnings
 
 from django.contrib.auth.decorators import login_required
@@ -35,6 +35,7 @@ from django.views import View
 from idgo_admin.exceptions import CriticalError
 from idgo_admin.exceptions import GenericException
 from idgo_admin.forms.organisation import OrganisationForm as Form
+from idgo_admin import harvest
 from idgo_admin.models import AccountActions
 from idgo_admin.models import BaseMaps
 from idgo_admin.models import Category
@@ -176,23 +177,54 @@ def handle_show_organisation(request, *args, **kwargs):
     return redirect('idgo_admin:show_organisation', id=id)
 
 
+# Nombre d'organisations affichées par page dans la liste de sélection
+ORGANISATIONS_PAGE_SIZE = 50
+
+
+def get_organisations_page(profile, q=None, offset=0, limit=ORGANISATIONS_PAGE_SIZE):
+    """Retourner le nombre total d'organisations (filtrées sur le nom par
+    `q`) et la page demandée, annotée des rôles du profil."""
+    queryset = Organisation.extras.get_with_roles(profile)
+    if q:
+        queryset = queryset.filter(legal_name__icontains=q)
+    organisations = queryset.values(
+        'pk', 'legal_name', 'member', 'contributor', 'referent')
+    return queryset.count(), list(organisations[offset:offset + limit])
+
+
+@login_required(login_url=LOGIN_URL)
+def search_organisations(request, *args, **kwargs):
+    """Rechercher les organisations par leur nom (liste de sélection)."""
+    try:
+        offset = max(int(request.GET.get('offset', 0)), 0)
+        limit = min(max(int(request.GET.get('limit', ORGANISATIONS_PAGE_SIZE)), 1), ORGANISATIONS_PAGE_SIZE)
+    except ValueError:
+        raise Http404()
+
+    total, organisations = get_organisations_page(
+        request.user.profile, q=request.GET.get('q'), offset=offset, limit=limit)
+
+    return JsonResponse(data={
+        'total': total,
+        'offset': offset,
+        'results': [{
+            'id': item['pk'],
+            'name': item['legal_name'],
+            'member': item['member'],
+            'contributor': item['contributor'],
+            'referent': item['referent'],
+            } for item in organisations],
+        })
+
+
 @login_required(login_url=LOGIN_URL)
 @csrf_exempt
 def show_organisation(request, id, *args, **kwargs):
     profile = request.user.profile
 
-    all_organisations = []
-    for instance in Organisation.objects.filter(is_active=True):
-        all_organisations.append({
-            'pk': instance.pk,
-            'legal_name': instance.legal_name,
-            'member': (instance == profile.organisation),
-            'contributor': (instance in profile.contribute_for),
-            'referent': profile.is_admin and True or (instance in profile.referent_for),
-            })
-    all_organisations.sort(key=operator.itemgetter('contributor'), reverse=True)
-    all_organisations.sort(key=operator.itemgetter('referent'), reverse=True)
-    all_organisations.sort(key=operator.itemgetter('member'), reverse=True)
+    # Seule la première page est affichée ; la suite et la recherche
+    # passent par `search_organisations`
+    organisations_total, all_organisations = get_organisations_page(profile)
 
     try:
         organisation = Organisation.objects.get(pk=id)
@@ -201,10 +233,37 @@ def show_organisation(request, id, *args, **kwargs):
 
     context = {
         'all_organisations': all_organisations,
+        'organisations_total': organisations_total,
         'basemaps': BaseMaps.objects.all(),
         'organisation': organisation,
         }
 
+    if organisation:
+        # Tri et pagination de la liste des membres
+        order_by = request.GET.get('sortby', 'username')
+        try:
+            page_number = int(request.GET.get('page', 1))
+            items_per_page = int(request.GET.get('count', 25))
+        except ValueError:
+            raise Http404()
+        if page_number < 1 or items_per_page < 1:
+            raise Http404()
+
+        total = organisation.get_members_profiles().count()
+        number_of_pages = ceil(total / items_per_page)
+        if number_of_pages < page_number:
+            page_number = 1
+
+        context.update({
+            'members': organisation.get_members_list(
+                ordering=order_by, limit=items_per_page,
+                offset=items_per_page * (page_number - 1)),
+            'members_pagination': {
+                'current': page_number,
+                'total': number_of_pages},
+            'members_total': total,
+            })
+
     return render(request, 'idgo_admin/organisation/show.html', context=context)
 
 
@@ -427,6 +486,50 @@ class Subscription(View):
         # TODO Supprimer AJAX et remplacer par `redirect('idgo_admin:show_organisation', id=id)`
 
 
+def render_harvest_preview(request, template, Model, Form, organisation, context, errors):
+    """Afficher l'aperçu du moissonnage sans rien enregistrer.
+
+    Si le catalogue distant n'est pas encore lié à l'organisation, l'aperçu
+    est construit à partir d'une instance non sauvegardée.
+    """
+    url = request.POST.get('url')
+    instance = Model.objects.filter(organisation=organisation, url=url).first() \
+        or Model(organisation=organisation, url=url)
+    if instance.pk:
+        context['instance'] = instance
+
+    form = Form(request.POST, instance=instance)
+    context['form'] = form
+    if not form.is_valid():
+        messages.error(request, form._errors.__str__())
+        return render(request, template, context=context)
+
+    for k, v in form.cleaned_data.items():
+        setattr(instance, k, v)
+    try:
+        context['preview'] = instance.preview()
+    except errors as e:
+        messages.error(request, e.__str__())
+    return render(request, template, context=context)
+
+
+def enqueue_harvest(request, instance):
+    """Planifier le moissonnage du catalogue distant ; l'utilisateur n'est
+    informé du moissonnage en cours qu'une fois la tâche envoyée."""
+    def on_sent():
+        messages.success(request, (
+            "Les informations de moissonnage ont été mises à jour. "
+            "Le moissonnage du catalogue est en cours."))
+
+    def on_error(e):
+        messages.error(request, (
+            "Les informations de moissonnage ont été mises à jour, mais "
+            "le moissonnage du catalogue n'a pu être planifié. "
+            "Veuillez réessayer ultérieurement."))
+
+    harvest.enqueue(instance, on_sent=on_sent, on_error=on_error)
+
+
 from idgo_admin import ENABLE_CKAN_HARVESTER  # noqa
 if ENABLE_CKAN_HARVESTER:
 
@@ -489,7 +592,15 @@ if ENABLE_CKAN_HARVESTER:
             if not (is_referent or is_admin):
                 raise Http404()
 
-            context = {'organisation': organisation}
+            context = {
+                'organisation': organisation,
+                'datasets': Dataset.harvested_ckan.filter(organisation=organisation),
+                }
+
+            if 'preview' in request.POST:
+                return render_harvest_preview(
+                    request, self.template, RemoteCkan, RemoteCkanForm,
+                    organisation, context, CkanBaseError)
 
             instance = None
             url = request.POST.get('url')
@@ -536,7 +647,7 @@ if ENABLE_CKAN_HARVESTER:
                 try:
                     # with transaction.atomic():
                     with warnings.catch_warnings(record=True) as caught_warnings:
-                        instance.save()
+                        instance.save(harvest=False)
                         for warn in caught_warnings:
                             messages.warning(request, str(warn.message))
                 except ValidationError as e:
@@ -556,10 +667,12 @@ if ENABLE_CKAN_HARVESTER:
                         Dataset.harvested_ckan.filter(organisation=organisation)
                     context['form'] = RemoteCkanForm(instance=instance)
                     if created:
-                        msg = "Veuillez indiquez les organisations distantes à moissonner."
+                        messages.success(request, "Veuillez indiquez les organisations distantes à moissonner.")
+                    elif instance.sync_with:
+                        # Le moissonnage est effectué en tâche de fond
+                        enqueue_harvest(request, instance)
                     else:
-                        msg = "Les informations de moissonnage ont été mises à jour."
-                    messages.success(request, msg)
+                        messages.success(request, "Les informations de moissonnage ont été mises à jour.")
 
             if 'continue' in request.POST or error:
                 namespace = 'idgo_admin:edit_remote_ckan_link'
@@ -684,7 +797,15 @@ if ENABLE_CSW_HARVESTER:
             if not (is_referent or is_admin):
                 raise Http404()
 
-            context = {'organisation': organisation}
+            context = {
+                'organisation': organisation,
+                'datasets': Dataset.harvested_csw.filter(organisation=organisation),
+                }
+
+            if 'preview' in request.POST:
+                return render_harvest_preview(
+                    request, self.template, RemoteCsw, RemoteCswForm,
+                    organisation, context, CswBaseError)
 
             url = request.POST.get('url')
             try:
@@ -709,12 +830,15 @@ if ENABLE_CSW_HARVESTER:
                 messages.error(request, form._errors.__str__())
                 return redirect('idgo_admin:edit_remote_csw_link', id=organisation.id)
 
+            # La tâche de fond relit l'instance : le changement de requête est constaté ici
+            previous_getrecords = RemoteCsw.objects.filter(
+                pk=instance.pk).values_list('getrecords', flat=True).first()
             for k, v in form.cleaned_data.items():
                 setattr(instance, k, v)
             try:
                 # with transaction.atomic():
                 with warnings.catch_warnings(record=True) as caught_warnings:
-                    instance.save(harvest=not created)
+                    instance.save(harvest=False)
                     for warn in caught_warnings:
                         messages.warning(request, str(warn.message))
             except ValidationError as e:
@@ -734,10 +858,12 @@ if ENABLE_CSW_HARVESTER:
                     Dataset.harvested_csw.filter(organisation=organisation)
                 context['form'] = RemoteCswForm(instance=instance)
                 if created:
-                    msg = "Veuillez indiquez une requête <strong>GetRecord</strong> avant moissonnage du service."
+                    messages.success(request, "Veuillez indiquez une requête <strong>GetRecord</strong> avant moissonnage du service.")
                 else:
-                    msg = "Les informations de moissonnage ont été mises à jour."
-                messages.success(request, msg)
+                    if (previous_getrecords or None) != (instance.getrecords or None):
+                        instance.reset_harvest()
+                    # Le moissonnage est effectué en tâche de fond
+                    enqueue_harvest(request, instance)
 
             if 'continue' in request.POST or error:
                 return render(
@@ -840,7 +966,15 @@ if ENABLE_DCAT_HARVESTER:
             if not (is_referent or is_admin):
                 raise Http404()
 
-            context = {'organisation': organisation}
+            context = {
+                'organisation': organisation,
+                'datasets': Dataset.harvested_dcat.filter(organisation=organisation),
+                }
+
+            if 'preview' in request.POST:
+                return render_harvest_preview(
+                    request, self.template, RemoteDcat, RemoteDcatForm,
+                    organisation, context, (DcatError, DcatTimeoutError))
 
             instance = None
             url = request.POST.get('url')
@@ -870,12 +1004,15 @@ if ENABLE_DCAT_HARVESTER:
                     return render(
                         request, self.template, context=context)
 
+                # La tâche de fond relit l'instance : le changement d'organisations est constaté ici
+                previous_sync_with = RemoteDcat.objects.filter(
+                    pk=instance.pk).values_list('sync_with', flat=True).first()
                 for k, v in form.cleaned_data.items():
                     setattr(instance, k, v)
                 try:
                     # with transaction.atomic():
                     with warnings.catch_warnings(record=True) as caught_warnings:
-                        instance.save(harvest=not created)
+                        instance.save(harvest=False)
                         for warn in caught_warnings:
                             messages.warning(request, str(warn.message))
                 except ValidationError as e:
@@ -895,10 +1032,14 @@ if ENABLE_DCAT_HARVESTER:
                         Dataset.harvested_dcat.filter(organisation=organisation)
                     context['form'] = RemoteDcatForm(instance=instance)
                     if created:
-                        msg = "Veuillez configurer les informations ci-dessous et poursuivre le moissonnage du catalogue."
+                        messages.success(request, "Veuillez configurer les informations ci-dessous et poursuivre le moissonnage du catalogue.")
+                    elif instance.sync_with:
+                        if (previous_sync_with or []) != (instance.sync_with or []):
+                            instance.reset_harvest()
+                        # Le moissonnage est effectué en tâche de fond
+                        enqueue_harvest(request, instance)
                     else:
-                        msg = "Les informations de moissonnage ont été mises à jour."
-                    messages.success(request, msg)
+                        messages.success(request, "Les informations de moissonnage ont été mises à jour.")
 
             if 'continue' in request.POST or error:
                 namespace = 'idgo_admin:edit_remote_dcat_link'
@@ -17,17 +17,20 @@
 import requests
 
 from django.contrib.auth.decorators import login_required
+from django.http import Http404
 from django.http import HttpResponse
 from django.http import JsonResponse
 from django.utils.decorators import method_decorator
 from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 
+from idgo_admin.metrics import metrics
 from idgo_admin.models import License
 
 from idgo_admin import LOGIN_URL
 from idgo_admin import OWS_PREVIEW_URL
 from idgo_admin import MAPSERV_TIMEOUT
+from idgo_admin import METRICS_ALLOWED_IPS
 
 
 @method_decorator([csrf_exempt], name='dispatch')
@@ -57,3 +60,11 @@ def ows_preview(request):
         OWS_PREVIEW_URL, params=dict(request.GET), timeout=MAPSERV_TIMEOUT)
     r.raise_for_status()
     return HttpResponse(r.content, content_type=r.headers['Content-Type'])
+
+
+def export_metrics(request):
+    """Exposer les mesures des appels aux services distants (Prometheus)."""
+    if request.META.get('REMOTE_ADDR') not in METRICS_ALLOWED_IPS \
+            and not request.user.is_staff:
+        raise Http404()
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4')